@@ -4,14 +4,29 @@ import logging
 import os
 import re
 import shutil
+import signal
 import subprocess
+import time
 
 from distutils import dir_util
+from multiprocessing import pool
 
+from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib import log
 from autotest_lib.client.cros import constants
 from autotest_lib.client.bin import utils, package
 
+_get_value = global_config.global_config.get_config_value
+# Number of loggables collected at the same time.
+_LOGGABLE_WORKERS = _get_value('CLIENT', 'sysinfo_loggable_workers', type=int,
+                               default=4)
+# Seconds a loggable may take before it is stopped and skipped.
+_LOGGABLE_TIMEOUT_SECS = _get_value('CLIENT', 'sysinfo_loggable_timeout_secs',
+                                    type=int, default=300)
+# Keyval file, in each sysinfo directory, with the seconds each loggable took.
+_LOGGABLE_SECONDS_KEYVAL = 'loggable_seconds'
+_BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+
 _DEFAULT_COMMANDS_TO_LOG_PER_TEST = []
 _DEFAULT_COMMANDS_TO_LOG_PER_BOOT = [
     'lspci -vvn',
@@ -74,6 +89,13 @@ class loggable(object):
         """
         raise NotImplementedError()
 
+    def stop(self):
+        """Stops a run that took too long, if the loggable supports it.
+
+        Loggables that cannot be stopped are left running in the background.
+        """
+        pass
+
 
 class logfile(loggable):
     """Represents a log file."""
@@ -173,19 +195,41 @@ class command(loggable):
         stdout = open(logf_path, "w")
         try:
             logging.debug('Loggable runs cmd: %s', self.cmd)
-            subprocess.call(self.cmd,
-                            stdin=stdin,
-                            stdout=stdout,
-                            stderr=stderr,
-                            shell=True,
-                            env=env)
+            # Run the command in its own process group, so that stop() also
+            # kills whatever the shell started.
+            self._process = subprocess.Popen(self.cmd,
+                                             stdin=stdin,
+                                             stdout=stdout,
+                                             stderr=stderr,
+                                             shell=True,
+                                             env=env,
+                                             preexec_fn=os.setsid)
+            self._process.wait()
         finally:
+            self._process = None
             for f in (stdin, stdout, stderr):
                 f.close()
             if self._compress_log and os.path.exists(logf_path):
                 utils.system('gzip -9 "%s"' % logf_path, ignore_status=True)
 
 
+    def stop(self):
+        """Kills the command, if it is running."""
+        process = getattr(self, '_process', None)
+        if process is None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_process', None)
+        return state
+
+
 class base_sysinfo(object):
     """Represents system info."""
     def __init__(self, job_resultsdir):
@@ -242,6 +286,7 @@ class base_sysinfo(object):
                                         logf='uname',
                                         log_in_keyval=True))
         self._installed_packages = []
+        self._installed_packages_boot_id = None
 
 
     def serialize(self):
@@ -285,6 +330,23 @@ class base_sysinfo(object):
             return os.path.join(self.sysinfodir, boot_dir)
 
 
+    def _list_installed_packages(self):
+        """Returns the installed packages, listing them once per boot.
+
+        Packages only change across tests when a test installs or removes
+        some, which log_after_each_test catches by refreshing the list.
+        """
+        try:
+            boot_id = utils.read_one_line(_BOOT_ID_FILE)
+        except IOError:
+            boot_id = None
+        cached_boot_id = getattr(self, '_installed_packages_boot_id', None)
+        if boot_id is None or boot_id != cached_boot_id:
+            self._installed_packages = package.list_all()
+            self._installed_packages_boot_id = boot_id
+        return self._installed_packages
+
+
     def _get_iteration_subdir(self, test, iteration):
         iter_dir = "iteration.%d" % iteration
 
@@ -306,8 +368,9 @@ class base_sysinfo(object):
                 logdir)
 
         # also log any installed packages
+        self._installed_packages_boot_id = None
         installed_path = os.path.join(logdir, "installed_packages")
-        installed_packages = "\n".join(package.list_all()) + "\n"
+        installed_packages = "\n".join(self._list_installed_packages()) + "\n"
         utils.open_write_close(installed_path, installed_packages)
 
 
@@ -317,7 +380,7 @@ class base_sysinfo(object):
 
         @param test: A test object.
         """
-        self._installed_packages = package.list_all()
+        self._list_installed_packages()
         if os.path.exists("/var/log/messages"):
             stat = os.stat("/var/log/messages")
             self._messages_size = stat.st_size
@@ -370,7 +433,9 @@ class base_sysinfo(object):
 
         # log any changes to installed packages
         old_packages = set(self._installed_packages)
-        new_packages = set(package.list_all())
+        # Refresh the cached list, so the next test starts from it.
+        self._installed_packages_boot_id = None
+        new_packages = set(self._list_installed_packages())
         added_path = os.path.join(test_sysinfodir, "added_packages")
         added_packages = "\n".join(new_packages - old_packages) + "\n"
         utils.open_write_close(added_path, added_packages)
@@ -492,19 +557,94 @@ class base_sysinfo(object):
         # return what we collected
         return keyval
 
-def _run_loggables_ignoring_errors(loggables, output_dir):
+
+def _run_loggable(log, output_dir, started):
+    """Runs a loggable, logging any exception.
+
+    @param log: A base_sysinfo.loggable object.
+    @param output_dir: Path to the output directory.
+    @param started: Dictionary the start time of the loggable is stored in.
+
+    @return: The number of seconds the loggable took.
+    """
+    started[log] = time.time()
+    try:
+        log.run(output_dir)
+    except Exception:
+        logging.exception(
+                'Failed to collect loggable %r to %s. Continuing...',
+                log, output_dir)
+    return time.time() - started[log]
+
+
+def _keyval_key(logf):
+    """Returns a keyval key for the seconds spent on a loggable."""
+    return re.sub(r'[^-.\w]', '_', logf.strip('/')) or '_'
+
+
+def _run_loggables_ignoring_errors(loggables, output_dir,
+                                   workers=None, timeout=None):
     """Runs the given loggables robustly.
 
-    In the event of any one of the loggables raising an exception, we print a
-    traceback and continue on.
+    Up to |workers| loggables run at the same time. In the event of any one
+    of the loggables raising an exception, we print a traceback and continue
+    on. A loggable still running after |timeout| seconds is stopped and
+    skipped. The seconds each loggable took are appended to the
+    _LOGGABLE_SECONDS_KEYVAL keyval file of output_dir.
 
     @param loggables: An iterable of base_sysinfo.loggable objects.
     @param output_dir: Path to the output directory.
+    @param workers: Number of loggables run at the same time, defaults to the
+                    sysinfo_loggable_workers config value.
+    @param timeout: Seconds after which a loggable is stopped, defaults to the
+                    sysinfo_loggable_timeout_secs config value. 0 means no
+                    timeout.
     """
-    for log in loggables:
-        try:
-            log.run(output_dir)
-        except Exception:
-            logging.exception(
-                    'Failed to collect loggable %r to %s. Continuing...',
-                    log, output_dir)
+    loggables = list(loggables)
+    if workers is None:
+        workers = _LOGGABLE_WORKERS
+    if timeout is None:
+        timeout = _LOGGABLE_TIMEOUT_SECS
+    workers = max(1, min(workers, len(loggables)))
+    started = {}
+    seconds = {}
+    if workers == 1 and not timeout:
+        for log in loggables:
+            seconds[log] = _run_loggable(log, output_dir, started)
+    else:
+        thread_pool = pool.ThreadPool(workers)
+        results = dict(
+                (log, thread_pool.apply_async(_run_loggable,
+                                              (log, output_dir, started)))
+                for log in loggables)
+        thread_pool.close()
+        # Bound the wait even if stuck loggables keep every worker busy.
+        deadline = time.time() + timeout * len(loggables) if timeout else None
+        while results:
+            for log, result in results.items():
+                if result.ready():
+                    seconds[log] = result.get()
+                    del results[log]
+                elif (timeout and log in started
+                      and time.time() - started[log] > timeout):
+                    logging.error('Loggable %r took more than %d seconds, '
+                                  'stopping it.', log, timeout)
+                    log.stop()
+                    seconds[log] = time.time() - started[log]
+                    del results[log]
+            if results and deadline and time.time() > deadline:
+                logging.error('Giving up on loggables %r, no worker was free '
+                              'to run them.', results.keys())
+                break
+            if results:
+                time.sleep(0.1)
+        # Workers stuck on a loggable that cannot be stopped are not joined,
+        # they exit with it.
+    try:
+        utils.write_keyval(
+                os.path.join(output_dir, _LOGGABLE_SECONDS_KEYVAL),
+                dict((_keyval_key(log.logf), '%.2f' % secs)
+                     for log, secs in seconds.iteritems()))
+    except (IOError, ValueError) as e:
+        logging.error('Failed to write loggable timings to %s: %s',
+                      output_dir, e)
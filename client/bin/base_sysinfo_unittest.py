@@ -1,6 +1,8 @@
 """Tests for base_sysinfo."""
 
 import mock
+import os
+import time
 import unittest
 
 import common
@@ -12,6 +14,13 @@ class LoggableTestException(Exception):
     """An exception thrown by the loggable used for testing."""
 
 
+def _mock_loggable(logf):
+    """Returns a mock loggable logging to |logf|."""
+    log = mock.create_autospec(base_sysinfo.loggable)
+    log.logf = logf
+    return log
+
+
 class BaseSysinfoTestCase(unittest.TestCase):
     """TestCase for free functions in the base_sysinfo module."""
 
@@ -19,28 +28,97 @@ class BaseSysinfoTestCase(unittest.TestCase):
         self._output_dir = autotemp.tempdir()
         self.addCleanup(self._output_dir.clean)
 
+    def _read_seconds_keyval(self):
+        path = os.path.join(self._output_dir.name,
+                            base_sysinfo._LOGGABLE_SECONDS_KEYVAL)
+        with open(path) as f:
+            return dict(line.strip().split('=', 1) for line in f)
+
     def test_run_loggables_with_no_exception(self):
         """Tests _run_loggables_ignoring_errors when no loggable throws"""
         loggables = {
-                mock.create_autospec(base_sysinfo.loggable),
-                mock.create_autospec(base_sysinfo.loggable),
+                _mock_loggable('log1'),
+                _mock_loggable('log2'),
         }
-        base_sysinfo._run_loggables_ignoring_errors(loggables, self._output_dir)
+        base_sysinfo._run_loggables_ignoring_errors(loggables,
+                                                    self._output_dir.name)
         for log in loggables:
-            log.run.assert_called_once_with(self._output_dir)
+            log.run.assert_called_once_with(self._output_dir.name)
 
     def test_run_loggables_with_exception(self):
         """Tests _run_loggables_ignoring_errors when one loggable throws"""
-        failing_loggable = mock.create_autospec(base_sysinfo.loggable)
+        failing_loggable = _mock_loggable('failing')
         failing_loggable.run.side_effect = LoggableTestException
         loggables = {
-                mock.create_autospec(base_sysinfo.loggable),
+                _mock_loggable('log1'),
                 failing_loggable,
-                mock.create_autospec(base_sysinfo.loggable),
+                _mock_loggable('log2'),
         }
-        base_sysinfo._run_loggables_ignoring_errors(loggables, self._output_dir)
+        base_sysinfo._run_loggables_ignoring_errors(loggables,
+                                                    self._output_dir.name)
         for log in loggables:
-            log.run.assert_called_once_with(self._output_dir)
+            log.run.assert_called_once_with(self._output_dir.name)
+
+    def test_run_loggables_concurrently(self):
+        """Tests loggables run concurrently and their timings are recorded"""
+        loggables = [_mock_loggable('/var/log/log%d' % i) for i in range(4)]
+        for log in loggables:
+            log.run.side_effect = lambda _: time.sleep(0.5)
+        start = time.time()
+        base_sysinfo._run_loggables_ignoring_errors(
+                loggables, self._output_dir.name, workers=4, timeout=0)
+        self.assertLess(time.time() - start, 1.5)
+        keyval = self._read_seconds_keyval()
+        self.assertEqual(sorted(keyval),
+                         ['var_log_log%d' % i for i in range(4)])
+        for seconds in keyval.itervalues():
+            self.assertGreaterEqual(float(seconds), 0.5)
+
+    def test_run_loggables_stops_slow_command(self):
+        """Tests a command running past the timeout is killed"""
+        slow = base_sysinfo.command('sleep 30', logf='slow')
+        fast = base_sysinfo.command('echo done', logf='fast')
+        start = time.time()
+        base_sysinfo._run_loggables_ignoring_errors(
+                [slow, fast], self._output_dir.name, workers=2, timeout=1)
+        self.assertLess(time.time() - start, 10)
+        with open(os.path.join(self._output_dir.name, 'fast')) as f:
+            self.assertEqual(f.read(), 'done\n')
+        self.assertEqual(sorted(self._read_seconds_keyval()),
+                         ['fast', 'slow'])
+
+
+class InstalledPackagesTestCase(unittest.TestCase):
+    """TestCase for the installed packages cache of base_sysinfo."""
+
+    def setUp(self):
+        self._results_dir = autotemp.tempdir()
+        self.addCleanup(self._results_dir.clean)
+        self._sysinfo = base_sysinfo.base_sysinfo(self._results_dir.name)
+        patcher = mock.patch.object(base_sysinfo.package, 'list_all',
+                                    return_value=['pkg-1'])
+        self._list_all = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(base_sysinfo.utils, 'read_one_line',
+                                    return_value='boot-1')
+        self._read_one_line = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_listed_once_per_boot(self):
+        """Tests packages are only listed again after a reboot"""
+        self.assertEqual(self._sysinfo._list_installed_packages(), ['pkg-1'])
+        self.assertEqual(self._sysinfo._list_installed_packages(), ['pkg-1'])
+        self.assertEqual(self._list_all.call_count, 1)
+        self._read_one_line.return_value = 'boot-2'
+        self._sysinfo._list_installed_packages()
+        self.assertEqual(self._list_all.call_count, 2)
+
+    def test_unknown_boot_id(self):
+        """Tests packages are always listed without a boot id"""
+        self._read_one_line.side_effect = IOError
+        self._sysinfo._list_installed_packages()
+        self._sysinfo._list_installed_packages()
+        self.assertEqual(self._list_all.call_count, 2)
 
 
 if __name__ == '__main__':
@@ -806,7 +806,12 @@ class base_client_job(base_job.base_job):
                     '_state', '_record_indent.%d' % os.getpid(),
                     base_record_indent, namespace='client')
                 self.__class__._record_indent = proc_local
-                task[0](*task[1:])
+                try:
+                    task[0](*task[1:])
+                finally:
+                    # the child exits through os._exit
+                    self._logger.flush()
+            self._logger.flush()
             pids.append(parallel.fork_start(self.resultdir, task_func))
 
         old_log_path = os.path.join(self.resultdir, old_log_filename)
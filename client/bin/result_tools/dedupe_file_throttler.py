@@ -11,7 +11,6 @@ prefix and remove files in the middle part.
 import os
 import re
 
-import result_info_lib
 import throttler_lib
 import utils_lib
 
@@ -32,22 +31,17 @@ NO_DEDUPE_FILE_PATTERNS = [
 # regex pattern to get the prefix of a file.
 PREFIX_PATTERN = '([a-zA-Z_-]*).*'
 
-def _group_by(file_infos, keys):
-    """Group the file infos by the given keys.
+def _group_by_parent_dir_and_prefix(file_infos):
+    """Group the file infos by their parent directory and name prefix.
 
     @param file_infos: A list of ResultInfo objects.
-    @param keys: A list of names of the attribute to group the file infos by.
-    @return: A dictionary of grouped_key: [ResultInfo].
+    @return: A dictionary of (parent_dir, prefix): [ResultInfo].
     """
     grouped_infos = {}
     for info in file_infos:
-        key_values = []
-        for key in keys:
-            key_values.append(getattr(info, key))
-        grouped_key = os.sep.join(key_values)
-        if grouped_key not in grouped_infos:
-            grouped_infos[grouped_key] = []
-        grouped_infos[grouped_key].append(info)
+        grouped_key = (os.path.dirname(info.path),
+                       re.match(PREFIX_PATTERN, info.name).group(1))
+        grouped_infos.setdefault(grouped_key, []).append(info)
     return grouped_infos
 
 
@@ -58,9 +52,9 @@ def _dedupe_files(summary, file_infos, max_result_size_KB):
     @param file_infos: A list of ResultInfo objects to be de-duplicated.
     @param max_result_size_KB: Maximum test result size in KB.
     """
-    # Sort file infos based on the modify date of the file.
-    file_infos.sort(
-            key=lambda f: result_info_lib.get_last_modification_time(f.path))
+    # Sort file infos based on the modify date of the file, as recorded when
+    # the summary was built.
+    file_infos.sort(key=lambda f: f.mtime)
     file_infos_to_delete = file_infos[
             OLDEST_FILES_TO_KEEP_COUNT:-NEWEST_FILES_TO_KEEP_COUNT]
 
@@ -86,14 +80,10 @@ def throttle(summary, max_result_size_KB):
         throttable_files = list(throttler_lib.get_throttleable_files(
                 grouped_files[pattern], NO_DEDUPE_FILE_PATTERNS))
 
-        for info in throttable_files:
-            info.parent_dir = os.path.dirname(info.path)
-            info.prefix = re.match(PREFIX_PATTERN, info.name).group(1)
-
         # Group files for each parent directory
-        grouped_infos = _group_by(throttable_files, ['parent_dir', 'prefix'])
+        grouped_infos = _group_by_parent_dir_and_prefix(throttable_files)
 
-        for infos in grouped_infos.values():
+        for (parent_dir, prefix), infos in grouped_infos.items():
             if (len(infos) <=
                 OLDEST_FILES_TO_KEEP_COUNT + NEWEST_FILES_TO_KEEP_COUNT):
                 # No need to dedupe if the count of file is too few.
@@ -101,7 +91,7 @@ def throttle(summary, max_result_size_KB):
 
             # Remove files can be deduped
             utils_lib.LOG('De-duplicating files in %s with the same prefix of '
-                          '"%s"' % (infos[0].parent_dir, infos[0].prefix))
+                          '"%s"' % (parent_dir, prefix))
             #dedupe_file_infos = [i.result_info for i in infos]
             _dedupe_files(summary, infos, max_result_size_KB)
 
@@ -82,10 +82,17 @@ class ResultInfo(dict):
                 ]
         }
     }
+
+    A result directory from a crash-heavy test can have 100k+ files, so the
+    class keeps no per-instance __dict__. Any new attribute must be added to
+    __slots__.
     """
 
+    __slots__ = ('_initialized', '_parent_result_info', '_name', '_details',
+                 '_path', '_is_dir', '_mtime', '_previous_collected_size')
+
     def __init__(self, parent_dir, name=None, parent_result_info=None,
-                 original_info=None):
+                 original_info=None, file_stat=None):
         """Initialize a collection of size information for a given result path.
 
         A ResultInfo object can be initialized in two ways:
@@ -107,6 +114,8 @@ class ResultInfo(dict):
                 which means a file's original size is 100 bytes, and trimmed
                 down to 50 bytes. This argument is used when the object is
                 restored from a json string.
+        @param file_stat: A result_info_lib.EntryStat of the result file, if
+                it's already known. Only used with `name`.
         """
         super(ResultInfo, self).__init__()
 
@@ -122,9 +131,12 @@ class ResultInfo(dict):
         # the size updates can reduce unnecessary calculations.
         self._initialized = False
         self._parent_result_info = parent_result_info
+        # Last modification time of the file when it was scanned. None if the
+        # result was restored from a json string.
+        self._mtime = None
 
         if original_info is None:
-            self._init_from_file(parent_dir, name)
+            self._init_from_file(parent_dir, name, file_stat)
         else:
             self._init_with_original_info(parent_dir, original_info)
 
@@ -132,11 +144,13 @@ class ResultInfo(dict):
         self._previous_collected_size = 0
         self._initialized = True
 
-    def _init_from_file(self, parent_dir, name):
+    def _init_from_file(self, parent_dir, name, file_stat=None):
         """Initialize with the physical file.
 
         @param parent_dir: Path to the parent directory.
         @param name: Name of the result file or directory.
+        @param file_stat: A result_info_lib.EntryStat of the file. It's read
+                from the file if not given.
         """
         assert name != None
         self._name = name
@@ -149,7 +163,10 @@ class ResultInfo(dict):
 
         # rstrip is to remove / when name is ROOT_DIR ('').
         self._path = os.path.join(parent_dir, self.name).rstrip(os.sep)
-        self._is_dir = os.path.isdir(self._path)
+        if file_stat is None:
+            file_stat = result_info_lib.get_entry_stat(self._path)
+        self._is_dir = file_stat.is_dir
+        self._mtime = file_stat.mtime
 
         if self.is_dir:
             # The value of key utils_lib.DIRS is a list of ResultInfo objects.
@@ -162,7 +179,7 @@ class ResultInfo(dict):
             # sub-directories are added.
             self.original_size = 0
         else:
-            self.original_size = self.size
+            self.original_size = file_stat.size
 
     def _init_with_original_info(self, parent_dir, original_info):
         """Initialize with pre-collected information.
@@ -268,31 +285,19 @@ class ResultInfo(dict):
             dir_info.add_file(os.path.basename(parent_dir))
             return dir_info
 
+        path = os.path.join(parent_dir, name)
+        file_stat = result_info_lib.get_entry_stat(path)
         dir_info = ResultInfo(parent_dir=parent_dir,
                               name=name,
-                              parent_result_info=parent_result_info)
+                              parent_result_info=parent_result_info,
+                              file_stat=file_stat)
 
-        path = os.path.join(parent_dir, name)
-        if os.path.isdir(path):
-            real_path = os.path.realpath(path)
-            # The assumption here is that results are copied back to drone by
-            # copying the symlink, not the content, which is true with currently
-            # used rsync in cros_host.get_file call.
-            # Skip scanning the child folders if any of following condition is
-            # true:
-            # 1. The directory is a symlink and link to a folder under `top_dir`
-            # 2. The directory was scanned already.
-            if ((os.path.islink(path) and real_path.startswith(top_dir)) or
-                real_path in all_dirs):
-                return dir_info
-            all_dirs.add(real_path)
-            for f in sorted(os.listdir(path)):
-                dir_info.files.append(ResultInfo.build_from_path(
-                        parent_dir=path,
-                        name=f,
-                        parent_result_info=dir_info,
-                        top_dir=top_dir,
-                        all_dirs=all_dirs))
+        if file_stat.is_dir:
+            real_path = ResultInfo._get_real_path_to_scan(
+                    path, None, file_stat, top_dir, all_dirs)
+            if real_path is not None:
+                ResultInfo._scan_dir(dir_info, path, real_path, top_dir,
+                                     all_dirs)
 
         # Update all directory's original size at the end of the tree building.
         if is_top_level:
@@ -300,6 +305,71 @@ class ResultInfo(dict):
 
         return dir_info
 
+    @staticmethod
+    def _get_real_path_to_scan(path, parent_real_path, file_stat, top_dir,
+                               all_dirs):
+        """Get the real path of a directory, if its content should be scanned.
+
+        The assumption here is that results are copied back to drone by
+        copying the symlink, not the content, which is true with currently
+        used rsync in cros_host.get_file call.
+        Scanning the child folders is skipped if any of following condition is
+        true:
+        1. The directory is a symlink and link to a folder under `top_dir`
+        2. The directory was scanned already.
+
+        @param path: Path to the directory.
+        @param parent_real_path: Real path of the parent directory, or None if
+                it's not known.
+        @param file_stat: A result_info_lib.EntryStat of the directory.
+        @param top_dir: The top directory to collect ResultInfo.
+        @param all_dirs: A set of real paths that have been scanned. The real
+                path of the directory is added to it if it should be scanned.
+        @return: The real path of the directory, or None if the directory
+                should not be scanned.
+        """
+        if file_stat.is_link or parent_real_path is None:
+            real_path = os.path.realpath(path)
+        else:
+            # A directory that is not a symlink resolves under its parent's
+            # real path, so its path components don't need to be walked again.
+            real_path = os.path.join(parent_real_path,
+                                     os.path.basename(path))
+        if ((file_stat.is_link and real_path.startswith(top_dir)) or
+            real_path in all_dirs):
+            return None
+        all_dirs.add(real_path)
+        return real_path
+
+    @staticmethod
+    def _scan_dir(dir_info, path, real_path, top_dir, all_dirs):
+        """Add ResultInfo of all the files under a directory, recursively.
+
+        Each entry is only stat-ed once, and its type, size and modification
+        time are all taken from that stat.
+
+        @param dir_info: A ResultInfo of the directory.
+        @param path: Path to the directory.
+        @param real_path: Real path of the directory.
+        @param top_dir: The top directory to collect ResultInfo.
+        @param all_dirs: A set of real paths that have been scanned.
+        """
+        for f in sorted(os.listdir(path)):
+            file_path = os.path.join(path, f)
+            file_stat = result_info_lib.get_entry_stat(file_path)
+            file_info = ResultInfo(parent_dir=path,
+                                   name=f,
+                                   parent_result_info=dir_info,
+                                   file_stat=file_stat)
+            dir_info.files.append(file_info)
+            if not file_stat.is_dir:
+                continue
+            file_real_path = ResultInfo._get_real_path_to_scan(
+                    file_path, real_path, file_stat, top_dir, all_dirs)
+            if file_real_path is not None:
+                ResultInfo._scan_dir(file_info, file_path, file_real_path,
+                                     top_dir, all_dirs)
+
     @property
     def details(self):
         """Get the details of the result.
@@ -326,6 +396,17 @@ class ResultInfo(dict):
         """
         return self._path
 
+    @property
+    def mtime(self):
+        """Last modification time of the result, as a unix timestamp.
+
+        The time read when the result was scanned is used, so sorting results
+        by it doesn't stat the files again.
+        """
+        if self._mtime is None:
+            return result_info_lib.get_last_modification_time(self._path)
+        return self._mtime
+
     @property
     def files(self):
         """All files or sub-directories of the result.
@@ -511,7 +592,7 @@ class ResultInfo(dict):
                     f.original_size for f in self.files])
         elif self.original_size is None:
             # Only set original_size if it's not initialized yet.
-            self.orginal_size = self.size
+            self.original_size = self.size
 
         # Update the size of parent result infos.
         if not skip_parent_update and self._parent_result_info is not None:
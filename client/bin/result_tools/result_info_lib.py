@@ -5,7 +5,9 @@
 """Module for helper methods related to ResultInfo.
 """
 
+import collections
 import os
+import stat as stat_lib
 
 
 def _get_file_stat(path):
@@ -40,3 +42,35 @@ def get_last_modification_time(path):
     """
     stat = _get_file_stat(path)
     return stat.st_mtime if stat else 0
+
+
+# Type, size and modification time of a result file, see get_entry_stat.
+EntryStat = collections.namedtuple('EntryStat',
+                                   ['is_dir', 'is_link', 'size', 'mtime'])
+# EntryStat of a path that doesn't exist.
+MISSING_ENTRY_STAT = EntryStat(False, False, 0, 0)
+
+
+def get_entry_stat(path):
+    """Get the type, size and last modification time of the given path.
+
+    This replaces separate os.path.isdir, os.path.islink and os.stat calls
+    with a single lstat. Like those, it describes the target of a symlink,
+    which costs a second stat for symlinks only.
+
+    @param path: Path to the file or directory.
+    @return: An EntryStat of the path. MISSING_ENTRY_STAT if the path doesn't
+            exist.
+    """
+    try:
+        stat = os.lstat(path)
+    except OSError:
+        return MISSING_ENTRY_STAT
+    is_link = stat_lib.S_ISLNK(stat.st_mode)
+    if is_link:
+        stat = _get_file_stat(path)
+        if stat is None:
+            # Broken symlink.
+            return EntryStat(False, True, 0, 0)
+    return EntryStat(stat_lib.S_ISDIR(stat.st_mode), is_link, stat.st_size,
+                     stat.st_mtime)
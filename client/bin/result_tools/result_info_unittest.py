@@ -140,6 +140,33 @@ class ResultInfoUnittest(unittest.TestCase):
         summary = result_info.ResultInfo.build_from_path(file1)
         self.assertEqual(_EXPECTED_SINGLE_FILE_SUMMARY, summary)
 
+    def testBuildFromPath_StatOnce(self):
+        """Test build_from_path records the mtime and follows symlinks."""
+        folder1 = os.path.join(self.test_dir, 'folder1')
+        os.mkdir(folder1)
+        file1 = os.path.join(folder1, 'file1')
+        unittest_lib.create_file(file1)
+        os.utime(file1, (1000, 1000))
+        os.symlink(file1, os.path.join(self.test_dir, 'link1'))
+        os.symlink(folder1, os.path.join(self.test_dir, 'link2'))
+        os.symlink('missing', os.path.join(self.test_dir, 'link3'))
+
+        summary = result_info.ResultInfo.build_from_path(self.test_dir)
+        file1_info = summary.get_file('folder1').get_file('file1')
+        self.assertEqual(file1_info.mtime, 1000)
+        # Files are not stat-ed again for their mtime.
+        os.utime(file1, (2000, 2000))
+        self.assertEqual(file1_info.mtime, 1000)
+
+        self.assertEqual(summary.get_file('link1').original_size,
+                         unittest_lib.SIZE)
+        # A symlink to a folder under the result directory is not scanned.
+        self.assertEqual(summary.get_file('link2').files, [])
+        self.assertFalse(summary.get_file('link3').is_dir)
+        self.assertEqual(summary.get_file('link3').original_size, 0)
+        self.assertEqual(summary.original_size, 2 * unittest_lib.SIZE)
+        self.assertFalse(hasattr(summary, '__dict__'))
+
 
 # this is so the test can be run in standalone mode
 if __name__ == '__main__':
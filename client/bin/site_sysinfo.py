@@ -4,6 +4,9 @@
 
 import logging
 import os
+import shutil
+import stat
+import time
 
 from autotest_lib.client.common_lib import log
 from autotest_lib.client.common_lib import error, utils, global_config
@@ -14,6 +17,13 @@ get_value = global_config.global_config.get_config_value
 collect_corefiles = get_value('CLIENT', 'collect_corefiles',
                               type=bool, default=False)
 
+# Size of the buffer used to copy new log data.
+_COPY_BUFFER_BYTES = 1024 * 1024
+# A directory mtime this close to the time of the scan may still change without
+# the change being visible in the mtime. Such directories are listed again on
+# the next scan.
+_RACY_MTIME_SECS = 2
+
 
 logfile = base_sysinfo.logfile
 command = base_sysinfo.command
@@ -118,22 +128,6 @@ class logdir(base_sysinfo.loggable):
             self.additional_exclude = None
 
 
-class file_stat(object):
-    """Store the file size and inode, used for retrieving new data in file."""
-    def __init__(self, file_path):
-        """Collect the size and inode information of a file.
-
-        @param file_path: full path to the file.
-
-        """
-        stat = os.stat(file_path)
-        # Start size of the file, skip that amount of bytes when do diff.
-        self.st_size = stat.st_size
-        # inode of the file. If inode is changed, treat this as a new file and
-        # copy the whole file.
-        self.st_ino = stat.st_ino
-
-
 class diffable_logdir(logdir):
     """Represents a log directory that only new content will be copied.
 
@@ -161,8 +155,19 @@ class diffable_logdir(logdir):
         super(diffable_logdir, self).__init__(directory, excludes)
         self.keep_file_hierarchy = keep_file_hierarchy
         self.append_diff_in_name = append_diff_in_name
-        # Init dictionary to store all file status for files in the directory.
+        # Maps the (st_dev, st_ino) of each file in the directory to its size
+        # when the initial status was collected.
         self._log_stats = {}
+        # Maps each directory scanned to a tuple (mtime, subdirs, files) of
+        # its last listing.
+        self._dir_listings = {}
+
+
+    def __setstate__(self, state):
+        """Unpickle handler, see logdir.__setstate__."""
+        super(diffable_logdir, self).__setstate__(state)
+        if '_dir_listings' not in state:
+            self._dir_listings = {}
 
 
     def _get_init_status_of_src_dir(self, src_dir):
@@ -171,50 +176,99 @@ class diffable_logdir(logdir):
         @param src_dir: directory to be diff-ed.
 
         """
-        # Dictionary used to store the initial status of files in src_dir.
-        for file_path in self._get_all_files(src_dir):
-            self._log_stats[file_path] = file_stat(file_path)
+        self._log_stats = dict(((st.st_dev, st.st_ino), st.st_size)
+                               for _, st in self._get_all_files(src_dir))
         self.file_stats_collected = True
 
 
+    def _list_dir(self, path):
+        """List a directory, reusing its previous listing if it is unchanged.
+
+        @param path: directory to list.
+        @return: a tuple (subdirs, files), where subdirs are the paths of the
+            subdirectories to descend into and files is a list of tuples
+            (file path, os.stat result or None).
+
+        """
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return [], []
+        listing = self._dir_listings.get(path)
+        if listing and listing[0] == mtime:
+            return listing[1], [(f, None) for f in listing[2]]
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return [], []
+        subdirs = []
+        files = []
+        for name in names:
+            entry = os.path.join(path, name)
+            try:
+                entry_stat = os.stat(entry)
+            except OSError:
+                continue
+            if stat.S_ISDIR(entry_stat.st_mode):
+                # Like os.walk, do not descend into symlinked directories.
+                if not os.path.islink(entry):
+                    subdirs.append(entry)
+            elif not name.startswith('autoserv'):
+                files.append((entry, entry_stat))
+        if time.time() - mtime > _RACY_MTIME_SECS:
+            self._dir_listings[path] = (mtime, subdirs, [f for f, _ in files])
+        else:
+            self._dir_listings.pop(path, None)
+        return subdirs, files
+
+
     def _get_all_files(self, path):
         """Iterate through files in given path including subdirectories.
 
+        Directories that did not change since the previous scan are not listed
+        again, so a scan costs one stat per file and directory.
+
         @param path: root directory.
-        @return: an iterator that iterates through all files in given path
-            including subdirectories.
+        @return: an iterator of tuples (file path, os.stat result) of the files
+            in given path including subdirectories.
 
         """
-        if not os.path.exists(path):
-            yield []
-        for root, dirs, files in os.walk(path):
-            for f in files:
-                if f.startswith('autoserv'):
-                    continue
-                yield os.path.join(root, f)
-
-
-    def _copy_new_data_in_file(self, file_path, src_dir, dest_dir):
+        pending = [path]
+        while pending:
+            subdirs, files = self._list_dir(pending.pop())
+            pending.extend(subdirs)
+            for file_path, file_stat in files:
+                if file_stat is None:
+                    try:
+                        file_stat = os.stat(file_path)
+                    except OSError:
+                        continue
+                yield file_path, file_stat
+
+
+    def _copy_new_data_in_file(self, file_path, src_dir, dest_dir,
+                               file_stat=None):
         """Copy all new data in a file to target directory.
 
         @param file_path: full path to the file to be copied.
         @param src_dir: source directory to do the diff.
         @param dest_dir: target directory to store new data of src_dir.
+        @param file_stat: os.stat result of file_path, if already known.
 
         """
+        if file_stat is None:
+            file_stat = os.stat(file_path)
         bytes_to_skip = 0
-        if self._log_stats.has_key(file_path):
-            prev_stat = self._log_stats[file_path]
-            new_stat = os.stat(file_path)
-            if new_stat.st_ino == prev_stat.st_ino:
-                bytes_to_skip = prev_stat.st_size
-            if new_stat.st_size == bytes_to_skip:
+        key = (file_stat.st_dev, file_stat.st_ino)
+        if key in self._log_stats:
+            bytes_to_skip = self._log_stats[key]
+            if file_stat.st_size == bytes_to_skip:
                 return
-            elif new_stat.st_size < prev_stat.st_size:
+            elif file_stat.st_size < bytes_to_skip:
                 # File is modified to a smaller size, copy whole file.
                 bytes_to_skip = 0
         try:
-            with open(file_path, 'r') as in_log:
+            with open(file_path, 'rb') as in_log:
                 if bytes_to_skip > 0:
                     in_log.seek(bytes_to_skip)
                 # Skip src_dir in path, e.g., src_dir/[sub_dir]/file_name.
@@ -223,8 +277,8 @@ class diffable_logdir(logdir):
                 target_dir = os.path.dirname(target_path)
                 if not os.path.exists(target_dir):
                     os.makedirs(target_dir)
-                with open(target_path, "w") as out_log:
-                    out_log.write(in_log.read())
+                with open(target_path, 'wb') as out_log:
+                    shutil.copyfileobj(in_log, out_log, _COPY_BUFFER_BYTES)
         except IOError as e:
             logging.error('Diff %s failed with error: %s', file_path, e)
 
@@ -245,8 +299,8 @@ class diffable_logdir(logdir):
         if not os.path.exists(dest_dir):
             os.makedirs(dest_dir)
 
-        for src_file in self._get_all_files(src_dir):
-            self._copy_new_data_in_file(src_file, src_dir, dest_dir)
+        for src_file, src_stat in self._get_all_files(src_dir):
+            self._copy_new_data_in_file(src_file, src_dir, dest_dir, src_stat)
 
 
     def run(self, log_dir, collect_init_status=True, collect_all=False):
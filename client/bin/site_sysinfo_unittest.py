@@ -5,10 +5,12 @@
 __author__ = 'dshi@google.com (Dan Shi)'
 
 import cPickle as pickle
+import mock
 import os
 import random
 import shutil
 import tempfile
+import time
 import unittest
 
 import common
@@ -99,6 +101,44 @@ class diffable_logdir_test(unittest.TestCase):
                 self.assertEqual(file_name, f.read())
 
 
+    def test_diffable_logdir_rotated_file(self):
+        """Test only new data is copied from a renamed log file."""
+        info = site_sysinfo.diffable_logdir(self.src_dir,
+                                            keep_file_hierarchy=False,
+                                            append_diff_in_name=False)
+        info.run(log_dir=None, collect_init_status=True)
+        existing_file_0 = self.existing_files_path[0]
+        self.append_text_to_file('new data', existing_file_0)
+        os.rename(existing_file_0, existing_file_0 + '.1')
+        info.run(self.dest_dir, collect_init_status=False)
+
+        rotated_path = existing_file_0.replace('src', 'dest') + '.1'
+        with open(rotated_path, 'r') as f:
+            self.assertEqual('new data', f.read())
+        self.assertFalse(os.path.exists(
+                self.existing_files_path[1].replace('src', 'dest')))
+
+
+    def test_unchanged_directory_not_listed(self):
+        """Test a directory is only listed again once it changed."""
+        old = time.time() - 60
+        for folder in self.existing_files_folder:
+            os.utime(os.path.join(self.src_dir, folder), (old, old))
+        info = site_sysinfo.diffable_logdir(self.src_dir)
+        info.run(log_dir=None, collect_init_status=True)
+
+        real_listdir = os.listdir
+        with mock.patch.object(os, 'listdir') as listdir:
+            listdir.side_effect = real_listdir
+            self.append_text_to_file('more', self.existing_files_path[2])
+            self.assertEqual(len(list(info._get_all_files(self.src_dir))), 3)
+            self.assertEqual(listdir.call_count, 0)
+            self.append_text_to_file('new', self.new_files_path[0])
+            self.assertEqual(len(list(info._get_all_files(self.src_dir))), 4)
+            listdir.assert_called_once_with(
+                    os.path.join(self.src_dir, 'sub'))
+
+
 class LogdirTestCase(unittest.TestCase):
     """Tests logdir.run"""
 
@@ -1,5 +1,7 @@
 # pylint: disable=missing-docstring
 
+import atexit
+import collections
 import cPickle as pickle
 import copy
 import errno
@@ -8,6 +10,7 @@ import logging
 import os
 import re
 import tempfile
+import threading
 import time
 import traceback
 import weakref
@@ -182,10 +185,19 @@ class job_state(object):
     as names. Additionally, the namespace 'stateful_property' is used for
     storing the valued associated with properties constructed using the
     property_factory method.
+
+    A state file holds a pickled dictionary of the whole state, optionally
+    followed by a journal of pickled changes appended since the dictionary
+    was written. The in-memory state is only refreshed from the backing file
+    when the file changed since this instance last read or wrote it, and
+    changes are appended to the journal instead of rewriting the whole file.
+    Once the journal grows past JOURNAL_COMPACT_RECORDS records the file is
+    compacted, by atomically replacing it with a fresh pickle of the state.
     """
 
     NO_DEFAULT = object()
     PICKLE_PROTOCOL = 2  # highest protocol available in python 2.4
+    JOURNAL_COMPACT_RECORDS = 256
 
 
     def __init__(self):
@@ -194,13 +206,35 @@ class job_state(object):
         self._backing_file = None
         self._backing_file_initialized = False
         self._backing_file_lock = None
+        # (dev, inode, size, mtime, ctime) of the backing file as of the last
+        # time it was read or written, or None if it has to be read again.
+        self._backing_file_signature = None
+        self._journal_records = 0
+        # Set when the backing file has to be rewritten from scratch, e.g.
+        # after the in-memory state was replaced by read_from_file.
+        self._backing_file_needs_compaction = True
+        self._pending_records = []
 
 
     def _lock_backing_file(self):
         """Acquire a lock on the backing file."""
         if self._backing_file:
-            self._backing_file_lock = open(self._backing_file, 'a')
-            fcntl.flock(self._backing_file_lock, fcntl.LOCK_EX)
+            while True:
+                lock_file = open(self._backing_file, 'a')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # The file may have been replaced by a compaction while we
+                # were waiting for the lock, in which case we hold a lock on
+                # a file no one else will ever look at again.
+                try:
+                    replaced = (os.fstat(lock_file.fileno()).st_ino !=
+                                os.stat(self._backing_file).st_ino)
+                except OSError:
+                    replaced = True
+                if not replaced:
+                    self._backing_file_lock = lock_file
+                    return
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
 
 
     def _unlock_backing_file(self):
@@ -211,6 +245,98 @@ class job_state(object):
             self._backing_file_lock = None
 
 
+    @staticmethod
+    def _apply_journal_record(state, record):
+        """Apply a single journal record to a state dictionary.
+
+        @param state: The state dictionary to update.
+        @param record: A tuple whose first item is the name of the operation
+            (set, discard or discard_namespace) and whose other items are its
+            arguments.
+        """
+        if record[0] == 'set':
+            _, namespace, name, value = record
+            state.setdefault(namespace, {})[name] = value
+        elif record[0] == 'discard':
+            _, namespace, name = record
+            namespace_dict = state.get(namespace, {})
+            namespace_dict.pop(name, None)
+            if not namespace_dict:
+                state.pop(namespace, None)
+        elif record[0] == 'discard_namespace':
+            state.pop(record[1], None)
+        else:
+            raise ValueError('Unknown state journal record %r' % (record,))
+
+
+    @classmethod
+    def _load_state_file(cls, file_path):
+        """Load the state stored in a state file.
+
+        A journal record that cannot be loaded, as left behind by a write that
+        was interrupted by a crash or a reboot, is ignored along with anything
+        following it.
+
+        @param file_path: The path of the state file. It must exist but it can
+            be empty.
+
+        @return: A tuple (state, journal_records, complete), where state is
+            the state dictionary, journal_records the number of journal
+            records that were applied to it and complete is False if the end
+            of the file could not be loaded.
+        """
+        state_file = open(file_path, 'rb')
+        try:
+            unpickler = pickle.Unpickler(state_file)
+            try:
+                state = unpickler.load()
+            except EOFError:
+                return {}, 0, True
+            journal_records = 0
+            while True:
+                offset = state_file.tell()
+                try:
+                    record = unpickler.load()
+                except EOFError:
+                    complete = state_file.tell() == offset
+                    break
+                except Exception:
+                    complete = False
+                    break
+                cls._apply_journal_record(state, record)
+                journal_records += 1
+            if not complete:
+                logging.warning('Ignoring a truncated record at offset %d of '
+                                'state file %s', offset, file_path)
+            return state, journal_records, complete
+        finally:
+            state_file.close()
+
+
+    def _merge_state(self, on_disk_state, file_path):
+        """Merge a state dictionary read from file_path into self._state.
+
+        @param on_disk_state: The state dictionary to merge.
+        @param file_path: The path it was read from, for logging.
+        """
+        for namespace, namespace_dict in on_disk_state.iteritems():
+            in_memory_namespace = self._state.setdefault(namespace, {})
+            for name, value in namespace_dict.iteritems():
+                if name in in_memory_namespace:
+                    if in_memory_namespace[name] != value:
+                        logging.info('Persistent value of %s.%s from %s '
+                                     'overridding existing in-memory '
+                                     'value', namespace, name, file_path)
+                        in_memory_namespace[name] = value
+                    else:
+                        logging.debug('Value of %s.%s is unchanged, '
+                                      'skipping import', namespace, name)
+                else:
+                    logging.debug('Importing %s.%s from state file %s',
+                                  namespace, name, file_path)
+                    in_memory_namespace[name] = value
+
+
     def read_from_file(self, file_path, merge=True):
         """Read in any state from the file at file_path.
 
@@ -227,36 +353,15 @@ class job_state(object):
         @warning: This method is intentionally concurrency-unsafe. It makes no
             attempt to control concurrent access to the file at file_path.
         """
-
-        # we can assume that the file exists
-        if os.path.getsize(file_path) == 0:
-            on_disk_state = {}
-        else:
-            on_disk_state = pickle.load(open(file_path))
-
+        on_disk_state = self._load_state_file(file_path)[0]
         if merge:
-            # merge the on-disk state with the in-memory state
-            for namespace, namespace_dict in on_disk_state.iteritems():
-                in_memory_namespace = self._state.setdefault(namespace, {})
-                for name, value in namespace_dict.iteritems():
-                    if name in in_memory_namespace:
-                        if in_memory_namespace[name] != value:
-                            logging.info('Persistent value of %s.%s from %s '
-                                         'overridding existing in-memory '
-                                         'value', namespace, name, file_path)
-                            in_memory_namespace[name] = value
-                        else:
-                            logging.debug('Value of %s.%s is unchanged, '
-                                          'skipping import', namespace, name)
-                    else:
-                        logging.debug('Importing %s.%s from state file %s',
-                                      namespace, name, file_path)
-                        in_memory_namespace[name] = value
+            self._merge_state(on_disk_state, file_path)
         else:
             # just replace the in-memory state with the on-disk state
             self._state = on_disk_state
 
         # lock the backing file before we refresh it
+        self._backing_file_needs_compaction = True
         with_backing_lock(self.__class__._write_to_backing_file)(self)
 
 
@@ -276,23 +381,78 @@ class job_state(object):
             outfile.close()
 
 
+    def _get_backing_file_signature(self):
+        """Return a tuple identifying the contents of the backing file.
+
+        @return: A tuple that changes whenever the file is written to or
+            replaced, or None if it cannot be stat'ed.
+        """
+        try:
+            st = os.stat(self._backing_file)
+        except OSError:
+            return None
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime, st.st_ctime
+
+
     def _read_from_backing_file(self):
         """Refresh the current state from the backing file.
 
         If the backing file has never been read before (indicated by checking
         self._backing_file_initialized) it will merge the file with the
-        in-memory state, rather than overwriting it.
+        in-memory state, rather than overwriting it. Otherwise the file is only
+        read if it changed since it was last read or written by this instance.
         """
-        if self._backing_file:
-            merge_backing_file = not self._backing_file_initialized
-            self.read_from_file(self._backing_file, merge=merge_backing_file)
+        if not self._backing_file:
+            return
+        signature = self._get_backing_file_signature()
+        if (self._backing_file_initialized and signature is not None and
+                signature == self._backing_file_signature):
+            return
+        on_disk_state, self._journal_records, complete = (
+                self._load_state_file(self._backing_file))
+        if self._backing_file_initialized:
+            self._state = on_disk_state
+        else:
+            self._merge_state(on_disk_state, self._backing_file)
+            # the in-memory state may hold values the file does not have
+            self._backing_file_needs_compaction = True
             self._backing_file_initialized = True
+        if not complete:
+            # don't append anything behind a truncated record
+            self._backing_file_needs_compaction = True
+        self._backing_file_signature = signature
 
 
     def _write_to_backing_file(self):
-        """Flush the current state to the backing file."""
-        if self._backing_file:
-            self.write_to_file(self._backing_file)
+        """Flush the current state to the backing file.
+
+        Pending changes are appended to the journal of the backing file, unless
+        it needs to be compacted, in which case the whole state is rewritten
+        into a new file that atomically replaces the backing file.
+        """
+        pending_records, self._pending_records = self._pending_records, []
+        if not self._backing_file:
+            return
+        if (not self._backing_file_needs_compaction and
+                self._journal_records + len(pending_records) >
+                self.JOURNAL_COMPACT_RECORDS):
+            self._backing_file_needs_compaction = True
+
+        if self._backing_file_needs_compaction:
+            temp_path = self._backing_file + '.tmp'
+            self.write_to_file(temp_path)
+            with open(temp_path, 'a') as temp_file:
+                os.fsync(temp_file.fileno())
+            os.rename(temp_path, self._backing_file)
+            self._journal_records = 0
+            self._backing_file_needs_compaction = False
+        elif pending_records:
+            data = ''.join(pickle.dumps(record, self.PICKLE_PROTOCOL)
+                           for record in pending_records)
+            with open(self._backing_file, 'ab') as backing_file:
+                backing_file.write(data)
+            self._journal_records += len(pending_records)
+        self._backing_file_signature = self._get_backing_file_signature()
 
 
     @with_backing_file
@@ -317,6 +477,8 @@ class job_state(object):
         self._synchronize_backing_file()
         self._backing_file = file_path
         self._backing_file_initialized = False
+        self._backing_file_signature = None
+        self._journal_records = 0
         self._synchronize_backing_file()
 
 
@@ -353,6 +515,8 @@ class job_state(object):
         """
         namespace_dict = self._state.setdefault(namespace, {})
         namespace_dict[name] = copy.deepcopy(value)
+        self._pending_records.append(
+                ('set', namespace, name, namespace_dict[name]))
         logging.debug('Persistent state %s.%s now set to %r', namespace,
                       name, value)
 
@@ -381,6 +545,7 @@ class job_state(object):
             del self._state[namespace][name]
             if len(self._state[namespace]) == 0:
                 del self._state[namespace]
+            self._pending_records.append(('discard', namespace, name))
             logging.debug('Persistent state %s.%s deleted', namespace, name)
         else:
             logging.debug(
@@ -396,6 +561,7 @@ class job_state(object):
         """
         if namespace in self._state:
             del self._state[namespace]
+            self._pending_records.append(('discard_namespace', namespace))
         logging.debug('Persistent state %s.* deleted', namespace)
 
 
@@ -596,15 +762,42 @@ class status_indenter(object):
         """Decrease indentation by one level."""
 
 
+# status loggers that may hold buffered entries, flushed at exit
+_status_loggers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_status_loggers():
+    """Flush the buffered entries of all the live status loggers."""
+    for logger in list(_status_loggers):
+        try:
+            logger.flush()
+        except Exception:
+            logging.exception('Failed to flush status logs at exit')
+
+
 class status_logger(object):
     """Represents a status log file. Responsible for translating messages
     into on-disk status log lines.
 
+    The log files are kept open between entries (up to MAX_OPEN_FILES of
+    them) instead of being opened and closed for every entry. By default
+    every entry is written out as soon as it is recorded; with a
+    flush_interval, entries are buffered and written out at most once per
+    interval, and by flush() and close(). Buffered entries are also flushed
+    when the process exits normally, but callers that fork must flush()
+    before forking and children that leave through os._exit must flush()
+    themselves, or entries may be reordered or lost.
+
     @property global_filename: The filename to write top-level logs to.
     @property subdir_filename: The filename to write subdir-level logs to.
     """
+    MAX_OPEN_FILES = 32
+
+
     def __init__(self, job, indenter, global_filename='status',
-                 subdir_filename='status', record_hook=None):
+                 subdir_filename='status', record_hook=None,
+                 flush_interval=0, fsync=False):
         """Construct a logger instance.
 
         @param job: A reference to the job object this is logging for. Only a
@@ -619,12 +812,27 @@ class status_logger(object):
         @param record_hook: An optional function to be called before an entry
             is logged. The function should expect a single parameter, a
             copy of the status_log_entry object.
+        @param flush_interval: The minimum number of seconds between two
+            writes of buffered entries to the log files. 0 writes every entry
+            out as soon as it is recorded.
+        @param fsync: If True, fsync the log files every time entries are
+            written out to them.
         """
         self._jobref = weakref.ref(job)
         self._indenter = indenter
         self.global_filename = global_filename
         self.subdir_filename = subdir_filename
         self._record_hook = record_hook
+        self._flush_interval = flush_interval
+        self._fsync = fsync
+        self._lock = threading.Lock()
+        # the process that opened self._open_files and buffered the entries
+        self._owner_pid = os.getpid()
+        self._open_files = collections.OrderedDict()
+        # maps a log file path to the list of buffered lines for that file
+        self._pending_lines = collections.OrderedDict()
+        self._last_flush_time = time.time()
+        _status_loggers.add(self)
 
 
     def render_entry(self, log_entry):
@@ -669,13 +877,14 @@ class status_logger(object):
                                           self.subdir_filename))
 
         # write out to entry to the log files
-        log_text = self.render_entry(log_entry)
-        for log_file in log_files:
-            fileobj = open(log_file, 'a')
-            try:
-                print >> fileobj, log_text
-            finally:
-                fileobj.close()
+        log_text = self.render_entry(log_entry) + '\n'
+        with self._lock:
+            self._check_owner()
+            for log_file in log_files:
+                self._pending_lines.setdefault(log_file, []).append(log_text)
+            if (time.time() - self._last_flush_time >=
+                    self._flush_interval):
+                self._flush_pending_lines()
 
         # adjust the indentation if this was a START or END entry
         if log_entry.is_start():
@@ -684,6 +893,69 @@ class status_logger(object):
             self._indenter.decrement()
 
 
+    def _check_owner(self):
+        """Drop the open files and buffered entries inherited over a fork.
+
+        The parent process still owns them, so they must neither be written
+        nor flushed by the child.
+        """
+        if self._owner_pid != os.getpid():
+            for fileobj in self._open_files.itervalues():
+                fileobj.close()
+            self._open_files.clear()
+            self._pending_lines.clear()
+            self._owner_pid = os.getpid()
+
+
+    def _get_file(self, log_file):
+        """Return an open, unbuffered file object appending to log_file.
+
+        @param log_file: The path of the log file.
+        """
+        fileobj = self._open_files.pop(log_file, None)
+        if fileobj is None:
+            if len(self._open_files) >= self.MAX_OPEN_FILES:
+                self._open_files.popitem(last=False)[1].close()
+            fileobj = open(log_file, 'a', 0)
+            fcntl.fcntl(fileobj, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        # keep the most recently used files at the end
+        self._open_files[log_file] = fileobj
+        return fileobj
+
+
+    def _flush_pending_lines(self):
+        """Write the buffered entries out. Must hold self._lock."""
+        while self._pending_lines:
+            log_file, lines = self._pending_lines.popitem(last=False)
+            fileobj = self._get_file(log_file)
+            fileobj.write(''.join(lines))
+            if self._fsync:
+                os.fsync(fileobj.fileno())
+        self._last_flush_time = time.time()
+
+
+    def flush(self):
+        """Write any buffered entries out to the log files."""
+        with self._lock:
+            self._check_owner()
+            self._flush_pending_lines()
+
+
+    def close(self):
+        """Flush buffered entries and close all the open log files.
+
+        The logger can still be used afterwards, log files are opened again
+        as needed.
+        """
+        with self._lock:
+            self._check_owner()
+            try:
+                self._flush_pending_lines()
+            finally:
+                while self._open_files:
+                    self._open_files.popitem()[1].close()
+
+
 class base_job(object):
     """An abstract base class for the various autotest job classes.
 
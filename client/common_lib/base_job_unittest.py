@@ -38,6 +38,7 @@ class stub_job_state(base_job.job_state):
     def __init__(self):
         self._state = {}
         self._backing_file_lock = None
+        self._pending_records = []
 
     def read_from_file(self, file_path):
         pass
@@ -520,6 +521,67 @@ class test_job_state_with_backing_file(test_job_state):
         self.assertRaises(KeyError, written_state.get, 'persist', 'var')
 
 
+    def test_changes_are_journaled(self):
+        self.state.set('persist', 'var', 'value')
+        size = os.path.getsize(self.backing_file)
+        self.state.set('persist', 'var2', 'value2')
+        self.state.discard('persist', 'var')
+        self.assert_(os.path.getsize(self.backing_file) > size)
+        written_state = base_job.job_state()
+        written_state.read_from_file(self.backing_file)
+        self.assertFalse(written_state.has('persist', 'var'))
+        self.assertEqual('value2', written_state.get('persist', 'var2'))
+
+
+    def test_journal_is_compacted(self):
+        self.state.JOURNAL_COMPACT_RECORDS = 3
+        for i in xrange(10):
+            self.state.set('persist', 'var', i)
+        self.assert_(self.state._journal_records <= 3)
+        written_state = base_job.job_state()
+        written_state.read_from_file(self.backing_file)
+        self.assertEqual(9, written_state.get('persist', 'var'))
+
+
+    def test_unchanged_file_is_not_read_again(self):
+        self.state.set('persist', 'var', 'value')
+        loads = []
+        original_load = base_job.job_state._load_state_file
+        def counting_load(file_path):
+            loads.append(file_path)
+            return original_load(file_path)
+        self.state._load_state_file = counting_load
+        self.assertEqual('value', self.state.get('persist', 'var'))
+        self.state.set('persist', 'var', 'value2')
+        self.assertEqual([], loads)
+
+
+    def test_changes_by_other_instances_are_read(self):
+        self.state.set('persist', 'var', 'value')
+        other_state = base_job.job_state()
+        other_state.set_backing_file(self.backing_file)
+        other_state.set('persist', 'var', 'other value')
+        self.assertEqual('other value', self.state.get('persist', 'var'))
+        other_state.JOURNAL_COMPACT_RECORDS = 0
+        other_state.set('persist', 'var2', 'value2')
+        self.assertEqual('value2', self.state.get('persist', 'var2'))
+
+
+    def test_truncated_journal_record_is_ignored(self):
+        self.state.set('persist', 'var', 'value')
+        self.state.set('persist', 'var2', 'value2')
+        with open(self.backing_file, 'r+') as backing_file:
+            backing_file.truncate(os.path.getsize(self.backing_file) - 2)
+        written_state = base_job.job_state()
+        written_state.set_backing_file(self.backing_file)
+        self.assertEqual('value', written_state.get('persist', 'var'))
+        self.assertFalse(written_state.has('persist', 'var2'))
+        written_state.set('persist', 'var3', 'value3')
+        final_state = base_job.job_state()
+        final_state.read_from_file(self.backing_file)
+        self.assertEqual('value3', final_state.get('persist', 'var3'))
+
+
 class test_job_state_read_write_file(unittest.TestCase):
     def setUp(self):
         self.testdir = tempfile.mkdtemp(suffix='unittest')
@@ -752,6 +814,16 @@ class test_job_state_backing_file_locking(unittest.TestCase):
                 if self._backing_file and file_path == self._backing_file:
                     ut_self.assertNotEqual(None, self._backing_file_lock)
                 return super(mocked_job_state, self).write_to_file(file_path)
+            def _read_from_backing_file(self):
+                if self._backing_file:
+                    ut_self.assertNotEqual(None, self._backing_file_lock)
+                return super(mocked_job_state,
+                             self)._read_from_backing_file()
+            def _write_to_backing_file(self):
+                if self._backing_file:
+                    ut_self.assertNotEqual(None, self._backing_file_lock)
+                return super(mocked_job_state,
+                             self)._write_to_backing_file()
         self.state = mocked_job_state()
         self.state.set_backing_file('backing_file')
 
@@ -1243,6 +1315,50 @@ class test_status_logger(unittest.TestCase):
         self.assertEqual(expected_log, open('status').read())
 
 
+    def test_log_files_are_kept_open(self):
+        os.mkdir('sub')
+        self.logger.record_entry(self.make_dummy_entry('LINE1', subdir='sub'))
+        opened = []
+        def counting_open(*args):
+            opened.append(args[0])
+            return open(*args)
+        base_job.open = counting_open
+        try:
+            self.logger.record_entry(
+                self.make_dummy_entry('LINE2', subdir='sub'))
+        finally:
+            del base_job.open
+        self.assertEqual([], opened)
+        self.assertEqual('LINE1\nLINE2\n', open('status').read())
+        self.assertEqual('LINE1\nLINE2\n', open('sub/status').read())
+
+
+    def test_open_files_are_bounded(self):
+        self.logger.MAX_OPEN_FILES = 2
+        for i in xrange(5):
+            os.mkdir('sub%d' % i)
+            self.logger.record_entry(
+                self.make_dummy_entry('LINE%d' % i, subdir='sub%d' % i))
+        self.assertEqual(2, len(self.logger._open_files))
+        self.assertEqual('LINE0\nLINE1\nLINE2\nLINE3\nLINE4\n',
+                         open('status').read())
+        self.assertEqual('LINE4\n', open('sub4/status').read())
+
+
+    def test_flush_interval_buffers_entries(self):
+        self.logger = base_job.status_logger(self.job, self.indenter,
+                                             flush_interval=3600)
+        self.logger.record_entry(self.make_dummy_entry('LINE1', start=True))
+        self.logger.record_entry(self.make_dummy_entry('LINE2'))
+        self.assertFalse(os.path.exists('status'))
+        self.logger.flush()
+        self.assertEqual('LINE1\n\tLINE2\n', open('status').read())
+        self.logger.record_entry(self.make_dummy_entry('LINE3', end=True))
+        self.logger.close()
+        self.assertEqual('LINE1\n\tLINE2\nLINE3\n', open('status').read())
+        self.assertEqual({}, self.logger._open_files)
+
+
     def test_hook_is_called(self):
         entries = [self.make_dummy_entry('LINE%d' % x) for x in xrange(5)]
         recorded_entries = []
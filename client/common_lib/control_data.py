@@ -7,13 +7,27 @@ with warnings.catch_warnings():
     # so in every log file.
     warnings.simplefilter("ignore", DeprecationWarning)
     import compiler
+import collections
+import copy
+import hashlib
+import json
 import logging
+import os
+import stat
+import tempfile
 import textwrap
+import threading
 import re
 
 from autotest_lib.client.common_lib import enum
 from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib import priorities
+from autotest_lib.client.common_lib import utils
+
+try:
+    from chromite.lib import metrics
+except ImportError:
+    metrics = utils.metrics_mock
 
 REQUIRED_VARS = set(['author', 'doc', 'name', 'time', 'test_type'])
 OBSOLETE_VARS = set(['experimental'])
@@ -29,6 +43,23 @@ CONFIG = global_config.global_config
 DEFAULT_MAX_RESULT_SIZE_KB = CONFIG.get_config_value(
         'AUTOSERV', 'default_max_result_size_KB', type=int, default=20000)
 
+# Number of parsed control files kept in memory by parse_control_string_cached.
+CONTROL_DATA_CACHE_SIZE = CONFIG.get_config_value(
+        'AUTOSERV', 'control_data_cache_size', type=int, default=20000)
+# Directory to also keep parsed control files in across processes, a directory
+# of the current user in the system temporary directory if empty.
+CONTROL_DATA_CACHE_DIR = (
+        CONFIG.get_config_value('AUTOSERV', 'control_data_cache_dir',
+                                default='') or
+        os.path.join(tempfile.gettempdir(),
+                     'autotest_control_data_%d' % os.getuid()))
+# Number of parsed control files kept in CONTROL_DATA_CACHE_DIR. The on-disk
+# cache is disabled if 0.
+CONTROL_DATA_CACHE_DISK_SIZE = CONFIG.get_config_value(
+        'AUTOSERV', 'control_data_cache_disk_size', type=int, default=50000)
+# Number of results saved to disk between two prunings of the cache directory.
+_DISK_PRUNE_INTERVAL = 1000
+
 
 class ControlVariableException(Exception):
     pass
@@ -369,14 +400,12 @@ def _extract_assignment(n):
     return (key, val)
 
 
-def parse_control_string(control, raise_warnings=False, path=''):
-    """Parse a control file from a string.
+def _parse_control_variables(control):
+    """Extract the variables a control file sets from its text.
 
     @param control: string containing the text of a control file.
-    @param raise_warnings: True iff ControlData should raise an error on
-            warnings about control file contents.
-    @param path: string path to the control file.
 
+    @returns: A dict of the variables, as passed to ControlData.
     """
     try:
         mod = compiler.parse(control)
@@ -386,7 +415,274 @@ def parse_control_string(control, raise_warnings=False, path=''):
         for n, l in enumerate(lines):
             logging.error('Line %d: %s', n + 1, l)
         raise ControlVariableException("Error parsing data because %s" % e)
-    return finish_parse(mod, path, raise_warnings)
+    return _get_control_variables(mod)
+
+
+def parse_control_string(control, raise_warnings=False, path=''):
+    """Parse a control file from a string.
+
+    @param control: string containing the text of a control file.
+    @param raise_warnings: True iff ControlData should raise an error on
+            warnings about control file contents.
+    @param path: string path to the control file.
+
+    """
+    return ControlData(_parse_control_variables(control), path,
+                       raise_warnings)
+
+
+def _encode_strings(value):
+    """Turn the unicode strings of a decoded JSON value back into str."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_encode_strings(item) for item in value]
+    if isinstance(value, dict):
+        return dict((_encode_strings(k), _encode_strings(v))
+                    for k, v in value.iteritems())
+    return value
+
+
+class ControlDataCache(object):
+    """LRU cache of parsed control files, keyed by their content.
+
+    The same control files are parsed over and over, e.g. for every suite
+    created against a build. Parsing is only done once for each distinct
+    (control text, raise_warnings, path), and copies of the result are
+    returned afterwards. If a cache directory is given, the variables
+    extracted from each control text are also saved there as JSON, so they
+    are shared across processes. The directory must belong to the current
+    user and not be writable by anyone else, or it is not used.
+    """
+
+    def __init__(self, max_size, cache_dir=None, max_disk_entries=0):
+        """
+        @param max_size: Maximum number of results kept in memory.
+        @param cache_dir: Directory to keep results in, or None to only cache
+                          them in memory.
+        @param max_disk_entries: Maximum number of results kept in cache_dir.
+                                 The least recently used ones are removed
+                                 beyond it. cache_dir is not used if 0.
+        """
+        self._max_size = max_size
+        self._cache_dir = cache_dir if max_disk_entries > 0 else None
+        self._max_disk_entries = max_disk_entries
+        self._cache_dir_checked = False
+        self._saves_until_prune = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    @staticmethod
+    def _get_key(control, raise_warnings, path):
+        """Get the cache key of a control file.
+
+        @param control: string containing the text of a control file.
+        @param raise_warnings: The raise_warnings argument of the parse.
+        @param path: string path to the control file.
+        """
+        digest = hashlib.sha1()
+        for part in (control, path):
+            if isinstance(part, unicode):
+                part = part.encode('utf-8')
+            digest.update('%d:' % len(part))
+            digest.update(part)
+        digest.update(str(bool(raise_warnings)))
+        return digest.hexdigest()
+
+
+    def _get_disk_path(self, control):
+        """Get the path of the variables of a control text in the cache dir.
+
+        @param control: string containing the text of a control file.
+
+        @returns: The path, or None if the cache directory can't be used.
+        """
+        with self._lock:
+            if not self._cache_dir_checked:
+                self._cache_dir_checked = True
+                if not self._check_cache_dir():
+                    self._cache_dir = None
+        if not self._cache_dir:
+            return None
+        if isinstance(control, unicode):
+            control = control.encode('utf-8')
+        return os.path.join(self._cache_dir,
+                            hashlib.sha1(control).hexdigest() + '.json')
+
+
+    def _check_cache_dir(self):
+        """Create the cache directory if needed, and check it is trusted.
+
+        @returns: True if the cache directory can be used.
+        """
+        if not self._cache_dir:
+            return False
+        try:
+            if not os.path.isdir(self._cache_dir):
+                os.makedirs(self._cache_dir, 0700)
+            dir_stat = os.lstat(self._cache_dir)
+        except OSError as e:
+            logging.warning('Not using control data cache dir %s: %s',
+                            self._cache_dir, e)
+            return False
+        if (not stat.S_ISDIR(dir_stat.st_mode) or
+                dir_stat.st_uid != os.getuid() or
+                dir_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+            logging.warning('Not using control data cache dir %s, it must be '
+                            'a directory of the current user only it can '
+                            'write to.', self._cache_dir)
+            return False
+        return True
+
+
+    def _load_from_disk(self, control):
+        """Load the variables of a control text from the cache dir, if any."""
+        path = self._get_disk_path(control)
+        if not path:
+            return None
+        try:
+            with open(path) as f:
+                variables = _encode_strings(json.load(f))
+        except IOError:
+            return None
+        except ValueError as e:
+            logging.warning('Ignoring unreadable control data cache entry %s: '
+                            '%s', path, e)
+            return None
+        # Keep track of the last use, for pruning.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return variables
+
+
+    def _save_to_disk(self, control, variables):
+        """Save the variables of a control text to the cache dir, if any."""
+        path = self._get_disk_path(control)
+        if not path:
+            return
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            data = json.dumps(variables)
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.rename(tmp_path, path)
+        except (IOError, OSError, ValueError) as e:
+            logging.warning('Failed to write control data cache entry %s: %s',
+                            path, e)
+            return
+        with self._lock:
+            prune = self._saves_until_prune == 0
+            if prune:
+                self._saves_until_prune = _DISK_PRUNE_INTERVAL
+            self._saves_until_prune -= 1
+        if prune:
+            self._prune_disk()
+
+
+    def _prune_disk(self):
+        """Remove the least recently used results beyond max_disk_entries."""
+        try:
+            names = [name for name in os.listdir(self._cache_dir)
+                     if name.endswith('.json')]
+        except OSError as e:
+            logging.warning('Failed to list control data cache dir %s: %s',
+                            self._cache_dir, e)
+            return
+        if len(names) <= self._max_disk_entries:
+            return
+        entries = []
+        for name in names:
+            path = os.path.join(self._cache_dir, name)
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except OSError:
+                pass
+        entries.sort()
+        for _, path in entries[:len(entries) - self._max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+    def _add(self, key, control_data):
+        """Add a result to the in-memory LRU, evicting the oldest one."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = control_data
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+
+    def parse(self, control, raise_warnings=False, path=''):
+        """Parse a control file from a string, using cached results.
+
+        @param control: string containing the text of a control file.
+        @param raise_warnings: True iff ControlData should raise an error on
+                warnings about control file contents.
+        @param path: string path to the control file.
+
+        @returns: A ControlData object the caller is free to modify.
+        """
+        key = self._get_key(control, raise_warnings, path)
+        with self._lock:
+            control_data = self._entries.pop(key, None)
+            if control_data is not None:
+                # Re-insert it as the most recently used.
+                self._entries[key] = control_data
+        result = 'memory'
+        if control_data is None:
+            variables = self._load_from_disk(control)
+            result = 'disk'
+            if variables is None:
+                variables = _parse_control_variables(control)
+                self._save_to_disk(control, variables)
+                result = 'miss'
+            control_data = ControlData(variables, path, raise_warnings)
+            self._add(key, control_data)
+
+        if result == 'miss':
+            self.misses += 1
+        else:
+            self.hits += 1
+        metrics.Counter('chromeos/autotest/control_data/cache_lookups'
+                        ).increment(fields={'result': result})
+        return copy.deepcopy(control_data)
+
+
+    def clear(self):
+        """Drop all results kept in memory."""
+        with self._lock:
+            self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+_control_data_cache = ControlDataCache(CONTROL_DATA_CACHE_SIZE,
+                                       CONTROL_DATA_CACHE_DIR,
+                                       CONTROL_DATA_CACHE_DISK_SIZE)
+
+
+def parse_control_string_cached(control, raise_warnings=False, path=''):
+    """Parse a control file from a string, reusing earlier results.
+
+    Same as parse_control_string, except that a control file that was parsed
+    before with the same arguments is not parsed again. Warnings about the
+    control file contents are only reported the first time in a process.
+
+    @param control: string containing the text of a control file.
+    @param raise_warnings: True iff ControlData should raise an error on
+            warnings about control file contents.
+    @param path: string path to the control file.
+
+    """
+    return _control_data_cache.parse(control, raise_warnings=raise_warnings,
+                                     path=path)
 
 
 def parse_control(path, raise_warnings=False):
@@ -411,7 +707,7 @@ def _try_extract_assignment(node, variables):
         pass
 
 
-def finish_parse(mod, path, raise_warnings):
+def _get_control_variables(mod):
     assert(mod.__class__ == compiler.ast.Module)
     assert(mod.node.__class__ == compiler.ast.Stmt)
     assert(mod.node.nodes.__class__ == list)
@@ -433,4 +729,8 @@ def finish_parse(mod, path, raise_warnings):
             _try_extract_assignment(n, injection_variables)
 
     variables.update(injection_variables)
-    return ControlData(variables, path, raise_warnings)
+    return variables
+
+
+def finish_parse(mod, path, raise_warnings):
+    return ControlData(_get_control_variables(mod), path, raise_warnings)
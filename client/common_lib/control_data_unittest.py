@@ -2,6 +2,7 @@
 # pylint: disable-msg=C0111
 
 import json
+import mock
 import os, unittest
 
 import common
@@ -327,6 +328,79 @@ class SetMethodTests(unittest.TestCase):
         self.assertRaises(control_data.ControlVariableException, fail)
 
 
+class ControlDataCacheTest(unittest.TestCase):
+    """Tests for ControlDataCache."""
+
+    def setUp(self):
+        self.cache_dir = autotemp.tempdir(unique_id='control_cache')
+
+
+    def tearDown(self):
+        self.cache_dir.clean()
+
+
+    def test_parse_once(self):
+        cache = control_data.ControlDataCache(10)
+        cd = cache.parse(CONTROL, True, path='a/control')
+        cd.dependencies.add('modified')
+        cd2 = cache.parse(CONTROL, True, path='a/control')
+        self.assertEquals((cache.hits, cache.misses), (1, 1))
+        self.assertEquals(cd2.dependencies, set(['console', 'power']))
+        self.assertEquals(cd2.path, 'a/control')
+
+        cache.parse(CONTROL, True, path='b/control')
+        cache.parse(CONTROL, False, path='a/control')
+        self.assertEquals((cache.hits, cache.misses), (1, 3))
+
+
+    def test_lru_eviction(self):
+        cache = control_data.ControlDataCache(2)
+        cache.parse(CONTROL, path='a')
+        cache.parse(CONTROL, path='b')
+        cache.parse(CONTROL, path='a')
+        cache.parse(CONTROL, path='c')
+        # b was the least recently used result.
+        cache.parse(CONTROL, path='a')
+        cache.parse(CONTROL, path='b')
+        self.assertEquals((cache.hits, cache.misses), (2, 4))
+
+
+    def test_parse_errors_not_cached(self):
+        cache = control_data.ControlDataCache(10)
+        for _ in range(2):
+            self.assertRaises(control_data.ControlVariableException,
+                              cache.parse, 'NAME = (', True)
+        self.assertEquals(cache.misses, 0)
+
+
+    def test_disk_cache(self):
+        cache = control_data.ControlDataCache(10, self.cache_dir.name, 10)
+        cache.parse(CONTROL, True, path='a/control')
+        cache = control_data.ControlDataCache(10, self.cache_dir.name, 10)
+        cd = cache.parse(CONTROL, True, path='a/control')
+        # The variables on disk are shared by all the paths of the text.
+        cd2 = cache.parse(CONTROL, False, path='b/control')
+        self.assertEquals((cache.hits, cache.misses), (2, 0))
+        self.assertEquals(cd.name, 'nAmE')
+        self.assertEquals(cd.dependencies, set(['console', 'power']))
+        self.assertEquals(cd2.path, 'b/control')
+
+
+    def test_disk_cache_pruned(self):
+        cache = control_data.ControlDataCache(10, self.cache_dir.name, 2)
+        with mock.patch.object(control_data, '_DISK_PRUNE_INTERVAL', 1):
+            for i in range(4):
+                cache.parse(CONTROL + '\n# %d' % i)
+        self.assertEquals(len(os.listdir(self.cache_dir.name)), 2)
+
+
+    def test_untrusted_disk_cache_dir(self):
+        os.chmod(self.cache_dir.name, 0777)
+        cache = control_data.ControlDataCache(10, self.cache_dir.name, 10)
+        cache.parse(CONTROL)
+        self.assertEquals(os.listdir(self.cache_dir.name), [])
+
+
 # this is so the test can be run in standalone mode
 if __name__ == '__main__':
     unittest.main()
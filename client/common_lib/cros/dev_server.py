@@ -3,7 +3,9 @@
 # found in the LICENSE file.
 
 from distutils import version
+import bisect
 import cStringIO
+import hashlib
 import HTMLParser
 import httplib
 import json
@@ -12,6 +14,7 @@ import multiprocessing
 import os
 import re
 import socket
+import threading
 import time
 import urllib2
 import urlparse
@@ -150,6 +153,19 @@ DEFAULT_SUBNET_MASKBIT = 19
 METRICS_PATH = 'chromeos/autotest'
 PROVISION_PATH = METRICS_PATH + '/provision'
 
+# Number of seconds a devserver health check result is reused. A result older
+# than this is still used, but triggers a refresh in the background. A result
+# older than _HEALTH_CACHE_MAX_STALENESS times this is refreshed synchronously.
+# Set to 0 to check the health of a devserver every time it is picked.
+DEVSERVER_HEALTH_CACHE_TTL_SECS = CONFIG.get_config_value(
+        'CROS', 'devserver_health_cache_ttl_secs', type=int, default=60)
+_HEALTH_CACHE_MAX_STALENESS = 5
+
+# Number of points each devserver gets on the consistent hash ring used to
+# pick a devserver for a build.
+DEVSERVER_HASH_RING_VNODES = CONFIG.get_config_value(
+        'CROS', 'devserver_hash_ring_vnodes', type=int, default=100)
+
 
 class DevServerException(Exception):
     """Raised when the dev server returns a non-200 HTTP response."""
@@ -407,6 +423,186 @@ def get_hostname(url):
     return urlparse.urlparse(url).hostname
 
 
+def _ring_hash(key):
+    """Hash a string to a position on a _ConsistentHashRing.
+
+    Unlike hash(), the result does not depend on the platform or process.
+
+    @param key: A string.
+    @return: A 64 bit integer.
+    """
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+class _ConsistentHashRing(object):
+    """Consistent hash ring of devservers.
+
+    Each devserver is placed on the ring at a number of points proportional to
+    its weight. A build maps to the first devserver found walking the ring
+    clockwise from the hash of the build. Adding or removing a devserver only
+    moves the builds that hash next to its points, so builds stay on the
+    devserver that already staged them.
+    """
+
+    def __init__(self, devservers, weights=None,
+                 vnodes=DEVSERVER_HASH_RING_VNODES):
+        """
+        @param devservers: A list of devserver urls.
+        @param weights: An optional dict mapping a devserver url to a weight,
+                        which defaults to 1.0.
+        @param vnodes: Number of points on the ring for a weight of 1.0.
+        """
+        weights = weights or {}
+        self._devservers = set(devservers)
+        points = []
+        for devserver in self._devservers:
+            count = max(1, int(round(vnodes * weights.get(devserver, 1.0))))
+            for i in xrange(count):
+                points.append((_ring_hash('%s#%d' % (devserver, i)),
+                               devserver))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._points = [devserver for _, devserver in points]
+
+
+    def get_devservers(self, build):
+        """Yield every devserver once, in order of preference for |build|.
+
+        @param build: The build (e.g. x86-mario-release/R18-1586.0.0-a1-b1514).
+        """
+        if not self._points:
+            return
+        start = bisect.bisect(self._hashes, _ring_hash(str(build)))
+        seen = set()
+        for i in xrange(len(self._points)):
+            devserver = self._points[(start + i) % len(self._points)]
+            if devserver not in seen:
+                seen.add(devserver)
+                yield devserver
+                if len(seen) == len(self._devservers):
+                    return
+
+
+class _DevserverHealthCache(object):
+    """Process-wide cache of devserver health check results.
+
+    Results are keyed by DevServer class and devserver url, since subclasses
+    check health over different transports. Expired results are served while
+    a background thread refreshes them, so picking a devserver rarely waits
+    for a health check.
+    """
+
+    def __init__(self, ttl_secs=DEVSERVER_HEALTH_CACHE_TTL_SECS):
+        self._ttl_secs = ttl_secs
+        self._lock = threading.Lock()
+        # Maps (class, url) to a tuple (healthy, check time).
+        self._results = {}
+        self._refreshing = set()
+        # Maps a url to the last load dict reported by that devserver.
+        self._loads = {}
+        self._rings = {}
+
+
+    def clear(self):
+        """Forget all cached results."""
+        with self._lock:
+            self._results.clear()
+            self._loads.clear()
+            self._rings.clear()
+
+
+    def record_load(self, devserver, load):
+        """Remember the load a devserver reported in its health check.
+
+        @param devserver: url of the devserver.
+        @param load: The load dict, or None if it could not be retrieved.
+        """
+        with self._lock:
+            self._loads[devserver] = load
+
+
+    def _check(self, devserver_class, devserver):
+        """Run a health check and store the result."""
+        try:
+            healthy = bool(devserver_class.devserver_healthy(devserver))
+        finally:
+            with self._lock:
+                self._refreshing.discard((devserver_class, devserver))
+        with self._lock:
+            self._results[(devserver_class, devserver)] = (healthy,
+                                                           time.time())
+        return healthy
+
+
+    def is_healthy(self, devserver_class, devserver):
+        """Return whether a devserver is healthy, using the cache.
+
+        @param devserver_class: The DevServer class to check health with.
+        @param devserver: url of the devserver.
+        """
+        if self._ttl_secs <= 0:
+            return devserver_class.devserver_healthy(devserver)
+
+        key = (devserver_class, devserver)
+        with self._lock:
+            result = self._results.get(key)
+            age = time.time() - result[1] if result else None
+            refresh = (result is not None and age > self._ttl_secs
+                       and key not in self._refreshing)
+            if refresh:
+                self._refreshing.add(key)
+        c = metrics.Counter('chromeos/autotest/devserver/health_cache')
+        if (result is None
+            or age > self._ttl_secs * _HEALTH_CACHE_MAX_STALENESS):
+            c.increment(fields={'result': 'miss'})
+            return self._check(devserver_class, devserver)
+        if refresh:
+            c.increment(fields={'result': 'stale'})
+            thread = threading.Thread(target=self._check,
+                                      args=(devserver_class, devserver),
+                                      name='devserver-health-refresh')
+            thread.daemon = True
+            thread.start()
+        else:
+            c.increment(fields={'result': 'hit'})
+        return result[0]
+
+
+    def _weight(self, devserver):
+        """Return the hash ring weight of a devserver from its last load.
+
+        The weight is deliberately coarse: a devserver only loses part of its
+        builds while it is reporting high CPU or network load.
+        """
+        load = self._loads.get(devserver)
+        if not load:
+            return 1.0
+        if (load.get(DevServer.CPU_LOAD, 0) > DevServer.MAX_CPU_LOAD
+            or load.get(DevServer.NETWORK_IO, 0) > DevServer.MAX_NETWORK_IO):
+            return 0.5
+        return 1.0
+
+
+    def get_ring(self, devservers):
+        """Return the consistent hash ring for a list of devservers.
+
+        @param devservers: A list of devserver urls.
+        """
+        with self._lock:
+            weights = dict((d, self._weight(d)) for d in devservers)
+            key = tuple(sorted(weights.iteritems()))
+            ring = self._rings.get(key)
+            if ring is None:
+                if len(self._rings) > 32:
+                    self._rings.clear()
+                ring = self._rings[key] = _ConsistentHashRing(devservers,
+                                                              weights)
+        return ring
+
+
+_health_cache = _DevserverHealthCache()
+
+
 class DevServer(object):
     """Base class for all DevServer-like server stubs.
 
@@ -581,6 +777,7 @@ class DevServer(object):
         reason = ''
         healthy = False
         load = cls.get_devserver_load(devserver, timeout_min=timeout_min)
+        _health_cache.record_load(devserver, load)
         try:
             if not load:
                 # Failed to get the load of devserver.
@@ -662,7 +859,7 @@ class DevServer(object):
         calls = []
         # Note we use cls.servers as servers is class specific.
         for server in cls.servers():
-            if cls.devserver_healthy(server):
+            if cls.is_healthy_cached(server):
                 calls.append(cls._build_call(server, method, **kwargs))
 
         return calls
@@ -754,10 +951,26 @@ class DevServer(object):
         return devservers
 
 
+    @classmethod
+    def is_healthy_cached(cls, devserver):
+        """Returns True if the |devserver| is healthy to stage build.
+
+        Unlike devserver_healthy, this reuses recent health check results,
+        see DEVSERVER_HEALTH_CACHE_TTL_SECS.
+
+        @param devserver: url of the devserver.
+        """
+        return _health_cache.is_healthy(cls, devserver)
+
+
     @classmethod
     def get_healthy_devserver(cls, build, devservers, ban_list=None):
         """"Get a healthy devserver instance from the list of devservers.
 
+        Devservers are tried in the order of a consistent hash ring, so that
+        a build keeps resolving to the same devserver when devservers are
+        added to or removed from the list.
+
         @param build: The build (e.g. x86-mario-release/R18-1586.0.0-a1-b1514).
         @param devservers: The devserver list to be chosen out a healthy one.
         @param ban_list: The blacklist of devservers we don't want to choose.
@@ -768,14 +981,13 @@ class DevServer(object):
 
         """
         logging.debug('Pick one healthy devserver from %r', devservers)
-        while devservers:
-            hash_index = hash(build) % len(devservers)
-            devserver = devservers.pop(hash_index)
+        ring = _health_cache.get_ring(devservers)
+        for devserver in ring.get_devservers(build):
             logging.debug('Check health for %s', devserver)
             if ban_list and devserver in ban_list:
                 continue
 
-            if cls.devserver_healthy(devserver):
+            if cls.is_healthy_cached(devserver):
                 logging.debug('Pick %s', devserver)
                 return cls(devserver)
 
@@ -883,8 +1095,8 @@ class DevServer(object):
     def random(cls):
         """Return a random devserver that's available.
 
-        Devserver election in `resolve` method is based on a hash of the
-        build that a caller wants to stage. The purpose is that different
+        Devserver election in `resolve` method is based on a consistent hash
+        of the build that a caller wants to stage. The purpose is that different
         callers requesting for the same build can get the same devserver,
         while the lab is able to distribute different builds across all
         devservers. That helps to reduce the duplication of builds across
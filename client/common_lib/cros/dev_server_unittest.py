@@ -273,6 +273,15 @@ class RunCallTest(mox.MoxTestBase):
         self.assertEquals(self.contents, response)
 
 
+def _build_preferring(devservers, devserver):
+    """Return a build that hashes to |devserver| first among |devservers|."""
+    ring = dev_server._ConsistentHashRing(devservers)
+    for build in xrange(1000):
+        if next(ring.get_devservers(build)) == devserver:
+            return build
+    raise AssertionError('No build hashes to %s' % devserver)
+
+
 class DevServerTest(mox.MoxTestBase):
     """Unit tests for dev_server.DevServer.
 
@@ -303,6 +312,8 @@ class DevServerTest(mox.MoxTestBase):
         sleep = mock.patch('time.sleep', autospec=True)
         sleep.start()
         self.addCleanup(sleep.stop)
+        # Do not reuse health check results across tests.
+        dev_server._health_cache.clear()
 
 
     def testSimpleResolve(self):
@@ -337,7 +348,8 @@ class DevServerTest(mox.MoxTestBase):
                         '{"free_disk": 1024}')
 
         self.mox.ReplayAll()
-        host = dev_server.ImageServer.resolve(0) # Using 0 as it'll hash to 0.
+        build = _build_preferring([bad_host, good_host], bad_host)
+        host = dev_server.ImageServer.resolve(build)
         self.assertEquals(host.url(), good_host)
         self.mox.VerifyAll()
 
@@ -370,7 +382,8 @@ class DevServerTest(mox.MoxTestBase):
                         '{"free_disk": 1024}')
 
         self.mox.ReplayAll()
-        host = dev_server.ImageServer.resolve(0) # Using 0 as it'll hash to 0.
+        build = _build_preferring([bad_host, good_host], bad_host)
+        host = dev_server.ImageServer.resolve(build)
         self.assertEquals(host.url(), good_host)
         self.mox.VerifyAll()
 
@@ -391,8 +404,11 @@ class DevServerTest(mox.MoxTestBase):
         dev_server.ImageServer.devserver_healthy(host1_expected).AndReturn(True)
 
         self.mox.ReplayAll()
-        host0 = dev_server.ImageServer.resolve(0)
-        host1 = dev_server.ImageServer.resolve(1)
+        devservers = [host0_expected, host1_expected]
+        host0 = dev_server.ImageServer.resolve(
+                _build_preferring(devservers, host0_expected))
+        host1 = dev_server.ImageServer.resolve(
+                _build_preferring(devservers, host1_expected))
         self.mox.VerifyAll()
 
         self.assertEqual(host0.url(), host0_expected)
@@ -1468,5 +1484,103 @@ class DevServerTest(mox.MoxTestBase):
                 (restricted_servers, False))
 
 
+
+class ConsistentHashRingTest(unittest.TestCase):
+    """Unittests for _ConsistentHashRing."""
+
+    _DEVSERVERS = ['http://host%d:8082' % i for i in range(4)]
+
+    def _assignments(self, ring, builds):
+        return dict((b, next(ring.get_devservers(b))) for b in builds)
+
+
+    def testGetDevserversYieldsEachDevserverOnce(self):
+        """Every devserver is tried exactly once."""
+        ring = dev_server._ConsistentHashRing(self._DEVSERVERS)
+        self.assertEqual(sorted(ring.get_devservers('build')),
+                         sorted(self._DEVSERVERS))
+
+
+    def testAddingDevserverOnlyMovesBuildsToIt(self):
+        """Builds either stay put or move to the new devserver."""
+        builds = ['board-release/R%d-1.0.0' % i for i in range(200)]
+        before = self._assignments(
+                dev_server._ConsistentHashRing(self._DEVSERVERS), builds)
+        new_devserver = 'http://new_host:8082'
+        after = self._assignments(
+                dev_server._ConsistentHashRing(
+                        self._DEVSERVERS + [new_devserver]), builds)
+        moved = [b for b in builds if before[b] != after[b]]
+        self.assertTrue(moved)
+        self.assertLess(len(moved), len(builds) / 2)
+        for build in moved:
+            self.assertEqual(after[build], new_devserver)
+
+
+    def testLowerWeightGetsFewerBuilds(self):
+        """A devserver with a lower weight gets fewer builds."""
+        builds = ['board-release/R%d-1.0.0' % i for i in range(400)]
+        loaded = self._DEVSERVERS[0]
+        ring = dev_server._ConsistentHashRing(self._DEVSERVERS,
+                                              weights={loaded: 0.1})
+        assignments = self._assignments(ring, builds).values()
+        self.assertLess(assignments.count(loaded), len(builds) / 8)
+
+
+class DevserverHealthCacheTest(unittest.TestCase):
+    """Unittests for _DevserverHealthCache."""
+
+    def setUp(self):
+        self.devserver_class = mock.Mock()
+        self.devserver_class.devserver_healthy.return_value = True
+        time_patcher = mock.patch.object(dev_server.time, 'time',
+                                         return_value=1000)
+        self.time = time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+        thread_patcher = mock.patch.object(dev_server.threading, 'Thread')
+        self.thread = thread_patcher.start()
+        self.addCleanup(thread_patcher.stop)
+        self.cache = dev_server._DevserverHealthCache(ttl_secs=60)
+
+
+    def testFreshResultIsReused(self):
+        """A result within the TTL is reused."""
+        self.assertTrue(self.cache.is_healthy(self.devserver_class, 'host'))
+        self.time.return_value = 1059
+        self.assertTrue(self.cache.is_healthy(self.devserver_class, 'host'))
+        self.assertEqual(self.devserver_class.devserver_healthy.call_count, 1)
+        self.assertFalse(self.thread.called)
+
+
+    def testStaleResultIsRefreshedInBackground(self):
+        """An expired result is returned while it is refreshed."""
+        self.cache.is_healthy(self.devserver_class, 'host')
+        self.devserver_class.devserver_healthy.return_value = False
+        self.time.return_value = 1061
+        self.assertTrue(self.cache.is_healthy(self.devserver_class, 'host'))
+        self.assertEqual(self.thread.call_count, 1)
+        # A refresh is already running.
+        self.cache.is_healthy(self.devserver_class, 'host')
+        self.assertEqual(self.thread.call_count, 1)
+
+
+    def testVeryStaleResultIsRefreshedSynchronously(self):
+        """A result much older than the TTL is not used."""
+        self.cache.is_healthy(self.devserver_class, 'host')
+        self.devserver_class.devserver_healthy.return_value = False
+        self.time.return_value = 2000
+        self.assertFalse(self.cache.is_healthy(self.devserver_class, 'host'))
+
+
+    def testLoadedDevserverHasLowerWeight(self):
+        """A devserver reporting a high load gets a lower weight."""
+        self.cache.record_load('host0', {dev_server.DevServer.CPU_LOAD: 99})
+        self.cache.record_load('host1', {dev_server.DevServer.CPU_LOAD: 1})
+        self.assertEqual(self.cache._weight('host0'), 0.5)
+        self.assertEqual(self.cache._weight('host1'), 1.0)
+        self.assertIs(self.cache.get_ring(['host0', 'host1']),
+                      self.cache.get_ring(['host1', 'host0']))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -463,6 +463,19 @@ class UnmodifiableAttributeException(RPCException):
     """Raised when an RPC tries to modify static attributes."""
 
 
+class ShardRPCException(RPCException):
+    """Raised when an RPC forwarded to shards failed on some of them."""
+
+    def __init__(self, message, failures=None):
+        """
+        @param message: The error message.
+        @param failures: A dict mapping the hostname of each shard the RPC
+                         failed on to a description of the failure.
+        """
+        super(ShardRPCException, self).__init__(message)
+        self.failures = failures or {}
+
+
 class InvalidBgJobCall(Exception):
     """Raised when an invalid call is made to a BgJob object."""
 
@@ -22,11 +22,15 @@ meant to test for specific conditions that may cause tests to fail.
 more failures identified by a `Verifier` object.
 """
 
+import Queue
 import collections
 import logging
+import time
+from multiprocessing import pool
 
 import common
 from autotest_lib.client.common_lib import error
+from autotest_lib.client.common_lib import global_config
 
 try:
     from chromite.lib import metrics
@@ -34,6 +38,13 @@ except ImportError:
     from autotest_lib.client.bin.utils import metrics_mock as metrics
 
 
+# Default number of verifiers `RepairStrategy.verify()` may run at the
+# same time on one host.  With 1, the verifier DAG is walked one node at
+# a time.
+_VERIFY_PARALLELISM = global_config.global_config.get_config_value(
+        'CROS', 'repair_verify_parallelism', type=int, default=1)
+
+
 class AutoservVerifyError(error.AutoservError):
     """
     Generic Exception for failures from `Verifier` objects.
@@ -312,6 +323,24 @@ class Verifier(_DependencyNode):
         super(Verifier, self).__init__(tag, 'verify', dependencies)
         self._result = None
 
+    def _timed_verify(self, host):
+        """
+        Call `verify()`, and report how long it took.
+
+        @param host     The host to be tested for a problem.
+        """
+        logging.info('Verifying this condition: %s', self.description)
+        start_time = time.time()
+        try:
+            self.verify(host)
+        finally:
+            duration = time.time() - start_time
+            logging.debug('Verifier %s took %.2f seconds', self.tag,
+                          duration)
+            metrics.SecondsDistribution(
+                    'chromeos/autotest/repair/verifier_durations').add(
+                            duration, fields={'tag': self.tag})
+
     def _reverify(self):
         """
         Discard cached verification results.
@@ -346,9 +375,8 @@ class Verifier(_DependencyNode):
                 return              # cached success
         self._result = False
         self._verify_dependencies(host, silent)
-        logging.info('Verifying this condition: %s', self.description)
         try:
-            self.verify(host)
+            self._timed_verify(host)
             self._record_good(host, silent)
         except Exception as e:
             logging.exception('Failed: %s', self.description)
@@ -684,7 +712,8 @@ class RepairStrategy(object):
         deps = [verifiers[d] for d in dep_tags]
         verifiers[tag] = constructor(tag, deps)
 
-    def __init__(self, verifier_data, repair_data):
+    def __init__(self, verifier_data, repair_data,
+                 verify_parallelism=None):
         """
         Construct a `RepairStrategy` from simplified DAG data.
 
@@ -701,7 +730,14 @@ class RepairStrategy(object):
         @param repair_data    Iterable value with constructors for the
                               elements of the repair action list, and
                               their dependencies and triggers.
-        """
+        @param verify_parallelism  Maximum number of verifiers that
+                              `verify()` runs at the same time.  Defaults
+                              to the `repair_verify_parallelism` setting
+                              in the CROS section of global_config.
+        """
+        if verify_parallelism is None:
+            verify_parallelism = _VERIFY_PARALLELISM
+        self._verify_parallelism = max(1, verify_parallelism)
         # Metrics - we report on 'actions' for every repair action
         # we execute; we report on 'completions' for every complete
         # repair operation.
@@ -745,6 +781,108 @@ class RepairStrategy(object):
                       'board': board}
             self._actions_counter.increment(fields=fields)
 
+    def _verify_order(self):
+        """
+        Return the verifiers in the order a plain DAG walk checks them.
+
+        This is the order in which `Verifier._verify_host()` calls
+        `verify()` starting from the root:  every verifier comes after
+        all of its dependencies, and dependencies are visited in list
+        order.
+
+        @return A list of all verifiers in the DAG, ending with the root.
+        """
+        order = []
+        visited = set()
+        def visit(verifier):
+            if verifier in visited:
+                return
+            visited.add(verifier)
+            for dependency in verifier._dependency_list:
+                visit(dependency)
+            order.append(verifier)
+        visit(self._verify_root)
+        return order
+
+    def _verify_concurrently(self, host, silent):
+        """
+        Run independent verifiers of the DAG at the same time.
+
+        A verifier is started, in a pool of `self._verify_parallelism`
+        threads, as soon as all of its dependencies have passed.
+        Verifiers with a failed dependency are not run.
+
+        Status records are held back until every verifier is done, then
+        written in the order a plain DAG walk would have written them, so
+        `status.log` does not depend on timing.  Results are cached in
+        each verifier that ran; the caller then walks the DAG as usual to
+        raise and log failures, without re-running any check.
+
+        @param host     The target to be verified.
+        @param silent   If true, don't log host status records.
+        """
+        order = self._verify_order()
+        dependents = collections.defaultdict(list)
+        waiting = {}
+        for verifier in order:
+            # Leave no result behind from an interrupted earlier call.
+            verifier._result = None
+            dependencies = set(verifier._dependency_list)
+            waiting[verifier] = len(dependencies)
+            for dependency in dependencies:
+                dependents[dependency].append(verifier)
+        outcomes = {}
+        done = Queue.Queue()
+
+        def run(verifier):
+            failure = AutoservVerifyError('Verifier did not complete')
+            try:
+                verifier._timed_verify(host)
+                failure = None
+            except Exception as e:
+                logging.exception('Failed: %s', verifier.description)
+                failure = e
+            finally:
+                done.put((verifier, failure))
+
+        workers = pool.ThreadPool(self._verify_parallelism)
+        try:
+            running = 0
+            for verifier in order:
+                if not waiting[verifier]:
+                    workers.apply_async(run, (verifier,))
+                    running += 1
+            while running:
+                # Wait with a timeout so that signals still get handled.
+                try:
+                    verifier, failure = done.get(timeout=1)
+                except Queue.Empty:
+                    continue
+                running -= 1
+                outcomes[verifier] = failure
+                if failure is not None:
+                    continue
+                for dependent in dependents[verifier]:
+                    waiting[dependent] -= 1
+                    if not waiting[dependent]:
+                        workers.apply_async(run, (dependent,))
+                        running += 1
+        finally:
+            # The workers are daemon threads; after an exception, don't
+            # wait for checks that are still running.
+            workers.close()
+        workers.join()
+        for verifier in order:
+            if verifier not in outcomes:
+                continue
+            failure = outcomes[verifier]
+            if failure is None:
+                verifier._record_good(host, silent)
+                verifier._result = True
+            else:
+                verifier._record_fail(host, silent, failure)
+                verifier._result = failure
+
     def verify(self, host, silent=False):
         """
         Run the verifier DAG on the given host.
@@ -753,6 +891,8 @@ class RepairStrategy(object):
         @param silent   If true, don't log host status records.
         """
         self._verify_root._reverify()
+        if self._verify_parallelism > 1:
+            self._verify_concurrently(host, silent)
         self._verify_root._verify_host(host, silent)
 
     def repair(self, host, silent=False):
@@ -8,6 +8,7 @@
 
 import functools
 import logging
+import threading
 import unittest
 
 import common
@@ -1108,6 +1109,75 @@ class RepairStrategyVerifyTests(_RepairStrategyTestCase):
                 verifier.try_repair()
 
 
+class RepairStrategyConcurrentVerifyTests(_RepairStrategyTestCase):
+    """Unit tests for `RepairStrategy.verify()` with parallelism."""
+
+    # A DAG with shared dependencies, and both passing and failing
+    # verifiers at each level.
+    _VERIFY_INPUT = (('a', 0, ()),
+                     ('b', 1, ()),
+                     ('c', 0, ('a',)),
+                     ('d', 0, ('a', 'b')),
+                     ('e', 1, ('c',)),
+                     ('f', 0, ('c', 'a')))
+
+    def _verify(self, parallelism, silent):
+        """
+        Build a fresh strategy from `_VERIFY_INPUT` and verify with it.
+
+        @return A tuple of the log records and the set of failures.
+        """
+        self._fake_host.reset_log_records()
+        strategy = hosts.RepairStrategy(
+                self._make_verify_data(*self._VERIFY_INPUT), [],
+                verify_parallelism=parallelism)
+        with self.assertRaises(hosts.AutoservVerifyDependencyError) as e:
+            strategy.verify(self._fake_host, silent)
+        return self._fake_host.get_log_records(), e.exception.failures
+
+
+    def test_same_results_as_sequential(self):
+        """
+        Test concurrent verify logs and fails exactly like a plain walk.
+        """
+        for silent in self._generate_silent():
+            records, failures = self._verify(1, silent)
+            for _ in range(5):
+                self.assertEqual(self._verify(4, silent),
+                                 (records, failures))
+            self.assertEqual(self.nodes['d'].verify_count, 0)
+            self.assertEqual(self.nodes['f'].verify_count, 1)
+
+
+    def test_independent_verifiers_overlap(self):
+        """
+        Test independent verifiers run at the same time.
+
+        Each of two verifiers without dependencies waits for the other
+        one to start.
+        """
+        started = {'one': threading.Event(), 'two': threading.Event()}
+        other = {'one': 'two', 'two': 'one'}
+
+        class _WaitingVerifier(hosts.Verifier):
+            def verify(self, host):
+                started[self.tag].set()
+                if not started[other[self.tag]].wait(10):
+                    raise hosts.AutoservVerifyError('ran alone')
+
+            @property
+            def description(self):
+                return 'Waiting for the other verifier'
+
+        strategy = hosts.RepairStrategy(
+                [(_WaitingVerifier, 'one', ()),
+                 (_WaitingVerifier, 'two', ())], [],
+                verify_parallelism=2)
+        strategy.verify(self._fake_host)
+        self.assertEqual([r[2] for r in self._fake_host.get_log_records()],
+                         ['verify.one', 'verify.two', 'verify.PASS'])
+
+
 class RepairStrategyRepairTests(_RepairStrategyTestCase):
     """
     Unit tests for `RepairStrategy.repair()`.
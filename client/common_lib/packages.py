@@ -21,6 +21,9 @@ from autotest_lib.client.common_lib import utils
 
 # the name of the checksum file that stores the packages' checksums
 CHECKSUM_FILE = "packages.checksum"
+# the name of the file, in an install dir, that lists the MD5 checksum of
+# each file untarred from the package
+MANIFEST_FILE = ".manifest"
 
 
 def has_pbzip2():
@@ -801,6 +804,15 @@ class BasePackageManager(object):
         self._save_checksum_dict(checksum_dict)
 
 
+    def get_package_checksum(self, pkg_name):
+        '''
+        Return the checksum of a package as listed in the repositories'
+        checksum file, or None if it is not listed.
+        pkg_name : The name of the package file (ex: client-autotest.tar.bz2)
+        '''
+        return self._get_checksum_dict().get(pkg_name)
+
+
     def compare_checksum(self, pkg_path):
         '''
         Calculate the checksum of the file specified in pkg_path and
@@ -882,6 +894,78 @@ class BasePackageManager(object):
                           % (pkg_checksum, pkg_checksum_path))
 
 
+    def write_manifest(self, tarball_path, dest_dir):
+        '''
+        Record the MD5 checksum of each file of the package in tarball_path,
+        as untarred in dest_dir, in the MANIFEST_FILE of dest_dir. The
+        manifest is used by diff_manifest to find out which files changed
+        since the package was installed.
+        '''
+        manifest_path = os.path.join(dest_dir, MANIFEST_FILE)
+        # Write to a temporary file first, so that a partial manifest never
+        # hides files that were not checksummed.
+        self._run_command('cd %s && tar -tjf %s | grep -v "/$" | '
+                          'tr "\\n" "\\0" | xargs -0 -r md5sum > %s.tmp && '
+                          'mv %s.tmp %s'
+                          % (dest_dir, tarball_path, manifest_path,
+                             manifest_path, manifest_path))
+
+
+    def diff_manifest(self, dest_dir, exclude_dirs=()):
+        '''
+        Compare the files in dest_dir with those recorded in its manifest by
+        write_manifest.
+        exclude_dirs : directories of dest_dir, relative to it, that do not
+                       belong to the package and are not compared.
+        Returns None if dest_dir has no manifest, otherwise a tuple
+        (changed, extra): the names, as listed in the package, of its files
+        that were modified or removed since it was untarred, and the paths,
+        relative to dest_dir, of the files that are not part of it.
+        '''
+        manifest_path = os.path.join(dest_dir, MANIFEST_FILE)
+        result = self._run_command('cat %s' % manifest_path,
+                                   _run_command_dargs={'ignore_status': True,
+                                                       'verbose': False})
+        if result.exit_status:
+            return None
+        # Maps the normalized path of each file in the manifest to its name
+        # in the package.
+        package_files = {}
+        for line in result.stdout.splitlines():
+            name = line.split(None, 1)[1].lstrip('*')
+            package_files[os.path.normpath(name)] = name
+
+        prunes = ''.join('-path ./%s -prune -o ' % d for d in exclude_dirs)
+        result = self._run_command(
+                'cd %s && (md5sum -c --quiet %s 2>/dev/null; echo ---; '
+                'find . %s\\( -type f -o -type l \\) -print)'
+                % (dest_dir, MANIFEST_FILE, prunes),
+                _run_command_dargs={'ignore_status': True, 'verbose': False})
+        lines = result.stdout.splitlines()
+        separator = lines.index('---')
+        changed = [line.rsplit(': FAILED', 1)[0]
+                   for line in lines[:separator] if ': FAILED' in line]
+        ignored = set(['.checksum', MANIFEST_FILE, MANIFEST_FILE + '.tmp',
+                       CHECKSUM_FILE])
+        extra = []
+        for path in lines[separator + 1:]:
+            path = os.path.normpath(path)
+            if path not in package_files and path not in ignored:
+                extra.append(path)
+        return changed, extra
+
+
+    def untar_files(self, tarball_path, dest_dir, files):
+        '''
+        Untar only some of the files of the package in tarball_path into
+        dest_dir.
+        files : The names of the files, as listed in the package.
+        '''
+        self._run_command('tar --no-same-owner -xjf %s -C %s --null -T -'
+                          % (tarball_path, dest_dir),
+                          _run_command_dargs={'stdin': '\0'.join(files)})
+
+
     @staticmethod
     def get_tarball_name(name, pkg_type):
         """Converts a package name and type into a tarball name.
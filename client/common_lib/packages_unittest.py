@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+"""Tests for the manifest of the packages installed by PackageManager."""
+
+import os
+import unittest
+
+import common
+from autotest_lib.client.common_lib import autotemp
+from autotest_lib.client.common_lib import packages
+from autotest_lib.client.common_lib import utils
+
+
+class ManifestTest(unittest.TestCase):
+    """Tests for write_manifest, diff_manifest and untar_files."""
+
+    def setUp(self):
+        self._tempdir = autotemp.tempdir(unique_id='packages_unittest')
+        self.addCleanup(self._tempdir.clean)
+        self._pkgmgr = packages.PackageManager(self._tempdir.name,
+                                               do_locking=False,
+                                               run_function=utils.run)
+        src_dir = self._path('src')
+        self._write(os.path.join(src_dir, 'control'), 'control')
+        self._write(os.path.join(src_dir, 'bin', 'job.py'), 'job')
+        self._write(os.path.join(src_dir, 'with space'), 'space')
+        self._tarball = self._path('client.tar.bz2')
+        utils.run('tar -cjf %s -C %s .' % (self._tarball, src_dir))
+        self._dest_dir = self._path('dest')
+        os.mkdir(self._dest_dir)
+        self._pkgmgr.untar_pkg(self._tarball, self._dest_dir)
+        self._pkgmgr.write_manifest(self._tarball, self._dest_dir)
+
+
+    def _path(self, *names):
+        return os.path.join(self._tempdir.name, *names)
+
+
+    def _write(self, path, content):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+
+    def test_write_manifest(self):
+        """The manifest lists the checksum of each file of the package."""
+        manifest = self._read(os.path.join(self._dest_dir,
+                                           packages.MANIFEST_FILE))
+        names = sorted(os.path.normpath(line.split(None, 1)[1])
+                       for line in manifest.splitlines())
+        self.assertEqual(names, ['bin/job.py', 'control', 'with space'])
+        self.assertFalse(os.path.exists(os.path.join(
+                self._dest_dir, packages.MANIFEST_FILE + '.tmp')))
+
+
+    def test_diff_manifest_unchanged(self):
+        """A fresh install has no changed or extra files."""
+        self.assertEqual(self._pkgmgr.diff_manifest(self._dest_dir), ([], []))
+
+
+    def test_diff_manifest_no_manifest(self):
+        """None is returned when there is no manifest to compare with."""
+        os.remove(os.path.join(self._dest_dir, packages.MANIFEST_FILE))
+        self.assertIsNone(self._pkgmgr.diff_manifest(self._dest_dir))
+
+
+    def test_diff_manifest(self):
+        """Modified, removed and extra files are found."""
+        self._write(os.path.join(self._dest_dir, 'control'), 'modified')
+        os.remove(os.path.join(self._dest_dir, 'with space'))
+        self._write(os.path.join(self._dest_dir, 'bin', 'job.pyc'), 'extra')
+        self._write(os.path.join(self._dest_dir, 'packages', 'pkg.tar.bz2'),
+                    'excluded')
+        changed, extra = self._pkgmgr.diff_manifest(
+                self._dest_dir, exclude_dirs=['packages'])
+        self.assertEqual(sorted(os.path.normpath(name) for name in changed),
+                         ['control', 'with space'])
+        self.assertEqual(extra, ['bin/job.pyc'])
+
+
+    def test_untar_files(self):
+        """Only the requested files are untarred, with their content."""
+        self._write(os.path.join(self._dest_dir, 'control'), 'modified')
+        self._write(os.path.join(self._dest_dir, 'bin', 'job.py'), 'modified')
+        changed, _ = self._pkgmgr.diff_manifest(self._dest_dir)
+        self._pkgmgr.untar_files(self._tarball, self._dest_dir,
+                                 [name for name in changed
+                                  if os.path.normpath(name) == 'control'])
+        self.assertEqual(self._read(os.path.join(self._dest_dir, 'control')),
+                         'control')
+        self.assertEqual(self._read(os.path.join(self._dest_dir, 'bin',
+                                                 'job.py')),
+                         'modified')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,11 +19,20 @@
   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 """
 
+import StringIO
+import collections
+import errno
+import httplib
 import os
 import socket
 import subprocess
+import threading
+import time
 import urllib
 import urllib2
+import urlparse
+import zlib
+
 from autotest_lib.client.common_lib import error as exceptions
 from autotest_lib.client.common_lib import global_config
 
@@ -51,6 +60,25 @@ except ImportError:
     pass
 
 
+# Maximum number of idle connections kept open to each RPC server. 0 disables
+# connection reuse, and every RPC is made with a new urllib2 connection.
+_CONNECTION_POOL_SIZE = global_config.global_config.get_config_value(
+        'CLIENT', 'rpc_connection_pool_size', type=int, default=4)
+# Idle connections are dropped after this many seconds, before the server
+# (apache's KeepAliveTimeout defaults to 5 seconds) gets to close them.
+_CONNECTION_IDLE_SECS = global_config.global_config.get_config_value(
+        'CLIENT', 'rpc_connection_idle_secs', type=float, default=4)
+# Whether large request bodies are gzipped. Only turn this on once every RPC
+# server understands gzipped requests.
+_GZIP_REQUESTS = global_config.global_config.get_config_value(
+        'CLIENT', 'rpc_gzip_requests', type=bool, default=False)
+# Request bodies smaller than this are never gzipped.
+_GZIP_MIN_REQUEST_SIZE = 1024
+# zlib window bits selecting the gzip container format.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+_REDIRECT_STATUSES = (301, 302, 303, 307)
+
+
 class JSONRPCException(Exception):
     pass
 
@@ -123,26 +151,304 @@ class ServiceProxy(object):
         # Caller can pass in a minimum value of timeout to be used for urlopen
         # call. Otherwise, the default socket timeout will be used.
         min_rpc_timeout = kwargs.pop('min_rpc_timeout', None)
-        postdata = json_encoder_class().encode({'method': self.__serviceName,
-                                                'params': args + (kwargs,),
-                                                'id': 'jsonrpc'})
+        resp = self._request(self.__serviceName,
+                             {'method': self.__serviceName,
+                              'params': args + (kwargs,),
+                              'id': 'jsonrpc'},
+                             min_rpc_timeout)
+        if resp['error'] is not None:
+            raise BuildException(resp['error'])
+        else:
+            return resp['result']
+
+
+    def _method_name(self, name):
+        """Return the full name of a method of the proxied service.
+
+        @param name: The method name, relative to this proxy.
+        """
+        if self.__serviceName is not None:
+            return "%s.%s" % (self.__serviceName, name)
+        return name
+
+
+    def _request(self, method_label, request, min_rpc_timeout):
+        """Post a JSON-RPC request and decode the response.
+
+        @param method_label: Name passed in the URL, for the server logs.
+        @param request: The request object, or a list of them for a batch.
+        @param min_rpc_timeout: Minimum timeout of the request, in seconds.
+
+        @returns: The decoded response.
+        """
+        postdata = json_encoder_class().encode(request)
         url_with_args = self.__serviceURL + '?' + urllib.urlencode({
-            'method': self.__serviceName})
+            'method': method_label})
         if self.__use_sso_client:
             respdata = _sso_request(url_with_args, self.__headers, postdata,
                                     min_rpc_timeout)
         else:
-            respdata = _raw_http_request(url_with_args, self.__headers,
-                                         postdata, min_rpc_timeout)
+            respdata = _pooled_http_request(url_with_args, self.__headers,
+                                            postdata, min_rpc_timeout)
 
         try:
-            resp = decoder.JSONDecoder().decode(respdata)
+            return decoder.JSONDecoder().decode(respdata)
         except ValueError:
             raise JSONRPCException('Error decoding JSON reponse:\n' + respdata)
-        if resp['error'] is not None:
-            raise BuildException(resp['error'])
+
+
+class BatchCall(object):
+    """Several RPCs sent to a server in a single HTTP request.
+
+    Calls are queued with add() and sent with execute(), as a JSON-RPC batch:
+    a list of requests, answered by the list of their responses. The server
+    runs the calls one after the other, in order; a call failing does not stop
+    the following ones.
+
+    Usage:
+        batch = BatchCall(proxy)
+        batch.add('get_hosts', hostname='host1')
+        batch.add('get_jobs', id=42)
+        hosts, jobs = batch.execute()
+    """
+
+    def __init__(self, service_proxy):
+        """
+        @param service_proxy: The ServiceProxy of the service to call.
+        """
+        self._proxy = service_proxy
+        self._calls = []
+
+
+    def __len__(self):
+        return len(self._calls)
+
+
+    def add(self, method, *args, **kwargs):
+        """Queue a call.
+
+        @param method: Name of the method, relative to the service proxy.
+        @param args: Positional arguments of the call.
+        @param kwargs: Keyword arguments of the call.
+        """
+        self._calls.append({'method': self._proxy._method_name(method),
+                            'params': args + (kwargs,),
+                            'id': len(self._calls)})
+
+
+    def execute(self, min_rpc_timeout=None):
+        """Send the queued calls, and clear the queue.
+
+        @param min_rpc_timeout: Minimum timeout of the request, in seconds.
+
+        @returns: The list of the results of the calls, in order.
+        @raises JSONRPCException: or the exception matching the error of the
+                first call that failed, once all the calls have run.
+        """
+        calls, self._calls = self._calls, []
+        if not calls:
+            return []
+        resp = self._proxy._request('batch', calls, min_rpc_timeout)
+        if not isinstance(resp, list):
+            # Servers that do not support batches fail the whole request.
+            if isinstance(resp, dict) and resp.get('error') is not None:
+                raise BuildException(resp['error'])
+            raise JSONRPCException('Unexpected batch response: %r' % (resp,))
+        resp_by_id = dict((r.get('id'), r) for r in resp)
+        results = []
+        for call in calls:
+            call_resp = resp_by_id.get(call['id'])
+            if call_resp is None:
+                raise JSONRPCException('No response to batched call %s' %
+                                       call['method'])
+            if call_resp['error'] is not None:
+                raise BuildException(call_resp['error'])
+            results.append(call_resp['result'])
+        return results
+
+
+class _ConnectionPool(object):
+    """Idle persistent HTTP connections, by server.
+
+    Connections are only reused by the process that opened them; a forked
+    child starts with an empty pool, so that it never shares a connection, and
+    the requests on it, with its parent.
+    """
+
+    def __init__(self, max_idle, idle_secs):
+        """
+        @param max_idle: Maximum number of idle connections kept per server.
+        @param idle_secs: Seconds after which an idle connection is dropped.
+        """
+        self._max_idle = max_idle
+        self._idle_secs = idle_secs
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # Maps (scheme, netloc) to a list of (connection, last used time).
+        self._idle = collections.defaultdict(list)
+
+
+    def _check_owner(self):
+        """Forget the connections inherited from a parent process.
+
+        Must be called with the lock held.
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = collections.defaultdict(list)
+
+
+    def get(self, scheme, netloc, timeout):
+        """Get a connection to a server, reusing an idle one if possible.
+
+        @param scheme: 'http' or 'https'.
+        @param netloc: host[:port] of the server.
+        @param timeout: Socket timeout in seconds, or None for no timeout.
+
+        @returns: A tuple (connection, reused).
+        """
+        expired = []
+        conn = None
+        with self._lock:
+            self._check_owner()
+            idle = self._idle[(scheme, netloc)]
+            now = time.time()
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used < self._idle_secs:
+                    conn = candidate
+                    break
+                expired.append(candidate)
+        for candidate in expired:
+            candidate.close()
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+        if scheme == 'https':
+            conn_class = httplib.HTTPSConnection
         else:
-            return resp['result']
+            conn_class = httplib.HTTPConnection
+        return conn_class(netloc, timeout=timeout), False
+
+
+    def put(self, scheme, netloc, conn):
+        """Return a connection whose response was fully read to the pool.
+
+        @param scheme: 'http' or 'https'.
+        @param netloc: host[:port] of the server.
+        @param conn: The httplib connection.
+        """
+        with self._lock:
+            self._check_owner()
+            idle = self._idle[(scheme, netloc)]
+            if len(idle) < self._max_idle:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+
+_connection_pool = _ConnectionPool(_CONNECTION_POOL_SIZE,
+                                   _CONNECTION_IDLE_SECS)
+
+
+def _request_timeout(timeout):
+    """Return the socket timeout to use for a request.
+
+    @param timeout: The minimum timeout asked for by the caller, or None.
+    """
+    default_timeout = socket.getdefaulttimeout()
+    if not default_timeout:
+        # If default timeout is None, socket will never time out.
+        return None
+    return max(timeout, default_timeout)
+
+
+def _is_stale_connection_error(e):
+    """Whether an error means a reused connection was closed by the server.
+
+    Servers close idle keep-alive connections whenever they like. That shows
+    up as the connection being reset, or closed without a response, on the
+    next request sent on it.
+
+    @param e: The exception raised while making the request.
+    """
+    if isinstance(e, httplib.BadStatusLine):
+        # Depending on the python version, an empty status line is reported
+        # as "''" or with an explicit message.
+        return (not e.line or e.line == "''"
+                or 'server has closed the connection' in e.line)
+    if isinstance(e, socket.error):
+        return e.errno in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+    return False
+
+
+def _pooled_http_request(url_with_args, headers, postdata, timeout):
+    """Make an HTTP request on a persistent connection.
+
+    Behaves like _raw_http_request, including the errors raised, but keeps the
+    connection open for the next request to the same server. Requests that
+    need anything but a direct connection, i.e. going through a proxy or
+    being redirected, are handed over to _raw_http_request.
+
+    @param url_with_args: url with the GET params formatted.
+    @headers: Any extra headers to include in the request.
+    @postdata: data for a POST request instead of a GET.
+    @timeout: timeout to use (in seconds).
+
+    @returns: the response from the http request.
+    """
+    scheme, netloc, path, query, _ = urlparse.urlsplit(url_with_args)
+    if (not _CONNECTION_POOL_SIZE or scheme not in ('http', 'https')
+        or urllib.getproxies().get(scheme)):
+        return _raw_http_request(url_with_args, headers, postdata, timeout)
+
+    selector = path or '/'
+    if query:
+        selector += '?' + query
+    request_headers = {'Content-Type': 'application/x-www-form-urlencoded',
+                       'Accept-Encoding': 'gzip'}
+    request_headers.update(headers)
+    body = postdata
+    if _GZIP_REQUESTS and len(postdata) >= _GZIP_MIN_REQUEST_SIZE:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, _GZIP_WBITS)
+        body = compressor.compress(postdata) + compressor.flush()
+        request_headers['Content-Encoding'] = 'gzip'
+
+    timeout = _request_timeout(timeout)
+    while True:
+        conn, reused = _connection_pool.get(scheme, netloc, timeout)
+        try:
+            conn.request('POST', selector, body, request_headers)
+            response = conn.getresponse()
+            respdata = response.read()
+        except (httplib.HTTPException, socket.error) as e:
+            connected = conn.sock is not None
+            conn.close()
+            if reused and _is_stale_connection_error(e):
+                # Retry once, on a new connection.
+                continue
+            if isinstance(e, socket.error) and not connected:
+                # Same as urllib2, for callers that handle connection errors.
+                raise urllib2.URLError(e)
+            raise
+        break
+
+    if response.will_close:
+        conn.close()
+    else:
+        _connection_pool.put(scheme, netloc, conn)
+
+    if response.status in _REDIRECT_STATUSES:
+        return _raw_http_request(url_with_args, headers, postdata, timeout)
+    if response.getheader('content-encoding') == 'gzip':
+        respdata = zlib.decompress(respdata, _GZIP_WBITS)
+    if not 200 <= response.status < 300:
+        raise urllib2.HTTPError(url_with_args, response.status,
+                                response.reason, response.msg,
+                                StringIO.StringIO(respdata))
+    return respdata
 
 
 def _raw_http_request(url_with_args, headers, postdata, timeout):
@@ -156,15 +462,11 @@ def _raw_http_request(url_with_args, headers, postdata, timeout):
     @returns: the response from the http request.
     """
     request = urllib2.Request(url_with_args, data=postdata, headers=headers)
-    default_timeout = socket.getdefaulttimeout()
-    if not default_timeout:
-        # If default timeout is None, socket will never time out.
+    timeout = _request_timeout(timeout)
+    if timeout is None:
         return urllib2.urlopen(request).read()
     else:
-        return urllib2.urlopen(
-                request,
-                timeout=max(timeout, default_timeout),
-        ).read()
+        return urllib2.urlopen(request, timeout=timeout).read()
 
 
 def _sso_request(url_with_args, headers, postdata, timeout):
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+import BaseHTTPServer
+import SocketServer
+import json
+import threading
+import unittest
+import urllib2
+import zlib
+
+import common
+from autotest_lib.frontend.afe.json_rpc import proxy
+
+
+class _RpcRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers JSON-RPC calls to an `add` method, with keep-alive."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.server.connections.add(self.client_address)
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        request = json.loads(body)
+        if isinstance(request, list):
+            response = json.dumps([self._answer(call) for call in request])
+        else:
+            response = json.dumps(self._answer(request))
+        status = 200
+        if self.path.startswith('/broken'):
+            status = 500
+        self.send_response(status)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            response = compressor.compress(response) + compressor.flush()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+        if self.path.startswith('/closing'):
+            # Drop the connection without telling the client, like a server
+            # timing out an idle keep-alive connection.
+            self.close_connection = 1
+
+
+    def _answer(self, call):
+        if call['method'] != 'add':
+            return {'id': call['id'], 'result': None,
+                    'error': {'name': 'ServiceMethodNotFound',
+                              'message': call['method'],
+                              'traceback': ''}}
+        return {'id': call['id'], 'result': sum(call['params'][:-1]),
+                'error': None}
+
+
+    def log_message(self, *args):
+        pass
+
+
+class _RpcServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves each keep-alive connection in its own thread."""
+
+    daemon_threads = True
+
+
+class ServiceProxyTest(unittest.TestCase):
+    """Tests for the pooled JSON-RPC transport."""
+
+    def setUp(self):
+        self.server = _RpcServer(('127.0.0.1', 0), _RpcRequestHandler)
+        self.server.connections = set()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/rpc/' % self.server.server_port
+        self.proxy = proxy.ServiceProxy(self.url)
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def test_call(self):
+        """Test a call returns its result."""
+        self.assertEqual(self.proxy.add(1, 2), 3)
+
+
+    def test_connection_reused(self):
+        """Test consecutive calls share a connection."""
+        for i in range(5):
+            self.assertEqual(self.proxy.add(i, 1), i + 1)
+        self.assertEqual(len(self.server.connections), 1)
+
+
+    def test_closed_connection_retried(self):
+        """Test a call on a connection closed by the server is retried."""
+        closing = proxy.ServiceProxy(self.url.replace('/rpc/', '/closing/'))
+        for i in range(3):
+            self.assertEqual(closing.add(i, 1), i + 1)
+        self.assertEqual(len(self.server.connections), 3)
+
+
+    def test_error(self):
+        """Test an RPC error is raised as an exception."""
+        self.assertRaises(proxy.JSONRPCException, self.proxy.missing)
+
+
+    def test_http_error(self):
+        """Test an HTTP error status raises urllib2.HTTPError."""
+        broken = proxy.ServiceProxy(self.url.replace('/rpc/', '/broken/'))
+        self.assertRaises(urllib2.HTTPError, broken.add, 1)
+
+
+    def test_connection_refused(self):
+        """Test a connection failure raises urllib2.URLError."""
+        self.tearDown()
+        self.assertRaises(urllib2.URLError, self.proxy.add, 1)
+        self.setUp()
+
+
+    def test_batch(self):
+        """Test a batch returns the results of its calls in order."""
+        batch = proxy.BatchCall(self.proxy)
+        batch.add('add', 1, 2)
+        batch.add('add', 3, 4)
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(batch.execute(), [3, 7])
+        self.assertEqual(batch.execute(), [])
+
+
+    def test_batch_error(self):
+        """Test a failed call of a batch raises its error."""
+        batch = proxy.BatchCall(self.proxy)
+        batch.add('add', 1, 2)
+        batch.add('missing')
+        self.assertRaises(proxy.JSONRPCException, batch.execute)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -123,6 +123,11 @@ class ServiceHandler(object):
 
     def handleRequest(self, jsonRequest):
         request = self.translateRequest(jsonRequest)
+        if isinstance(request, list):
+            # A batch request: a list of calls answered by a list of results,
+            # in the same order.
+            return self.translateBatchResult(
+                    [self.dispatchRequest(call) for call in request])
         results = self.dispatchRequest(request)
         return self.translateResult(results)
 
@@ -175,3 +180,14 @@ class ServiceHandler(object):
                                         "error":err})
 
         return data
+
+
+    @classmethod
+    def translateBatchResult(cls, result_dicts):
+        """
+        @param result_dicts: a list of result dictionaries, one for each call
+                             of a batch request.
+        @returns translated json list of results
+        """
+        return '[%s]' % ', '.join(cls.translateResult(result_dict)
+                                  for result_dict in result_dicts)
@@ -68,5 +68,21 @@ class TestServiceHandler(unittest.TestCase):
         self.assertNotEquals(response_obj['error'], 'None')
 
 
+    def test_handleBatchRequest(self):
+        batch = '[%s, %s, %s]' % (json_request1, json_request3, json_request2)
+        response = self.serviceHandler.handleRequest(batch)
+        response_obj = eval(response.replace('null', 'None'))
+        self.assertEquals(len(response_obj), 3)
+        self.assertEquals(response_obj[0]['result'], 16)
+        self.assertEquals(response_obj[1]['error']['name'],
+                          'ServiceMethodNotFound')
+        self.assertEquals(response_obj[2]['result'], 'package.rpm')
+
+
+    def test_handleEmptyBatchRequest(self):
+        response = self.serviceHandler.handleRequest('[]')
+        self.assertEquals(response, '[]')
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -2,6 +2,7 @@
 Extensions to Django's model logic.
 """
 
+import contextlib
 import django.core.exceptions
 from django.db import connection
 from django.db import connections
@@ -1157,6 +1158,89 @@ class ModelExtensions(rdb_model_extensions.ModelValidators):
         self._deserialize_local(local)
 
 
+    # Maximum number of objects written by a single UPDATE statement in
+    # bulk_update_from_serialized.
+    _BULK_UPDATE_CHUNK_SIZE = 500
+
+    @classmethod
+    def bulk_update_from_serialized(cls, updates):
+        """Updates local fields of existing objects from their serialized forms.
+
+        This does what update_from_serialized does for each object, but only
+        writes the fields whose value changed, with one UPDATE statement for
+        up to _BULK_UPDATE_CHUNK_SIZE objects. Callers that need the updates
+        to be atomic must run this in a transaction.
+
+        @param updates: List of (instance, serialized) tuples, where instance
+                        is the object as currently stored in the database, and
+                        serialized its new representation, as returned by
+                        serialize.
+
+        @raises ValueError: if a serialized form contains related objects, i.e.
+                            not only local fields.
+
+        @returns: The number of objects whose fields changed.
+        """
+        fields = {}
+        for field in cls._meta.concrete_model._meta.local_fields:
+            fields[field.name] = fields[field.attname] = field
+
+        # Maps the primary key of each changed object to a dictionary mapping
+        # the columns that changed to their new database value.
+        changes = {}
+        for instance, serialized in updates:
+            local, related = cls._split_local_from_foreign_values(serialized)
+            if related:
+                raise ValueError('Serialized must not contain foreign '
+                                 'objects: %s' % related)
+            changed = {}
+            for link, value in local:
+                field = fields.get(link)
+                if field is None or field.primary_key:
+                    continue
+                if field.to_python(value) != getattr(instance, field.attname):
+                    changed[field.column] = field.get_db_prep_save(
+                            value, connection=connection)
+            if changed:
+                changes[instance.pk] = changed
+
+        pks = sorted(changes)
+        for start in xrange(0, len(pks), cls._BULK_UPDATE_CHUNK_SIZE):
+            cls._bulk_update_columns(
+                    pks[start:start + cls._BULK_UPDATE_CHUNK_SIZE], changes)
+        transaction.commit_unless_managed()
+        return len(changes)
+
+
+    @classmethod
+    def _bulk_update_columns(cls, pks, changes):
+        """Write new column values of several objects with one statement.
+
+        @param pks: List of the primary keys of the objects to update.
+        @param changes: Dictionary mapping the primary key of each object to a
+                        dictionary of column names and their new value.
+        """
+        qn = connection.ops.quote_name
+        pk_column = qn(cls._meta.pk.column)
+        columns = sorted(set(column for pk in pks for column in changes[pk]))
+        assignments = []
+        params = []
+        for column in columns:
+            whens = []
+            for pk in pks:
+                if column in changes[pk]:
+                    whens.append('WHEN %s THEN %s')
+                    params.extend([pk, changes[pk][column]])
+            assignments.append('%s = CASE %s %s ELSE %s END' % (
+                    qn(column), pk_column, ' '.join(whens), qn(column)))
+        params.extend(pks)
+        query = 'UPDATE %s SET %s WHERE %s IN (%s)' % (
+                qn(cls._meta.db_table), ', '.join(assignments), pk_column,
+                ','.join(['%s'] * len(pks)))
+        with contextlib.closing(connection.cursor()) as cursor:
+            cursor.execute(query, params)
+
+
     def custom_deserialize_relation(self, link, data):
         """Allows overriding the deserialization behaviour by subclasses."""
         raise NotImplementedError(
@@ -228,6 +228,30 @@ class Shard(dbmodels.Model, model_logic.ModelExtensions):
         db_table = 'afe_shards'
 
 
+class ShardHeartbeatState(dbmodels.Model, model_logic.ModelExtensions):
+    """Heartbeat bookkeeping of a shard, only used on the master.
+
+    A shard echoes the sequence number of the last heartbeat response it
+    persisted. As long as it matches |sequence|, the master knows exactly
+    which hosts and jobs the shard has, and the shard only needs to send what
+    changed since then.
+
+    sequence: Sequence number of the last heartbeat response sent to the
+              shard.
+    full_sync_sequence: Sequence number of the last heartbeat that carried
+                        the complete lists of hosts and jobs known to the
+                        shard.
+    """
+    shard = dbmodels.OneToOneField(Shard, on_delete=dbmodels.CASCADE,
+                                   primary_key=True)
+    sequence = dbmodels.IntegerField(default=0)
+    full_sync_sequence = dbmodels.IntegerField(default=0)
+
+    class Meta:
+        """Metadata for class ShardHeartbeatState."""
+        db_table = 'afe_shard_heartbeat_states'
+
+
 class Drone(dbmodels.Model, model_logic.ModelExtensions):
     """
     A scheduler drone
@@ -632,7 +656,7 @@ class Host(model_logic.ModelWithInvalid, rdb_model_extensions.AbstractHostModel,
 
 
     @classmethod
-    def assign_to_shard(cls, shard, known_ids):
+    def assign_to_shard(cls, shard, known_ids, incremental=False):
         """Assigns hosts to a shard.
 
         For all labels that have been assigned to a shard, all hosts that
@@ -656,6 +680,11 @@ class Host(model_logic.ModelWithInvalid, rdb_model_extensions.AbstractHostModel,
                           failed persisting them.
                           The number of hosts usually lies in O(100), so the
                           overhead is acceptable.
+        @param incremental: If True, the shard is known to have persisted
+                            every host previously assigned to it, so
+                            |known_ids| is ignored and only hosts that are
+                            not yet assigned to the shard are sent. No
+                            incorrect host ids are determined in this mode.
 
         @returns a tuple of (hosts objects that should be sent to the shard,
                              incorrect host ids that should not belong to]
@@ -677,12 +706,15 @@ class Host(model_logic.ModelWithInvalid, rdb_model_extensions.AbstractHostModel,
         #   returns the old state of the records.
         new_hosts = []
 
-        possible_new_host_ids = set(Host.objects.filter(
+        candidates = Host.objects.filter(
             labels__in=shard.labels.all(),
             leased=False
-            ).exclude(
-            id__in=known_ids,
-            ).values_list('pk', flat=True))
+            )
+        if incremental:
+            candidates = candidates.exclude(shard=shard)
+        else:
+            candidates = candidates.exclude(id__in=known_ids)
+        possible_new_host_ids = set(candidates.values_list('pk', flat=True))
 
         # No-op in production, used to simulate race condition in tests.
         cls._assign_to_shard_nothing_helper()
@@ -698,6 +730,9 @@ class Host(model_logic.ModelWithInvalid, rdb_model_extensions.AbstractHostModel,
                 shard=shard
                 ).all())
 
+        if incremental:
+            return new_hosts, []
+
         invalid_host_ids = list(Host.objects.filter(
             id__in=known_ids
             ).exclude(
@@ -1395,6 +1430,13 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
     #     - Active jobs
     #     - Jobs without host_queue_entries
     NON_ABORTED_KNOWN_JOBS = '(t2.aborted = 0 AND t1.id IN (%(known_ids)s))'
+    # Same as NON_ABORTED_KNOWN_JOBS, for a shard that is known to have
+    # persisted every job previously assigned to it.  The IS NOT NULL check
+    # keeps the expression false rather than NULL for unassigned jobs, which
+    # would otherwise be dropped by the NOT in front of it.
+    NON_ABORTED_ASSIGNED_JOBS = (
+            '(t2.aborted = 0 AND t1.shard_id IS NOT NULL AND '
+            't1.shard_id = %(shard_id)s)')
 
     SQL_SHARD_JOBS = (
         'SELECT DISTINCT(t1.id) FROM afe_jobs t1 '
@@ -1622,7 +1664,7 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
 
 
     @classmethod
-    def assign_to_shard(cls, shard, known_ids):
+    def assign_to_shard(cls, shard, known_ids, incremental=False):
         """Assigns unassigned jobs to a shard.
 
         For all labels that have been assigned to this shard, all jobs that
@@ -1642,6 +1684,11 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
                           Assuming one id takes 8 chars in the json, this means
                           overhead that lies in the lower kilobyte range.
                           A not in query with 5000 id's takes about 30ms.
+        @param incremental: If True, the shard is known to have persisted
+                            every job previously assigned to it, so
+                            |known_ids| is ignored and jobs already assigned
+                            to the shard are only sent again if they were
+                            aborted.
 
         @returns The job objects that should be sent to the shard.
         """
@@ -1653,10 +1700,15 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
         check_known_jobs_exclude = ''
         check_known_jobs_include = ''
 
-        if known_ids:
+        check_known_jobs = None
+        if incremental:
+            check_known_jobs = (cls.NON_ABORTED_ASSIGNED_JOBS %
+                                {'shard_id': shard.id})
+        elif known_ids:
             check_known_jobs = (
                     cls.NON_ABORTED_KNOWN_JOBS %
                     {'known_ids': ','.join([str(i) for i in known_ids])})
+        if check_known_jobs:
             check_known_jobs_exclude = 'AND NOT ' + check_known_jobs
             check_known_jobs_include = 'OR ' + check_known_jobs
 
@@ -41,6 +41,11 @@ def get_proxy(*args, **kwargs):
     return proxy.ServiceProxy(*args, **kwargs)
 
 
+def get_batch_call(service_proxy):
+    """Use this to send several RPCs through a proxy in one request."""
+    return proxy.BatchCall(service_proxy)
+
+
 def _base_authorization_headers(username, server):
     """
     Don't call this directly, call authorization_headers().
@@ -10,6 +10,7 @@ import pydoc
 import re
 import traceback
 import urllib
+import zlib
 
 from autotest_lib.client.common_lib import error
 from autotest_lib.frontend.afe import models, rpc_utils
@@ -28,6 +29,12 @@ COMPILED_REGEXP = re.compile(FULL_REGEXP)
 SHARD_RPC_INTERFACE = 'shard_rpc_interface'
 COMMON_RPC_INTERFACE = 'common_rpc_interface'
 
+# Responses smaller than this are sent uncompressed, even to clients that
+# accept gzip; compressing them costs more than it saves.
+GZIP_MIN_RESPONSE_SIZE = 1024
+# zlib window bits selecting the gzip container format.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
 def should_log_message(name):
     """Detect whether to log message.
 
@@ -97,6 +104,22 @@ class RpcValidator(object):
                                 meth_name, remote_ip, global_afe_ip))
 
 
+    def validate_result(self, meth_id, err):
+        """Build the result of an RPC refused by the validator.
+
+        @param meth_id: the id of the request for an RPC method.
+        @param err: The error raised by validator.
+
+        @return: a result dictionary, as returned by
+            ServiceHandler.dispatchRequest, holding the error.
+        """
+        error_result = serviceHandler.ServiceHandler.blank_result_dict()
+        error_result['id'] = meth_id
+        error_result['err'] = err
+        error_result['err_traceback'] = traceback.format_exc()
+        return error_result
+
+
     def encode_validate_result(self, meth_id, err):
         """Encode the return results for validator.
 
@@ -109,11 +132,8 @@ class RpcValidator(object):
         @return: a raw http response including the encoded error result. It
             will be parsed by service proxy.
         """
-        error_result = serviceHandler.ServiceHandler.blank_result_dict()
-        error_result['id'] = meth_id
-        error_result['err'] = err
-        error_result['err_traceback'] = traceback.format_exc()
-        result = self.encode_result(error_result)
+        result = serviceHandler.ServiceHandler.translateResult(
+                self.validate_result(meth_id, err))
         return rpc_utils.raw_http_response(result)
 
 
@@ -152,6 +172,8 @@ class RpcHandler(object):
         @param request: the request to get raw data from.
         """
         if request.method == 'POST':
+            if request.META.get('HTTP_CONTENT_ENCODING') == 'gzip':
+                return zlib.decompress(request.body, _GZIP_WBITS)
             return request.body
         return urllib.unquote(request.META['QUERY_STRING'])
 
@@ -208,34 +230,76 @@ class RpcHandler(object):
         return self._dispatcher.translateResult(results)
 
 
-    def handle_rpc_request(self, request):
-        """Handle common rpc request and return raw response.
+    def _handle_decoded_request(self, user, decoded_request, remote_ip):
+        """Validate, run and log a single decoded RPC call.
 
-        @param request: the rpc request to be processed.
-        """
-        remote_ip = self._get_remote_ip(request)
-        user = models.User.current_user()
-        json_request = self.raw_request_data(request)
-        decoded_request = self.decode_request(json_request)
+        @param user: current user.
+        @param decoded_request: the decoded request of the call.
+        @param remote_ip: the caller's ip.
 
+        @return: the decoded result of the call.
+        """
         # Validate whether method can be called by the remote_ip
         try:
             meth_id = decoded_request['id']
             meth_name = decoded_request['method']
             self._rpc_validator.validate_rpc_only_called_by_master(
                     meth_name, remote_ip)
-        except KeyError:
+        except (KeyError, TypeError):
             raise serviceHandler.BadServiceRequest(decoded_request)
         except error.RPCException as e:
-            return self._rpc_validator.encode_validate_result(meth_id, e)
+            return self._rpc_validator.validate_result(meth_id, e)
 
         decoded_request['remote_ip'] = remote_ip
         decoded_result = self.dispatch_request(decoded_request)
-        result = self.encode_result(decoded_result)
         if rpcserver_logging.LOGGING_ENABLED:
             self.log_request(user, decoded_request, decoded_result,
                              remote_ip)
-        return rpc_utils.raw_http_response(result)
+        return decoded_result
+
+
+    def _raw_rpc_response(self, request, result):
+        """Build the http response of an rpc request.
+
+        The result is gzipped if it is large enough and the client accepts it.
+
+        @param request: the rpc request being answered.
+        @param result: the encoded json result.
+        """
+        if (len(result) < GZIP_MIN_RESPONSE_SIZE or
+            'gzip' not in request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return rpc_utils.raw_http_response(result)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, _GZIP_WBITS)
+        response = rpc_utils.raw_http_response(
+                compressor.compress(result) + compressor.flush())
+        response['Content-Encoding'] = 'gzip'
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+
+    def handle_rpc_request(self, request):
+        """Handle common rpc request and return raw response.
+
+        The request is either a single call, or a batch: a list of calls that
+        are run in order and answered by the list of their results.
+
+        @param request: the rpc request to be processed.
+        """
+        remote_ip = self._get_remote_ip(request)
+        user = models.User.current_user()
+        json_request = self.raw_request_data(request)
+        decoded_request = self.decode_request(json_request)
+
+        if isinstance(decoded_request, list):
+            decoded_results = [
+                    self._handle_decoded_request(user, call, remote_ip)
+                    for call in decoded_request]
+            result = self._dispatcher.translateBatchResult(decoded_results)
+        else:
+            decoded_result = self._handle_decoded_request(
+                    user, decoded_request, remote_ip)
+            result = self.encode_result(decoded_result)
+        return self._raw_rpc_response(request, result)
 
 
     def handle_jsonp_rpc_request(self, request):
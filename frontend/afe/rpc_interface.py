@@ -1260,15 +1260,40 @@ def get_jobs_summary(**filter_data):
     jobs = get_jobs(**filter_data)
     ids = [job['id'] for job in jobs]
     all_status_counts = models.Job.objects.get_status_counts(ids)
+    all_result_counts = _get_result_counts(ids)
     for job in jobs:
         job['status_counts'] = all_status_counts[job['id']]
-        job['result_counts'] = tko_rpc_interface.get_status_counts(
-                ['afe_job_id', 'afe_job_id'],
-                header_groups=[['afe_job_id'], ['afe_job_id']],
-                **{'afe_job_id': job['id']})
+        job['result_counts'] = all_result_counts[job['id']]
     return rpc_utils.prepare_for_serialization(jobs)
 
 
+def _get_result_counts(job_ids):
+    """Get the TKO result counts of several jobs with a single query.
+
+    @param job_ids: A list of AFE job ids.
+
+    @return: A dict mapping each job id to its result counts, in the format
+             returned by tko_rpc_interface.get_status_counts() for the job
+             alone, grouped by afe_job_id with two afe_job_id header groups.
+    """
+    all_result_counts = dict(
+            (job_id, {'groups': [], 'header_values': [[], []]})
+            for job_id in job_ids)
+    if not job_ids:
+        return all_result_counts
+    info = tko_rpc_interface.get_status_counts(['afe_job_id'],
+                                               afe_job_id__in=job_ids)
+    for group in info['groups']:
+        job_id = group.pop('afe_job_id')
+        if job_id not in all_result_counts:
+            continue
+        group['header_indices'] = [0, 0]
+        all_result_counts[job_id] = {'groups': [group],
+                                     'header_values': [[(job_id,)],
+                                                       [(job_id,)]]}
+    return all_result_counts
+
+
 def get_info_for_clone(id, preserve_metahosts, queue_entry_filter_data=None):
     """\
     Retrieves all the information needed to clone a job.
@@ -1609,6 +1634,152 @@ def get_host_diagnosis_interval(host_id, end_time, success):
                 host_id, end_time, success)
 
 
+def _group_host_ids_by_shard(host_ids):
+    """Group hosts by the shard that owns them.
+
+    @param host_ids     Ids in the database of the hosts.
+
+    @return A dictionary mapping shard hostnames to the ids of the
+            hosts they own.  Hosts that this server owns, either
+            because they have no shard or because this server is a
+            shard, are listed under `None`.  Unknown hosts are left
+            out.
+
+    """
+    if utils.is_shard():
+        return {None: list(host_ids)}
+    host_ids_by_shard = collections.defaultdict(list)
+    rows = models.Host.objects.filter(id__in=host_ids).values_list(
+            'id', 'shard__hostname')
+    for host_id, shard_hostname in rows:
+        host_ids_by_shard[shard_hostname].append(host_id)
+    return host_ids_by_shard
+
+
+def get_special_tasks_for_hosts(host_ids, **filter_data):
+    """Get special task entries for many hosts.
+
+    Like `get_host_special_tasks()`, but for all the hosts in
+    `host_ids`, with a single query to each shard owning some of
+    them.
+
+    @param host_ids     Ids in the database of the target hosts.
+    @param filter_data  Filter keywords to pass to the underlying
+                        database query.
+
+    """
+    tasks = []
+    for shard_hostname, shard_host_ids in (
+            _group_host_ids_by_shard(host_ids).iteritems()):
+        if shard_hostname is None:
+            tasks.extend(get_special_tasks(host_id__in=shard_host_ids,
+                                           **filter_data))
+        else:
+            shard_afe = frontend.AFE(server=shard_hostname)
+            tasks.extend(shard_afe.run('get_special_tasks',
+                                       host_id__in=shard_host_ids,
+                                       **filter_data))
+    return tasks
+
+
+def get_status_tasks(host_ids, end_time):
+    """Get the "status tasks" for many hosts from the local shard.
+
+    Like `get_status_task()`, but for all the hosts in `host_ids`.
+    This call will not be forward to a shard; the receiving server
+    must be the shard that owns the hosts.
+
+    @param host_ids     Ids in the database of the target hosts.
+    @param end_time     Time reference for the hosts' status.
+
+    @return A list of tasks, at most one per host.  Hosts for which
+            no task is found are left out.
+
+    """
+    return rpc_utils.prepare_rows_as_nested_dicts(
+            status_history.get_status_tasks(host_ids, end_time),
+            ('host', 'queue_entry'))
+
+
+def get_host_status_tasks(host_ids, end_time):
+    """Get the "status tasks" for many hosts from their owning shards.
+
+    Like `get_host_status_task()`, but for all the hosts in
+    `host_ids`, with a single call to each shard owning some of them.
+
+    @param host_ids     Ids in the database of the target hosts.
+    @param end_time     Time reference for the hosts' status.
+
+    @return A list of tasks, at most one per host.  Hosts for which
+            no task is found are left out.
+
+    """
+    tasks = []
+    for shard_hostname, shard_host_ids in (
+            _group_host_ids_by_shard(host_ids).iteritems()):
+        if shard_hostname is None:
+            tasks.extend(get_status_tasks(shard_host_ids, end_time))
+        else:
+            shard_afe = frontend.AFE(server=shard_hostname)
+            tasks.extend(shard_afe.run('get_status_tasks',
+                                       host_ids=shard_host_ids,
+                                       end_time=end_time))
+    return tasks
+
+
+def get_diagnosis_intervals(host_ids, end_time, success):
+    """Find "diagnosis intervals" for many hosts on the local shard.
+
+    Like `get_host_diagnosis_interval()`, but for all the hosts in
+    `host_ids`.  This call will not be forward to a shard; the
+    receiving server must be the shard that owns the hosts.
+
+    @param host_ids     Ids in the database of the target hosts.
+    @param end_time     Time reference for the diagnosis intervals.
+    @param success      Whether the diagnosis intervals should start
+                        with a successful or failed status task.
+
+    @return A list of `[host_id, start, end]` lists, with the
+            timestamps of the beginning and the end of the interval of
+            each host.  Hosts that never changed state are left out.
+
+    """
+    intervals = status_history.get_diagnosis_intervals(
+            host_ids, end_time, success)
+    return [[host_id] + interval
+            for host_id, interval in intervals.iteritems()]
+
+
+def get_host_diagnosis_intervals(host_ids, end_time, success):
+    """Find "diagnosis intervals" for many hosts on their owning shards.
+
+    Like `get_host_diagnosis_interval()`, but for all the hosts in
+    `host_ids`, with a single call to each shard owning some of them.
+
+    @param host_ids     Ids in the database of the target hosts.
+    @param end_time     Time reference for the diagnosis intervals.
+    @param success      Whether the diagnosis intervals should start
+                        with a successful or failed status task.
+
+    @return A list of `[host_id, start, end]` lists, as returned by
+            `get_diagnosis_intervals()`.
+
+    """
+    intervals = []
+    for shard_hostname, shard_host_ids in (
+            _group_host_ids_by_shard(host_ids).iteritems()):
+        if shard_hostname is None:
+            intervals.extend(get_diagnosis_intervals(
+                    shard_host_ids, end_time, success))
+        else:
+            shard_afe = frontend.AFE(server=shard_hostname)
+            intervals.extend(shard_afe.run('get_diagnosis_intervals',
+                                           host_ids=shard_host_ids,
+                                           end_time=end_time,
+                                           success=success))
+    return intervals
+
+
 # support for host detail view
 
 def get_host_queue_entries_and_special_tasks(host, query_start=None,
@@ -2144,7 +2315,8 @@ def get_host_history(start_time, end_time, hosts=None, board=None, pool=None):
 
 
 def shard_heartbeat(shard_hostname, jobs=(), hqes=(), known_job_ids=(),
-                    known_host_ids=(), known_host_statuses=()):
+                    known_host_ids=(), known_host_statuses=(),
+                    heartbeat_sequence=None, host_status_updates=()):
     """Receive updates for job statuses from shards and assign hosts and jobs.
 
     @param shard_hostname: Hostname of the calling shard
@@ -2156,9 +2328,19 @@ def shard_heartbeat(shard_hostname, jobs=(), hqes=(), known_job_ids=(),
     @param known_job_ids: List of ids of jobs the shard already has.
     @param known_host_ids: List of ids of hosts the shard already has.
     @param known_host_statuses: List of statuses of hosts the shard already has.
+    @param heartbeat_sequence: The heartbeat_sequence of the last response the
+                               shard persisted. If None, the known_* lists
+                               are complete. Otherwise they are not sent, and
+                               the shard only sends what changed since then.
+    @param host_status_updates: List of (host id, status) pairs of hosts whose
+                                status changed since the heartbeat with
+                                sequence number |heartbeat_sequence|.
 
     @returns: Serialized representations of hosts, jobs, suite job keyvals
-              and their dependencies to be inserted into a shard's database.
+              and their dependencies to be inserted into a shard's database,
+              and the heartbeat_sequence to send in the next heartbeat. If
+              that is None, the next heartbeat needs the complete known_*
+              lists.
     """
     # The following alternatives to sending host and job ids in every heartbeat
     # have been considered:
@@ -2192,23 +2374,33 @@ def shard_heartbeat(shard_hostname, jobs=(), hqes=(), known_job_ids=(),
     # A NOT IN query with 5000 ids took about 30ms in tests made.
     # These numbers seem low enough to outweigh the disadvantages of the
     # solutions described above.
+    #
+    # With many shards the lists still add up on the master though, so the
+    # master also keeps the sequence number of the last response sent to each
+    # shard. A shard that persisted that response echoes the number, and then
+    # hosts and jobs already assigned to it are known to be on the shard. Only
+    # records that were never assigned to the shard and host statuses that
+    # changed are exchanged in that case, and the full lists are only sent
+    # after a missed response or every few heartbeats, to let the master
+    # report records that no longer belong to the shard.
     shard_obj = rpc_utils.retrieve_shard(shard_hostname=shard_hostname)
     rpc_utils.persist_records_sent_from_shard(shard_obj, jobs, hqes)
     assert len(known_host_ids) == len(known_host_statuses)
-    for i in range(len(known_host_ids)):
-        host_model = models.Host.objects.get(pk=known_host_ids[i])
-        if host_model.status != known_host_statuses[i]:
-            host_model.status = known_host_statuses[i]
-            host_model.save()
+    host_statuses = dict(zip(known_host_ids, known_host_statuses))
+    host_statuses.update(host_status_updates)
+    rpc_utils.update_host_statuses(host_statuses)
 
+    incremental, response_sequence = rpc_utils.start_shard_heartbeat(
+            shard_obj, heartbeat_sequence)
     hosts, jobs, suite_keyvals, inc_ids = rpc_utils.find_records_for_shard(
             shard_obj, known_job_ids=known_job_ids,
-            known_host_ids=known_host_ids)
+            known_host_ids=known_host_ids, incremental=incremental)
     return {
         'hosts': [host.serialize() for host in hosts],
         'jobs': [job.serialize() for job in jobs],
         'suite_keyvals': [kv.serialize() for kv in suite_keyvals],
         'incorrect_host_ids': [int(i) for i in inc_ids],
+        'heartbeat_sequence': response_sequence,
     }
 
 
@@ -2327,6 +2519,7 @@ def remove_board_from_shard(hostname, label):
           'Cannot remove label from shard that does not belong to it.')
 
     shard.labels.remove(label)
+    rpc_utils.reset_shard_heartbeat(shard)
     if label.is_replaced_by_static():
         static_label = models.StaticLabel.smart_get(label.name)
         models.Host.objects.filter(
@@ -2465,7 +2658,8 @@ def get_tests_by_build(build, ignore_invalid_tests=True):
             control_file = cfile_getter.get_control_file_contents(
                     control_file_path)
         try:
-            control_obj = control_data.parse_control_string(control_file)
+            control_obj = control_data.parse_control_string_cached(
+                    control_file)
         except:
             logging.info('Failed to parse control file: %s', control_file_path)
             if not ignore_invalid_tests:
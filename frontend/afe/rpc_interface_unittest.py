@@ -246,6 +246,44 @@ class ShardHeartbeatTest(mox.MoxTestBase, unittest.TestCase):
         self._do_heartbeat_and_assert_response(known_hosts=[host1])
 
 
+    def _testIncrementalHeartbeatHelper(self, shard1, host1, label1):
+        """Ensure only changes are exchanged once a heartbeat was acked."""
+        job1 = self._createJobForLabel(label1)
+        retval = rpc_interface.shard_heartbeat(shard_hostname=shard1.hostname)
+        self._assert_shard_heartbeat_response(
+                shard1.hostname, retval, jobs=[job1], hosts=[host1],
+                hqes=job1.hostqueueentry_set.all())
+        sequence = retval['heartbeat_sequence']
+        self.assertIsNotNone(sequence)
+
+        # Records the shard has are not sent again, host statuses are updated.
+        retval = rpc_interface.shard_heartbeat(
+                shard_hostname=shard1.hostname, heartbeat_sequence=sequence,
+                host_status_updates=[[host1.id, 'Running']])
+        self._assert_shard_heartbeat_response(shard1.hostname, retval)
+        self.assertEqual(models.Host.objects.get(pk=host1.id).status,
+                         'Running')
+        self.assertEqual(retval['heartbeat_sequence'], sequence + 1)
+        sequence = retval['heartbeat_sequence']
+
+        # New records are sent.
+        host2 = models.Host.objects.create(hostname='test_host2', leased=False)
+        host2.labels.add(label1)
+        job2 = self._createJobForLabel(label1)
+        retval = rpc_interface.shard_heartbeat(
+                shard_hostname=shard1.hostname, heartbeat_sequence=sequence)
+        self._assert_shard_heartbeat_response(
+                shard1.hostname, retval, jobs=[job2], hosts=[host2],
+                hqes=job2.hostqueueentry_set.all())
+
+        # The shard did not persist the last response, so it has to send a
+        # full heartbeat next.
+        retval = rpc_interface.shard_heartbeat(
+                shard_hostname=shard1.hostname, heartbeat_sequence=sequence)
+        self._assert_shard_heartbeat_response(shard1.hostname, retval)
+        self.assertIsNone(retval['heartbeat_sequence'])
+
+
 class RpcInterfaceTestWithStaticAttribute(
         mox.MoxTestBase, unittest.TestCase,
         frontend_test_utils.FrontendTestMixin):
@@ -688,6 +726,12 @@ class RpcInterfaceTestWithStaticLabel(ShardHeartbeatTest,
         self._testResendHostsAfterFailedHeartbeatHelper(host1)
 
 
+    def testIncrementalHeartbeat(self):
+        shard1, host1, label1 = self._createShardAndHostWithStaticLabel(
+                host_hostname='test_host1')
+        self._testIncrementalHeartbeatHelper(shard1, host1, label1)
+
+
 class RpcInterfaceTest(unittest.TestCase,
                        frontend_test_utils.FrontendTestMixin):
     def setUp(self):
@@ -815,16 +859,31 @@ class RpcInterfaceTest(unittest.TestCase,
         entries[2].aborted = True
         entries[2].save()
 
-        # Mock up tko_rpc_interface.get_status_counts.
+        other_job = self._create_job(hosts=[1])
+
+        # Mock up tko_rpc_interface.get_status_counts, which is called once
+        # for all the jobs.
+        group = {'afe_job_id': job.id, 'id': str([job.id]), 'group_count': 3,
+                 'pass_count': 1, 'complete_count': 3, 'incomplete_count': 0}
         self.god.stub_function_to_return(rpc_interface.tko_rpc_interface,
                                          'get_status_counts',
-                                         None)
-
-        job_summaries = rpc_interface.get_jobs_summary(id=job.id)
-        self.assertEquals(len(job_summaries), 1)
-        summary = job_summaries[0]
+                                         {'groups': [group],
+                                          'header_values': []})
+
+        job_summaries = rpc_interface.get_jobs_summary(
+                id__in=[job.id, other_job.id])
+        self.assertEquals(len(job_summaries), 2)
+        summaries = dict((summary['id'], summary)
+                         for summary in job_summaries)
+        summary = summaries[job.id]
         self.assertEquals(summary['status_counts'], {'Queued': 1,
                                                      'Failed': 2})
+        self.assertEquals(summary['result_counts']['groups'][0]['pass_count'],
+                          1)
+        self.assertEquals(summary['result_counts']['header_values'],
+                          [[[job.id]], [[job.id]]])
+        self.assertEquals(summaries[other_job.id]['result_counts'],
+                          {'groups': [], 'header_values': [[], []]})
 
 
     def _check_job_ids(self, actual_job_dicts, expected_jobs):
@@ -972,6 +1031,66 @@ class RpcInterfaceTest(unittest.TestCase,
         self.assertEquals(tasks[0]['id'], 2)
 
 
+    def _create_status_task(self, host, task, success, day):
+        return models.SpecialTask.objects.create(
+                host=host, task=task, success=success, is_complete=True,
+                time_started=datetime.datetime(2009, 1, day),
+                time_finished=datetime.datetime(2009, 1, day, 1),
+                requested_by=models.User.current_user())
+
+
+    def _setup_status_tasks(self):
+        Task = models.SpecialTask.Task
+        host1, host2 = self.hosts[0], self.hosts[1]
+        self._create_status_task(host1, Task.VERIFY, True, 1)
+        self._create_status_task(host1, Task.REPAIR, False, 2)
+        self._create_status_task(host1, Task.CLEANUP, False, 3)
+        self._create_status_task(host2, Task.VERIFY, True, 1)
+        self._create_status_task(host2, Task.VERIFY, True, 4)
+
+
+    def test_get_host_status_tasks(self):
+        self._setup_status_tasks()
+        host_ids = [h.id for h in self.hosts[:3]]
+        tasks = rpc_interface.get_host_status_tasks(host_ids,
+                                                    '2009-01-05 00:00:00')
+        by_host = dict((t['host']['hostname'], t['id']) for t in tasks)
+        self.assertEquals(by_host, {'host1': 2, 'host2': 5})
+        for host_id in host_ids:
+            task = rpc_interface.get_status_task(host_id,
+                                                 '2009-01-05 00:00:00')
+            self.assertEquals(task['id'] if task else None,
+                              by_host.get(self.hosts[host_id - 1].hostname))
+
+        tasks = rpc_interface.get_host_status_tasks(host_ids,
+                                                    '2009-01-03 00:00:00')
+        self.assertEquals(sorted(t['id'] for t in tasks), [2, 4])
+
+
+    def test_get_host_diagnosis_intervals(self):
+        self._setup_status_tasks()
+        host_ids = [h.id for h in self.hosts[:3]]
+        intervals = rpc_interface.get_host_diagnosis_intervals(
+                host_ids, '2009-01-05 00:00:00', True)
+        self.assertEquals(intervals, [[self.hosts[0].id,
+                                       '2009-01-01 00:00:00',
+                                       '2009-01-02 01:00:00']])
+        self.assertEquals(
+                intervals[0][1:],
+                rpc_interface.get_host_diagnosis_interval(
+                        self.hosts[0].id, '2009-01-05 00:00:00', True))
+        self.assertEquals(rpc_interface.get_host_diagnosis_intervals(
+                host_ids, '2009-01-05 00:00:00', False), [])
+
+
+    def test_get_special_tasks_for_hosts(self):
+        self._setup_status_tasks()
+        tasks = rpc_interface.get_special_tasks_for_hosts(
+                [self.hosts[1].id, self.hosts[2].id],
+                time_started__gte='2009-01-02 00:00:00')
+        self.assertEquals([t['id'] for t in tasks], [5])
+
+
     def _common_entry_check(self, entry_dict):
         self.assertEquals(entry_dict['host']['hostname'], 'host1')
         self.assertEquals(entry_dict['job']['id'], 2)
@@ -1221,6 +1340,8 @@ class RpcInterfaceTest(unittest.TestCase,
         mock_afe = self.god.create_mock_class_obj(frontend_wrappers.RetryingAFE,
                                                   'MockAFE')
         self.god.stub_with(frontend_wrappers, 'RetryingAFE', mock_afe)
+        # Call the shards one at a time, in the order the mocks expect.
+        self.god.stub_with(rpc_utils, 'SHARD_RPC_FANOUT_WORKERS', 1)
 
         # The statuses of one host might differ on master and shard.
         # Filters are always applied on the master. So the host on the shard
@@ -1875,5 +1996,10 @@ class ExtraRpcInterfaceTest(frontend_test_utils.FrontendTestMixin,
         self._testResendHostsAfterFailedHeartbeatHelper(host1)
 
 
+    def testIncrementalHeartbeat(self):
+        shard1, host1, label1 = self._createShardAndHostWithLabel()
+        self._testIncrementalHeartbeatHelper(shard1, host1, label1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -7,12 +7,16 @@ only RPC interface functions go into that file.
 __author__ = 'showard@google.com (Steve Howard)'
 
 import collections
+import contextlib
 import datetime
 from functools import wraps
 import inspect
 import logging
 import os
 import sys
+import time
+from multiprocessing import pool as multiprocessing_pool
+import django.db
 import django.db.utils
 import django.http
 
@@ -21,16 +25,36 @@ from autotest_lib.frontend.afe import models, model_logic
 from autotest_lib.client.common_lib import control_data, error
 from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib import time_utils
+from autotest_lib.client.common_lib import utils
 from autotest_lib.client.common_lib.cros import dev_server
 from autotest_lib.server import utils as server_utils
 from autotest_lib.server.cros import provision
 from autotest_lib.server.cros.dynamic_suite import frontend_wrappers
 
+try:
+    from chromite.lib import metrics
+except ImportError:
+    metrics = utils.metrics_mock
+
 NULL_DATETIME = datetime.datetime.max
 NULL_DATE = datetime.date.max
 DUPLICATE_KEY_MSG = 'Duplicate entry'
 RESPECT_STATIC_LABELS = global_config.global_config.get_config_value(
         'SKYLAB', 'respect_static_labels', type=bool, default=False)
+# Number of incremental heartbeats after which a shard is asked to send the
+# complete lists of hosts and jobs it knows again.
+HEARTBEAT_FULL_SYNC_INTERVAL = global_config.global_config.get_config_value(
+        'SHARD', 'heartbeat_full_sync_interval', type=int, default=60)
+# Maximum number of shards an RPC is forwarded to at the same time.
+SHARD_RPC_FANOUT_WORKERS = global_config.global_config.get_config_value(
+        'SHARD', 'rpc_fanout_workers', type=int, default=8)
+# Seconds the master waits for each shard to run a forwarded RPC, retries
+# included, when forwarding to several shards at once.
+SHARD_RPC_FANOUT_TIMEOUT_SECS = global_config.global_config.get_config_value(
+        'SHARD', 'rpc_fanout_timeout_secs', type=int, default=30 * 60)
+# Maximum number of records loaded by a single query when persisting records
+# sent from a shard.
+_PERSIST_RECORDS_CHUNK_SIZE = 500
 
 def prepare_for_serialization(objects):
     """
@@ -946,25 +970,111 @@ def retrieve_shard(shard_hostname):
     return models.Shard.smart_get(shard_hostname)
 
 
-def find_records_for_shard(shard, known_job_ids, known_host_ids):
+def find_records_for_shard(shard, known_job_ids, known_host_ids,
+                           incremental=False):
     """Find records that should be sent to a shard.
 
     @param shard: Shard to find records for.
     @param known_job_ids: List of ids of jobs the shard already has.
     @param known_host_ids: List of ids of hosts the shard already has.
+    @param incremental: If True, the shard has persisted all records sent to
+                        it before and the known ids are not used.
 
     @returns: Tuple of lists:
               (hosts, jobs, suite_job_keyvals, invalid_host_ids)
     """
     hosts, invalid_host_ids = models.Host.assign_to_shard(
-            shard, known_host_ids)
-    jobs = models.Job.assign_to_shard(shard, known_job_ids)
+            shard, known_host_ids, incremental=incremental)
+    jobs = models.Job.assign_to_shard(shard, known_job_ids,
+                                      incremental=incremental)
     parent_job_ids = [job.parent_job_id for job in jobs]
     suite_job_keyvals = models.JobKeyval.objects.filter(
             job_id__in=parent_job_ids)
     return hosts, jobs, suite_job_keyvals, invalid_host_ids
 
 
+def start_shard_heartbeat(shard, heartbeat_sequence):
+    """Check a heartbeat's sequence number against the master's record.
+
+    @param shard: The shard sending the heartbeat.
+    @param heartbeat_sequence: The sequence number of the last heartbeat
+                               response the shard persisted, or None if the
+                               shard sent the complete lists of records it
+                               knows.
+
+    @returns: Tuple (incremental, response_sequence). incremental is True if
+              records can be assigned without the shard's lists of known
+              records. response_sequence is the sequence number to send back
+              to the shard, or None to request a full heartbeat next time.
+    """
+    state, _ = models.ShardHeartbeatState.objects.get_or_create(shard=shard)
+    if heartbeat_sequence is None:
+        state.sequence += 1
+        state.full_sync_sequence = state.sequence
+        state.save()
+        return False, state.sequence
+
+    if heartbeat_sequence != state.sequence:
+        # The shard missed a response, or the master forgot about the shard.
+        # Only records that were never assigned to the shard are sent, which
+        # is always safe, and the next heartbeat resynchronizes everything.
+        logging.info('Shard %s sent heartbeat sequence %s, expected %s. '
+                     'Requesting a full heartbeat.', shard.hostname,
+                     heartbeat_sequence, state.sequence)
+        return True, None
+    if (state.sequence - state.full_sync_sequence >=
+        HEARTBEAT_FULL_SYNC_INTERVAL):
+        return True, None
+    state.sequence += 1
+    state.save()
+    return True, state.sequence
+
+
+def reset_shard_heartbeat(shard):
+    """Make the next heartbeat of a shard a full one.
+
+    This is needed whenever hosts or jobs stop belonging to a shard, as only
+    full heartbeats report records the shard should not have.
+
+    @param shard: The shard to reset.
+    """
+    models.ShardHeartbeatState.objects.filter(shard=shard).delete()
+
+
+def update_host_statuses(host_statuses):
+    """Set the statuses of hosts reported by a shard.
+
+    The hosts whose status differs are updated with a single statement.
+
+    @param host_statuses: Dictionary mapping host ids to their status.
+
+    @returns: Dictionary mapping the ids of the hosts that were updated to
+              their new status.
+    """
+    if not host_statuses:
+        return {}
+    current_statuses = models.Host.objects.filter(
+            id__in=host_statuses.keys()).values_list('id', 'status')
+    changed = dict((host_id, host_statuses[host_id])
+                   for host_id, status in current_statuses
+                   if status != host_statuses[host_id])
+    if not changed:
+        return {}
+
+    params = []
+    for host_id, status in changed.iteritems():
+        params.extend([host_id, status])
+    params.extend(changed.keys())
+    query = ('UPDATE afe_hosts SET status = CASE id %s END '
+             'WHERE id IN (%s)' % (' '.join(['WHEN %s THEN %s'] * len(changed)),
+                                   ','.join(['%s'] * len(changed))))
+    with contextlib.closing(django.db.connection.cursor()) as cursor:
+        cursor.execute(query, params)
+    django.db.transaction.commit_unless_managed()
+    logging.info('Updated host statuses: %s', changed)
+    return changed
+
+
 def _persist_records_with_type_sent_from_shard(
     shard, records, record_type, *args, **kwargs):
     """
@@ -982,12 +1092,19 @@ def _persist_records_with_type_sent_from_shard(
 
     @returns: List of primary keys of the processed records.
     """
+    # Load all the records at once, and check them all before writing any.
+    all_pks = [serialized_record['id'] for serialized_record in records]
+    current_records = {}
+    for start in xrange(0, len(all_pks), _PERSIST_RECORDS_CHUNK_SIZE):
+        current_records.update(record_type.objects.in_bulk(
+                all_pks[start:start + _PERSIST_RECORDS_CHUNK_SIZE]))
+
     pks = []
+    updates = []
     for serialized_record in records:
         pk = serialized_record['id']
-        try:
-            current_record = record_type.objects.get(pk=pk)
-        except record_type.DoesNotExist:
+        current_record = current_records.get(pk)
+        if current_record is None:
             raise error.UnallowedRecordsSentToMaster(
                 'Object with pk %s of type %s does not exist on master.' % (
                     pk, record_type))
@@ -1000,12 +1117,14 @@ def _persist_records_with_type_sent_from_shard(
             # variety. Silently skip this record.
             pass
         else:
-            current_record.update_from_serialized(serialized_record)
+            updates.append((current_record, serialized_record))
             pks.append(pk)
 
+    record_type.bulk_update_from_serialized(updates)
     return pks
 
 
+@django.db.transaction.commit_on_success
 def persist_records_sent_from_shard(shard, jobs, hqes):
     """
     Sanity checking then saving serialized records sent to master from shard.
@@ -1019,6 +1138,9 @@ def persist_records_sent_from_shard(shard, jobs, hqes):
     - Checking if the objects sent were assigned to this shard.
     - hostqueueentries must be sent together with their jobs.
 
+    All the records are checked before any is written, and they are written
+    in a single transaction.
+
     @param shard: The shard the records were sent from.
     @param jobs: The jobs the shard sent.
     @param hqes: The hostqueuentries the shart sent.
@@ -1081,16 +1203,12 @@ def fanout_rpc(host_objs, rpc_name, include_hostnames=True, **kwargs):
     shard_host_map = bucket_hosts_by_shard(host_objs)
 
     # Execute the rpc against the appropriate shards.
+    shard_kwargs = []
     for shard, hostnames in shard_host_map.iteritems():
+        shard_kwargs.append((shard, dict(kwargs)))
         if include_hostnames:
-            kwargs['hosts'] = hostnames
-        try:
-            run_rpc_on_multiple_hostnames(rpc_name, [shard], **kwargs)
-        except:
-            ei = sys.exc_info()
-            new_exc = error.RPCException('RPC %s failed on shard %s due to '
-                    '%s: %s' % (rpc_name, shard, ei[0].__name__, ei[1]))
-            raise new_exc.__class__, new_exc, ei[2]
+            shard_kwargs[-1][1]['hosts'] = hostnames
+    _run_rpc_on_shards(rpc_name, shard_kwargs)
 
 
 def run_rpc_on_multiple_hostnames(rpc_call, shard_hostnames, **kwargs):
@@ -1102,13 +1220,111 @@ def run_rpc_on_multiple_hostnames(rpc_call, shard_hostnames, **kwargs):
     @param rpc_call: Name of the rpc endpoint to call.
     @param shard_hostnames: List of hostnames to run the rpcs on.
     @param **kwargs: Keyword arguments to pass in the rpcs.
+
+    @raises error.ShardRPCException: if the rpc failed on any of the shards.
+    """
+    _run_rpc_on_shards(rpc_call, [(shard_hostname, kwargs)
+                                  for shard_hostname in shard_hostnames])
+
+
+def _run_rpc_on_shard(user, shard_hostname, rpc_call, kwargs):
+    """Runs an rpc on a shard, and records how long it took.
+
+    @param user: The user to run the rpc as.
+    @param shard_hostname: Hostname of the shard.
+    @param rpc_call: Name of the rpc endpoint to call.
+    @param kwargs: Keyword arguments to pass in the rpc.
+
+    @returns: None if the rpc succeeded, sys.exc_info() of its failure
+              otherwise.
+    """
+    start_time = time.time()
+    try:
+        afe = frontend_wrappers.RetryingAFE(server=shard_hostname, user=user)
+        afe.run(rpc_call, **kwargs)
+        return None
+    except Exception:
+        return sys.exc_info()
+    finally:
+        metrics.SecondsDistribution(
+                'chromeos/autotest/afe/shard_rpc_fanout/durations'
+        ).add(time.time() - start_time,
+              fields={'shard': shard_hostname, 'rpc': rpc_call})
+
+
+def _run_rpc_on_shards(rpc_call, shard_kwargs):
+    """Runs an rpc on several shards, concurrently.
+
+    Up to SHARD_RPC_FANOUT_WORKERS shards are called at the same time, so the
+    rpc takes about as long as on the slowest shard. A shard that did not
+    finish within SHARD_RPC_FANOUT_TIMEOUT_SECS is reported as failed; its
+    call is left running in the background.
+
+    @param rpc_call: Name of the rpc endpoint to call.
+    @param shard_kwargs: A list of (shard hostname, kwargs) tuples, the
+                         keyword arguments to pass in the rpc to each shard.
+
+    @raises error.ShardRPCException: once every shard finished, if the rpc
+            failed on any of them.
     """
     # Make sure this function is not called on shards but only on master.
     assert not server_utils.is_shard()
-    for shard_hostname in shard_hostnames:
-        afe = frontend_wrappers.RetryingAFE(server=shard_hostname,
-                                            user=thread_local.get_user())
-        afe.run(rpc_call, **kwargs)
+    # The user is local to the calling thread, so it is passed to the workers.
+    user = thread_local.get_user()
+    calls = [(user, shard_hostname, rpc_call, kwargs)
+             for shard_hostname, kwargs in shard_kwargs]
+
+    failures = collections.OrderedDict()
+    workers = min(SHARD_RPC_FANOUT_WORKERS, len(calls))
+    if workers <= 1:
+        for call in calls:
+            exc_info = _run_rpc_on_shard(*call)
+            if exc_info:
+                failures[call[1]] = exc_info
+    else:
+        thread_pool = multiprocessing_pool.ThreadPool(workers)
+        try:
+            results = [(call[1], thread_pool.apply_async(_run_rpc_on_shard,
+                                                         call))
+                       for call in calls]
+            deadline = time.time() + SHARD_RPC_FANOUT_TIMEOUT_SECS
+            for shard_hostname, result in results:
+                try:
+                    exc_info = result.get(max(0, deadline - time.time()))
+                except multiprocessing_pool.TimeoutError:
+                    exc_info = sys.exc_info()
+                if exc_info:
+                    failures[shard_hostname] = exc_info
+        finally:
+            # Let the calls that timed out finish in the background.
+            thread_pool.close()
+
+    metrics.Counter(
+            'chromeos/autotest/afe/shard_rpc_fanout/calls'
+    ).increment_by(len(calls), fields={'rpc': rpc_call})
+    if failures:
+        _raise_shard_rpc_failures(rpc_call, failures)
+
+
+def _raise_shard_rpc_failures(rpc_call, failures):
+    """Raise a single exception describing the failures of a forwarded rpc.
+
+    @param rpc_call: Name of the rpc endpoint called.
+    @param failures: An OrderedDict mapping the hostname of each shard the
+                     rpc failed on to sys.exc_info() of the failure.
+
+    @raises error.ShardRPCException: always, with the traceback of the first
+            failure.
+    """
+    descriptions = collections.OrderedDict(
+            (shard_hostname, '%s: %s' % (exc_info[0].__name__, exc_info[1]))
+            for shard_hostname, exc_info in failures.iteritems())
+    message = 'RPC %s failed on shard %s' % (
+            rpc_call, ', '.join('%s due to %s' % item
+                                for item in descriptions.iteritems()))
+    first_traceback = failures.values()[0][2]
+    new_exc = error.ShardRPCException(message, dict(descriptions))
+    raise new_exc.__class__, new_exc, first_traceback
 
 
 def get_label(name):
@@ -7,10 +7,12 @@
 """Unit tests for frontend/afe/rpc_utils.py."""
 
 import mock
+import threading
 import unittest
 
 import common
 from autotest_lib.client.common_lib import control_data
+from autotest_lib.client.common_lib import error
 from autotest_lib.frontend import setup_django_environment
 from autotest_lib.frontend.afe import frontend_test_utils
 from autotest_lib.frontend.afe import models
@@ -135,5 +137,143 @@ class AllowedHostsForMasterJobTest(unittest.TestCase):
         self.assertTrue(got)
 
 
+class PersistRecordsSentFromShardTest(unittest.TestCase,
+                                      frontend_test_utils.FrontendTestMixin):
+    """Unit tests for persist_records_sent_from_shard()."""
+
+    def setUp(self):
+        self._frontend_common_setup()
+        self.shard = models.Shard.objects.create(hostname='shard1')
+
+
+    def tearDown(self):
+        self._frontend_common_teardown()
+
+
+    def _serialize_finished(self, job):
+        """Serialize a job and its entries as a shard uploads them done."""
+        serialized_hqes = []
+        for hqe in job.hostqueueentry_set.all():
+            serialized = hqe.serialize(include_dependencies=False)
+            serialized.update(status='Completed', complete=True,
+                              finished_on='2018-01-02 03:04:05')
+            serialized_hqes.append(serialized)
+        return job.serialize(include_dependencies=False), serialized_hqes
+
+
+    def test_persist(self):
+        """Test the entries of uploaded jobs are updated."""
+        job1 = self._create_job(hosts=[1, 2], shard=self.shard)
+        job2 = self._create_job(hosts=[3], shard=self.shard)
+        serialized_job1, hqes1 = self._serialize_finished(job1)
+        serialized_job2, hqes2 = self._serialize_finished(job2)
+
+        rpc_utils.persist_records_sent_from_shard(
+                self.shard, [serialized_job1, serialized_job2],
+                hqes1 + hqes2)
+
+        for hqe in models.HostQueueEntry.objects.filter(
+                job__in=[job1, job2]):
+            self.assertEqual(hqe.status, 'Completed')
+            self.assertTrue(hqe.complete)
+            self.assertEqual(str(hqe.finished_on), '2018-01-02 03:04:05')
+
+
+    def test_entries_without_job_skipped(self):
+        """Test entries are only updated if their job was sent too."""
+        job = self._create_job(hosts=[1], shard=self.shard)
+        _, hqes = self._serialize_finished(job)
+
+        rpc_utils.persist_records_sent_from_shard(self.shard, [], hqes)
+
+        hqe = models.HostQueueEntry.objects.get(job=job)
+        self.assertEqual(hqe.status, 'Queued')
+        self.assertFalse(hqe.complete)
+
+
+    def test_unknown_record(self):
+        """Test nothing is written if a record does not exist."""
+        job = self._create_job(hosts=[1], shard=self.shard)
+        serialized_job, hqes = self._serialize_finished(job)
+        unknown = dict(hqes[0], id=hqes[0]['id'] + 100)
+
+        self.assertRaises(error.UnallowedRecordsSentToMaster,
+                          rpc_utils.persist_records_sent_from_shard,
+                          self.shard, [serialized_job], hqes + [unknown])
+        hqe = models.HostQueueEntry.objects.get(job=job)
+        self.assertEqual(hqe.status, 'Queued')
+
+
+class _FakeShardAFE(object):
+    """A RetryingAFE whose run() blocks until released, or fails."""
+
+    started = None
+    release = None
+    failing_shards = ()
+
+    def __init__(self, server, user):
+        self.server = server
+
+
+    def run(self, call, **dargs):
+        self.started.release()
+        if not self.release.wait(5):
+            raise AssertionError('%s was not released' % self.server)
+        if self.server in self.failing_shards:
+            raise error.RPCException('%s is broken' % self.server)
+
+
+@mock.patch.object(rpc_utils.server_utils, 'is_shard', return_value=False)
+@mock.patch.object(rpc_utils.frontend_wrappers, 'RetryingAFE', _FakeShardAFE)
+class RunRpcOnShardsTest(unittest.TestCase):
+    """Unit tests for forwarding rpcs to several shards."""
+
+    _SHARDS = ['shard1', 'shard2', 'shard3']
+
+    def setUp(self):
+        _FakeShardAFE.started = threading.Semaphore(0)
+        _FakeShardAFE.release = threading.Event()
+        _FakeShardAFE.failing_shards = ()
+
+
+    def _release_when_all_started(self):
+        """Release the calls once they all run, i.e. run concurrently."""
+        def release():
+            for _ in self._SHARDS:
+                _FakeShardAFE.started.acquire()
+            _FakeShardAFE.release.set()
+        thread = threading.Thread(target=release)
+        thread.daemon = True
+        thread.start()
+
+
+    def test_concurrent(self, _):
+        """Test the rpc runs on all the shards at the same time."""
+        self._release_when_all_started()
+        rpc_utils.run_rpc_on_multiple_hostnames('modify_hosts_local',
+                                                self._SHARDS, id=1)
+
+
+    def test_failures_aggregated(self, _):
+        """Test the failures of all the shards are reported together."""
+        _FakeShardAFE.failing_shards = ('shard1', 'shard3')
+        self._release_when_all_started()
+        with self.assertRaises(error.ShardRPCException) as cm:
+            rpc_utils.run_rpc_on_multiple_hostnames('modify_hosts_local',
+                                                    self._SHARDS, id=1)
+        self.assertEqual(sorted(cm.exception.failures), ['shard1', 'shard3'])
+        self.assertIn('shard1 is broken', cm.exception.failures['shard1'])
+
+
+    def test_timeout(self, _):
+        """Test a shard that does not answer in time is reported."""
+        with mock.patch.object(rpc_utils, 'SHARD_RPC_FANOUT_TIMEOUT_SECS', 0):
+            with self.assertRaises(error.ShardRPCException) as cm:
+                rpc_utils.run_rpc_on_multiple_hostnames(
+                        'modify_hosts_local', self._SHARDS, id=1)
+        _FakeShardAFE.release.set()
+        self.assertEqual(sorted(cm.exception.failures), self._SHARDS)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -433,6 +433,7 @@ class AgentTask(object):
         if not models.DroneSet.drone_sets_enabled():
             return filtered_drones
 
+        scheduler_models.flush_pending_writes()
         hqes = models.HostQueueEntry.objects.filter(id__in=self.queue_entry_ids)
         if not hqes:
             # Only special tasks could be missing host queue entries
@@ -607,6 +608,7 @@ class SpecialAgentTask(AgentTask, TaskWithJobKeyvals):
 
         assert self.TASK_TYPE is not None, 'self.TASK_TYPE must be overridden'
 
+        scheduler_models.flush_pending_writes()
         self.host = rdb_lib.get_hosts([task.host.id])[0]
         self.host.dbg_str = 'Task: %s' % str(task)
         self.queue_entry = None
@@ -746,6 +748,7 @@ class SpecialAgentTask(AgentTask, TaskWithJobKeyvals):
         self._parse_results([self.queue_entry])
 
         # Also fail all other special tasks that have not yet run for this HQE
+        scheduler_models.flush_pending_writes()
         pending_tasks = models.SpecialTask.objects.filter(
                 queue_entry__id=self.queue_entry.id,
                 is_complete=0)
@@ -775,6 +778,7 @@ class SpecialAgentTask(AgentTask, TaskWithJobKeyvals):
             the same as of special_task_to_remove.
 
         """
+        scheduler_models.flush_pending_writes()
         queued_special_tasks = models.SpecialTask.objects.filter(
             host__id=self.host.id,
             task=special_task_to_remove,
@@ -0,0 +1,434 @@
+#!/usr/bin/python
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Fork server that launches autoserv and parse processes on a drone.
+
+Starting autoserv or tko/parse costs seconds of CPU, most of it spent importing
+the server side libraries and the Django models. The fork server imports them
+once, and forks a child for each process drone_utility asks it to start. The
+child then runs the requested script as __main__, as a freshly started
+interpreter would.
+
+The children look like the processes drone_utility starts itself:
+  * they are reparented to init and lead their own session,
+  * their name (comm) is the basename of the script, and their command line
+    the requested argv when setproctitle is available,
+  * they carry the dark mark, since the fork server is started by
+    drone_utility with it in its environment,
+  * autoserv and parse write their pidfiles themselves, as usual.
+
+The server exits when the autotest code it imported or the global config
+changes on disk, or after being idle for a while. drone_utility starts it
+again when needed, and runs the command itself whenever the server is not
+available.
+"""
+
+import argparse
+import cPickle as pickle
+import ctypes
+import errno
+import fcntl
+import logging
+import os
+import random
+import runpy
+import signal
+import socket
+import subprocess
+import sys
+import traceback
+
+import common
+from autotest_lib.client.common_lib import global_config
+
+try:
+    import setproctitle
+except ImportError:
+    setproctitle = None
+
+
+# Scripts the fork server can run, by basename.
+FORKABLE_COMMANDS = ('autoserv', 'parse')
+SOCKET_PATH = os.path.join(common.autotest_dir, 'logs',
+                           'drone_fork_server.sock')
+LOG_PATH = os.path.join(common.autotest_dir, 'logs', 'drone_fork_server.log')
+
+# Modules imported by the fork server before it accepts requests.
+_PRELOAD_MODULES = (
+        'autotest_lib.server.autoserv_parser',
+        'autotest_lib.server.autotest',
+        'autotest_lib.server.hosts',
+        'autotest_lib.server.server_job',
+        'autotest_lib.server.server_logging_config',
+        'autotest_lib.server.site_utils',
+        'autotest_lib.site_utils.job_directories',
+        'autotest_lib.site_utils.lxc',
+        'autotest_lib.tko.parse',
+)
+# Seconds without requests after which the server exits.
+_IDLE_EXIT_SECS = 60 * 60
+# Seconds a client waits for the server to answer.
+_CLIENT_TIMEOUT_SECS = 30
+_PR_SET_NAME = 15
+# Length limit of a process name (comm), including the trailing NUL.
+_TASK_COMM_LEN = 16
+_MAX_FD = 1024
+
+
+class _ChildStart(Exception):
+    """Raised in a freshly forked child to unwind the server's stack."""
+
+    def __init__(self, request):
+        super(_ChildStart, self).__init__()
+        self.request = request
+
+
+def _receive(conn):
+    """Read a pickled message sent until end of file on a connection."""
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return pickle.loads(''.join(chunks))
+
+
+def _send(conn, message):
+    conn.sendall(pickle.dumps(message, pickle.HIGHEST_PROTOCOL))
+    conn.shutdown(socket.SHUT_WR)
+
+
+def _mtime(path):
+    """@return the mtime of path, or None if it does not exist."""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _module_mtimes():
+    """Map the source file of every imported module to its mtime.
+
+    The global config and its shadow are included too, so that a config
+    change is noticed like a code change. They are kept even while missing,
+    so that creating a shadow config is noticed as well.
+    """
+    mtimes = {}
+    for module in sys.modules.values():
+        path = getattr(module, '__file__', None)
+        if not path:
+            continue
+        if path.endswith(('.pyc', '.pyo')):
+            path = path[:-1]
+        mtime = _mtime(path)
+        if mtime is not None:
+            mtimes[path] = mtime
+    config = global_config.global_config
+    for path in (config.config_file, config.shadow_file):
+        if path:
+            mtimes[path] = _mtime(path)
+    return mtimes
+
+
+def _set_process_name(argv):
+    """Make the process look like a process started with argv."""
+    if setproctitle:
+        setproctitle.setproctitle(' '.join(argv))
+    name = os.path.basename(argv[0])[:_TASK_COMM_LEN - 1]
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.prctl(_PR_SET_NAME, ctypes.c_char_p(name), 0, 0, 0)
+    except (OSError, AttributeError):
+        pass
+
+
+class ForkServer(object):
+    """Serves requests to start processes on a unix socket."""
+
+    def __init__(self, socket_path, preload_modules=_PRELOAD_MODULES,
+                 idle_exit_secs=_IDLE_EXIT_SECS):
+        """
+        @param socket_path: Path of the unix socket to listen on.
+        @param preload_modules: Names of the modules to import before
+                                accepting requests.
+        @param idle_exit_secs: Seconds without requests after which serve()
+                               returns.
+        """
+        self._socket_path = socket_path
+        self._preload_modules = preload_modules
+        self._idle_exit_secs = idle_exit_secs
+        self._pid = os.getpid()
+        self._lock_file = None
+        self._socket = None
+        self._module_mtimes = {}
+
+
+    def serve(self):
+        """Serve requests until the server goes idle or stale.
+
+        @raises _ChildStart: in a child process that must run a request.
+        """
+        self._lock_file = open(self._socket_path + '.lock', 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                logging.info('Another fork server is running.')
+                return
+            raise
+
+        self._preload()
+        self._module_mtimes = _module_mtimes()
+        try:
+            os.unlink(self._socket_path)
+        except OSError:
+            pass
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.bind(self._socket_path)
+            os.chmod(self._socket_path, 0600)
+            self._socket.listen(32)
+            self._socket.settimeout(self._idle_exit_secs)
+            logging.info('Fork server %d listening on %s', self._pid,
+                         self._socket_path)
+            while True:
+                try:
+                    conn, _ = self._socket.accept()
+                except socket.timeout:
+                    logging.info('Idle for %d seconds, exiting.',
+                                 self._idle_exit_secs)
+                    return
+                try:
+                    conn.settimeout(_CLIENT_TIMEOUT_SECS)
+                    if not self._handle(conn):
+                        return
+                finally:
+                    conn.close()
+        finally:
+            self._socket.close()
+            if os.getpid() != self._pid:
+                # The server keeps holding the lock.
+                self._lock_file.close()
+            else:
+                try:
+                    os.unlink(self._socket_path)
+                except OSError:
+                    pass
+
+
+    def _preload(self):
+        for name in self._preload_modules:
+            try:
+                __import__(name)
+            except Exception:
+                logging.exception('Failed to preload %s', name)
+
+
+    def _code_changed(self):
+        for path, mtime in self._module_mtimes.iteritems():
+            if _mtime(path) != mtime:
+                return True
+        return False
+
+
+    def _handle(self, conn):
+        """Handle one request.
+
+        @param conn: The connection of the client.
+
+        @returns False if the server must exit.
+        """
+        request = _receive(conn)
+        if self._code_changed():
+            logging.info('Autotest code or config changed, exiting.')
+            _send(conn, {'error': 'fork server is stale'})
+            return False
+        try:
+            pid = self._fork(request)
+        except _ChildStart:
+            raise
+        except Exception as e:
+            logging.exception('Failed to start %s', request.get('argv'))
+            _send(conn, {'error': str(e)})
+            return True
+        logging.info('Started %d: %s', pid, ' '.join(request['argv']))
+        _send(conn, {'pid': pid})
+        return True
+
+
+    def _fork(self, request):
+        """Fork a detached child for a request.
+
+        @param request: The request dictionary.
+
+        @returns The pid of the child.
+        @raises _ChildStart: in the child.
+        """
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Fork again, so the child is reparented to init and does not
+            # need to be reaped by the server.
+            try:
+                os.close(read_fd)
+                os.setsid()
+                child_pid = os.fork()
+                if child_pid == 0:
+                    os.close(write_fd)
+                    raise _ChildStart(request)
+                os.write(write_fd, str(child_pid))
+            except _ChildStart:
+                raise
+            except BaseException:
+                os._exit(1)
+            os._exit(0)
+        os.close(write_fd)
+        try:
+            chunks = []
+            while True:
+                chunk = os.read(read_fd, 64)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            os.close(read_fd)
+            os.waitpid(pid, 0)
+        if not chunks:
+            raise OSError('Failed to fork %s' % request['argv'])
+        return int(''.join(chunks))
+
+
+def _run_child(request):
+    """Run the script a request asks for, in the current process.
+
+    Sets up the process like drone_utility.execute_command sets up the
+    processes it starts, then runs the script as __main__. Exits with the
+    script, through SystemExit.
+
+    @param request: The request dictionary.
+    """
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.setLevel(logging.WARNING)
+
+    os.chdir(request['cwd'])
+    stdin_fd = os.open(os.devnull, os.O_RDONLY)
+    out_fd = os.open(request['log_file'] or os.devnull,
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    os.dup2(stdin_fd, 0)
+    os.dup2(out_fd, 1)
+    os.dup2(out_fd, 2)
+    os.closerange(3, _MAX_FD)
+    sys.stdin = os.fdopen(0, 'r')
+    # The scripts run with python -u.
+    sys.stdout = os.fdopen(1, 'w', 0)
+    sys.stderr = os.fdopen(2, 'w', 0)
+
+    os.environ.clear()
+    os.environ.update(request['env'])
+    random.seed()
+    argv = request['argv']
+    _set_process_name(argv)
+    sys.argv = list(argv)
+    sys.path[0] = os.path.dirname(os.path.realpath(argv[0]))
+    # Let the script import its own common module.
+    sys.modules.pop('common', None)
+    runpy.run_path(argv[0], run_name='__main__')
+
+
+def spawn(argv, log_file, socket_path=SOCKET_PATH):
+    """Ask the fork server to start a process.
+
+    If no fork server answers, a new one is started in the background for the
+    next calls.
+
+    @param argv: The command to run. Its first item is a script whose basename
+                 is in FORKABLE_COMMANDS.
+    @param log_file: File the output of the process is appended to, or None.
+    @param socket_path: Path of the socket of the fork server.
+
+    @returns The pid of the started process, or None if the caller has to
+             start it itself.
+    """
+    request = {'argv': list(argv), 'log_file': log_file, 'cwd': os.getcwd(),
+               'env': dict(os.environ)}
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(_CLIENT_TIMEOUT_SECS)
+    try:
+        try:
+            conn.connect(socket_path)
+        except socket.error:
+            start_server(socket_path)
+            return None
+        _send(conn, request)
+        reply = _receive(conn)
+    except (socket.error, EOFError, pickle.UnpicklingError) as e:
+        logging.warning('Fork server on %s failed: %s', socket_path, e)
+        return None
+    finally:
+        conn.close()
+    if 'error' in reply:
+        logging.warning('Fork server on %s failed: %s', socket_path,
+                        reply['error'])
+        return None
+    return reply['pid']
+
+
+def start_server(socket_path=SOCKET_PATH, log_path=LOG_PATH):
+    """Start a fork server in the background.
+
+    The server inherits the environment of the caller, including the dark
+    mark drone_utility sets.
+
+    @param socket_path: Path of the socket the server listens on.
+    @param log_path: Path of the server's log file.
+    """
+    with open(os.devnull, 'r') as stdin, open(log_path, 'a') as log_file:
+        subprocess.Popen(
+                [sys.executable, '-u', os.path.abspath(__file__),
+                 '--socket', socket_path],
+                stdin=stdin, stdout=log_file, stderr=subprocess.STDOUT,
+                close_fds=True, preexec_fn=os.setsid)
+
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(
+            description='Fork server for autoserv and parse processes.')
+    parser.add_argument('--socket', default=SOCKET_PATH,
+                        help='Path of the unix socket to listen on.')
+    parser.add_argument('--no-preload', action='store_true',
+                        help='Do not import any module ahead of time.')
+    parser.add_argument('--idle-exit-secs', type=int,
+                        default=_IDLE_EXIT_SECS,
+                        help='Exit after being idle for that many seconds.')
+    return parser.parse_args(args)
+
+
+def main():
+    args = _parse_args(sys.argv[1:])
+    logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s %(process)d %(levelname)s %(message)s')
+    preload_modules = () if args.no_preload else _PRELOAD_MODULES
+    server = ForkServer(args.socket, preload_modules=preload_modules,
+                        idle_exit_secs=args.idle_exit_secs)
+    try:
+        server.serve()
+    except _ChildStart as child:
+        try:
+            _run_child(child.request)
+        except SystemExit:
+            raise
+        except BaseException:
+            traceback.print_exc()
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
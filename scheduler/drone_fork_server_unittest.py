@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Tests for drone_fork_server."""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import mock
+
+import common
+from autotest_lib.client.common_lib import global_config
+from autotest_lib.scheduler import drone_fork_server
+
+
+_SCRIPT = '''#!/usr/bin/python
+import json, os, sys
+with open(os.path.join(os.path.dirname(__file__), 'report.json'), 'w') as f:
+    json.dump({'argv': sys.argv, 'cwd': os.getcwd(), 'name': __name__,
+               'comm': open('/proc/self/comm').read().strip(),
+               'env': os.environ.get('FORK_SERVER_TEST'),
+               'pid': os.getpid(), 'sid': os.getsid(0)}, f)
+print 'output'
+'''
+
+
+class ForkServerTest(unittest.TestCase):
+    """Tests running commands through a fork server."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.socket_path = os.path.join(self.tempdir, 'server.sock')
+        self.script = os.path.join(self.tempdir, 'autoserv')
+        with open(self.script, 'w') as f:
+            f.write(_SCRIPT)
+        os.chmod(self.script, 0755)
+        self.server = subprocess.Popen(
+                [sys.executable, drone_fork_server.__file__.rstrip('c'),
+                 '--socket', self.socket_path, '--no-preload',
+                 '--idle-exit-secs', '30'])
+        self.addCleanup(self._stop_server)
+        self._wait_for(lambda: os.path.exists(self.socket_path))
+
+
+    def _stop_server(self):
+        if self.server.poll() is None:
+            self.server.kill()
+        self.server.wait()
+
+
+    def _wait_for(self, condition):
+        deadline = time.time() + 10
+        while not condition():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+
+
+    def _read_report(self):
+        path = os.path.join(self.tempdir, 'report.json')
+        self._wait_for(lambda: os.path.exists(path))
+        # Let the script finish writing it.
+        time.sleep(0.2)
+        with open(path) as f:
+            return json.load(f)
+
+
+    def test_spawn(self):
+        """Test a spawned child runs like a freshly started script."""
+        log_file = os.path.join(self.tempdir, 'log')
+        with mock.patch.dict(os.environ, {'FORK_SERVER_TEST': 'marked'}):
+            pid = drone_fork_server.spawn([self.script, '-r', 'results'],
+                                          log_file,
+                                          socket_path=self.socket_path)
+        report = self._read_report()
+        self.assertEqual(report['pid'], pid)
+        self.assertNotEqual(report['sid'], os.getsid(0))
+        self.assertEqual(report['argv'], [self.script, '-r', 'results'])
+        self.assertEqual(report['cwd'], os.getcwd())
+        self.assertEqual(report['name'], '__main__')
+        self.assertEqual(report['comm'], 'autoserv')
+        self.assertEqual(report['env'], 'marked')
+        with open(log_file) as f:
+            self.assertEqual(f.read(), 'output\n')
+
+
+    def test_stale_server_exits(self):
+        """Test the server refuses requests and exits once code changed."""
+        common_path = common.__file__.rstrip('c')
+        stat = os.stat(common_path)
+        self.addCleanup(os.utime, common_path, (stat.st_atime, stat.st_mtime))
+        os.utime(common_path, (stat.st_atime, stat.st_mtime + 1))
+        self.assertIsNone(drone_fork_server.spawn(
+                [self.script], None, socket_path=self.socket_path))
+        self._wait_for(lambda: self.server.poll() is not None)
+        self.assertFalse(os.path.exists(self.socket_path))
+
+
+    def test_config_change_exits(self):
+        """Test the server exits once the global config changed."""
+        config_path = global_config.global_config.config_file
+        stat = os.stat(config_path)
+        self.addCleanup(os.utime, config_path, (stat.st_atime, stat.st_mtime))
+        os.utime(config_path, (stat.st_atime, stat.st_mtime + 1))
+        self.assertIsNone(drone_fork_server.spawn(
+                [self.script], None, socket_path=self.socket_path))
+        self._wait_for(lambda: self.server.poll() is not None)
+
+
+class SpawnWithoutServerTest(unittest.TestCase):
+    """Tests spawn() when no fork server is running."""
+
+    def test_starts_server(self):
+        """Test a server is started for the next calls."""
+        socket_path = os.path.join(tempfile.gettempdir(), 'missing.sock')
+        with mock.patch.object(drone_fork_server,
+                               'start_server') as start_server:
+            self.assertIsNone(drone_fork_server.spawn(
+                    ['autoserv'], None, socket_path=socket_path))
+        start_server.assert_called_once_with(socket_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,14 +16,17 @@ import collections
 import datetime
 import getpass
 import itertools
+import json
 import logging
 import multiprocessing
 import os
 import pickle
 import shutil
 import signal
+import stat
 import subprocess
 import sys
+import tempfile
 import time
 import traceback
 
@@ -33,7 +36,7 @@ from autotest_lib.client.common_lib import error
 from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib import logging_manager
 from autotest_lib.client.common_lib import utils
-from autotest_lib.client.common_lib.cros import retry
+from autotest_lib.scheduler import drone_fork_server
 from autotest_lib.scheduler import drone_logging_config
 from autotest_lib.scheduler import scheduler_config
 from autotest_lib.server import subcommand
@@ -127,7 +130,12 @@ class DroneUtility(object):
             'SCHEDULER', 'check_processes_for_dark_mark', bool, False)
         use_pool = global_config.global_config.get_config_value(
             'SCHEDULER', 'drone_utility_refresh_use_pool', bool, False)
+        cache_file = global_config.global_config.get_config_value(
+            'SCHEDULER', 'drone_utility_refresh_cache_file',
+            default='') or _get_default_refresh_cache_file()
+        _process_scanner.load(cache_file)
         result, warnings = ProcessRefresher(check_mark, use_pool)(pidfile_paths)
+        _process_scanner.save(cache_file)
         self.warnings += warnings
         return result
 
@@ -223,12 +231,37 @@ class DroneUtility(object):
             self._warn('Pidfile %s already exists' % pidfile_path)
             os.remove(pidfile_path)
 
+        if self._spawn_with_fork_server(command, log_file):
+            out_file.close()
+            in_devnull.close()
+            return
         subprocess.Popen(command, stdout=out_file, stderr=subprocess.STDOUT,
                          stdin=in_devnull)
         out_file.close()
         in_devnull.close()
 
 
+    def _spawn_with_fork_server(self, command, log_file):
+        """Start a command through the drone fork server, if possible.
+
+        @param command: The command to run, as a list.
+        @param log_file: File the output of the command is appended to, or
+                         None.
+
+        @returns True if the fork server started the command.
+        """
+        use_fork_server = global_config.global_config.get_config_value(
+                scheduler_config.CONFIG_SECTION, 'drone_fork_server',
+                type=bool, default=False)
+        if (not use_fork_server or os.path.basename(command[0])
+                not in drone_fork_server.FORKABLE_COMMANDS):
+            return False
+        # Our dark mark was only set with os.putenv.
+        os.environ[DARK_MARK_ENVIRONMENT_VAR] = os.getenv(
+                DARK_MARK_ENVIRONMENT_VAR, str(os.getpid()))
+        return drone_fork_server.spawn(command, log_file) is not None
+
+
     def write_to_file(self, file_path, contents, is_retry=False):
         """Write the specified contents to the end of the given file.
 
@@ -434,6 +467,20 @@ class DroneUtility(object):
 
 
 _MAX_REFRESH_POOL_SIZE = 50
+# Process pool shared by all ProcessRefresher calls in this process.
+_refresh_pool = None
+
+
+def _get_refresh_pool(size):
+    """Return the process pool used to refresh processes, creating it if needed.
+
+    @param size: The number of processes of the pool, if it is created.
+    """
+    global _refresh_pool
+    if _refresh_pool is None:
+        _refresh_pool = multiprocessing.Pool(size)
+    return _refresh_pool
+
 
 class ProcessRefresher(object):
     """Object to refresh process information from give pidfiles.
@@ -452,6 +499,7 @@ class ProcessRefresher(object):
         self._check_mark = check_mark
         self._use_pool = use_pool
         self._pool = None
+        self._scanner = _process_scanner
 
 
     def __call__(self, pidfile_paths):
@@ -476,7 +524,7 @@ class ProcessRefresher(object):
             pool_size = max(
                     min(len(pidfile_paths), _MAX_REFRESH_POOL_SIZE),
                     1)
-            self._pool = multiprocessing.Pool(pool_size)
+            self._pool = _get_refresh_pool(pool_size)
         else:
             pool_size = 0
         logging.info('Refreshing %d pidfiles with %d helper processes',
@@ -508,19 +556,23 @@ class ProcessRefresher(object):
 
 
     def _read_pidfiles(self, pidfile_paths):
-        """Uses a process pool to read requested pidfile_paths."""
+        """Uses a process pool to read requested pidfile_paths.
+
+        Pidfiles that did not change since they were last read are not read
+        again.
+        """
+        pidfiles, changed_paths = self._scanner.get_cached_pidfiles(
+                pidfile_paths)
         if self._use_pool:
-            contents = self._pool.map(_read_pidfile, pidfile_paths)
-            contents = [c for c in contents if c is not None]
-            return {k: v for k, v in contents}
+            contents = self._pool.map(_read_pidfile, changed_paths)
         else:
-            pidfiles = {}
-            for path in pidfile_paths:
-                content = _read_pidfile(path)
-                if content is None:
-                    continue
-                pidfiles[content.path] = content.content
-            return pidfiles
+            contents = [_read_pidfile(path) for path in changed_paths]
+        for content in contents:
+            if content is None:
+                continue
+            pidfiles[content.path] = content.content
+            self._scanner.set_pidfile(content)
+        return pidfiles
 
 
     def _filter_proc_infos(self, proc_infos, command_name):
@@ -541,19 +593,26 @@ class ProcessRefresher(object):
         if not self._check_mark:
             return proc_infos, []
 
+        # Only processes that are new since the last scan are checked.
+        dark_marks = {}
+        for info in proc_infos:
+            marked = self._scanner.get_cached_dark_mark(info['pid'])
+            if marked is not None:
+                dark_marks[info['pid']] = marked
+        unknown_pids = [info['pid'] for info in proc_infos
+                        if info['pid'] not in dark_marks]
         if self._use_pool:
-            dark_marks = self._pool.map(
-                    _process_has_dark_mark,
-                    [info['pid'] for info in proc_infos]
-            )
+            new_marks = self._pool.map(_process_has_dark_mark, unknown_pids)
         else:
-            dark_marks = [_process_has_dark_mark(info['pid'])
-                          for info in proc_infos]
+            new_marks = [_process_has_dark_mark(pid) for pid in unknown_pids]
+        for pid, marked in itertools.izip(unknown_pids, new_marks):
+            dark_marks[pid] = marked
+            self._scanner.set_dark_mark(pid, marked)
 
         marked_proc_infos = []
         warnings = []
-        for marked, info in itertools.izip(dark_marks, proc_infos):
-            if marked:
+        for info in proc_infos:
+            if dark_marks[info['pid']]:
                 marked_proc_infos.append(info)
             else:
                 warnings.append(
@@ -617,7 +676,10 @@ def _process_has_dark_mark(pid):
 
 _PS_ARGS = ('pid', 'pgid', 'ppid', 'comm', 'args')
 def _get_process_info():
-    """Parse ps output for all process information.
+    """Get information about all the processes of the current user.
+
+    Equivalent to parsing the output of `ps x -o pid,pgid,ppid,comm,args`,
+    but reads /proc directly, see _ProcessScanner.
 
     @returns A generator of dicts. Each dict has the following keys:
         - comm: command_name,
@@ -626,17 +688,261 @@ def _get_process_info():
         - pid: process id,
         - args: args the command was invoked with,
     """
-    @retry.retry(subprocess.CalledProcessError,
-                    timeout_min=0.5, delay_sec=0.25)
-    def run_ps():
-        return subprocess.check_output(
-                ['/bin/ps', '--no-header', 'x', '-o', ','.join(_PS_ARGS)])
-
-    ps_output = run_ps()
-    # split each line into the columns output by ps
-    split_lines = [line.split(None, 4) for line in ps_output.splitlines()]
-    return (dict(itertools.izip(_PS_ARGS, line_components))
-            for line_components in split_lines)
+    return iter(_process_scanner.scan())
+
+
+def _get_default_refresh_cache_file():
+    """@returns the refresh cache file in a directory of the current user."""
+    return os.path.join(tempfile.gettempdir(),
+                        'autotest_drone_utility_%d' % os.getuid(),
+                        'refresh_cache.json')
+
+
+def _is_private_dir(path):
+    """Check only the current user can write to a directory.
+
+    @param path: Path of the directory.
+    @returns True if it is a directory of the current user that no one else
+             can write to.
+    """
+    try:
+        dir_stat = os.lstat(path)
+    except OSError:
+        return False
+    return (stat.S_ISDIR(dir_stat.st_mode) and
+            dir_stat.st_uid == os.getuid() and
+            not dir_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _encode_strings(value):
+    """Turn the unicode strings of a decoded refresh cache back into str."""
+    if isinstance(value, unicode):
+        return value.encode('latin-1')
+    if isinstance(value, list):
+        return tuple(_encode_strings(item) for item in value)
+    return value
+
+
+_PROC_DIR = '/proc'
+_BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+_TASK_COMM_LEN = 15
+# A pidfile modified this recently may be modified again without its mtime
+# changing, so its content is not cached.
+_RACY_MTIME_SECS = 2
+
+
+class _ProcessScanner(object):
+    """Incremental scanner of the processes and pidfiles of the drone.
+
+    Processes are identified by their pid and start time, so that the
+    command line and dark mark of a process are only read once, even if its
+    pid gets reused. Pidfile contents are cached by mtime and size. The caches
+    can be saved to and loaded from a JSON file, since drone_utility is usually
+    run once per scheduler tick. The file is only used in a directory no one
+    but the current user can write to.
+    """
+
+    def __init__(self, proc_dir=_PROC_DIR):
+        """
+        @param proc_dir: Where procfs is mounted.
+        """
+        self._proc_dir = proc_dir
+        # Maps a pid string to a tuple (start time, args, dark mark), where
+        # dark mark is None until it is checked.
+        self._processes = {}
+        # Maps a pidfile path to a tuple (mtime, size, content).
+        self._pidfiles = {}
+        self._loaded_from = None
+
+
+    def _boot_id(self):
+        try:
+            with open(_BOOT_ID_FILE) as f:
+                return f.read().strip()
+        except IOError:
+            return None
+
+
+    def load(self, path):
+        """Load the caches saved by a previous drone_utility run.
+
+        Does nothing if they were already loaded, saved on another boot, or if
+        the directory of the cache file is writable by other users.
+
+        @param path: Path of the cache file.
+        """
+        if self._loaded_from == path:
+            return
+        self._loaded_from = path
+        if not _is_private_dir(os.path.dirname(path)):
+            return
+        try:
+            with open(path) as f:
+                cache = json.load(f)
+            boot_id = cache['boot_id']
+            processes = dict((str(pid), _encode_strings(value))
+                             for pid, value in cache['processes'].iteritems())
+            pidfiles = dict((str(pidfile), _encode_strings(value))
+                            for pidfile, value in cache['pidfiles'].iteritems())
+        except Exception:
+            return
+        if boot_id == self._boot_id():
+            self._processes = processes
+            self._pidfiles = pidfiles
+
+
+    def save(self, path):
+        """Save the caches for the next drone_utility run.
+
+        @param path: Path of the cache file.
+        """
+        cache_dir = os.path.dirname(path)
+        tmp_path = '%s.%d' % (path, os.getpid())
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir, 0700)
+            if not _is_private_dir(cache_dir):
+                logging.warning('Not saving refresh cache, %s is writable by '
+                                'other users', cache_dir)
+                return
+            # Command lines and pidfiles are not necessarily valid UTF-8.
+            data = json.dumps({'boot_id': self._boot_id(),
+                               'processes': self._processes,
+                               'pidfiles': self._pidfiles},
+                              encoding='latin-1')
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.rename(tmp_path, path)
+        except (IOError, OSError, ValueError) as e:
+            logging.warning('Unable to save refresh cache %s: %s', path, e)
+
+
+    def _read_stat(self, pid):
+        """Read the stat file of a process.
+
+        @returns a tuple (comm, ppid, pgid, start time), or None if the process
+                 is gone.
+        """
+        try:
+            with open(os.path.join(self._proc_dir, pid, 'stat')) as f:
+                stat = f.read()
+        except IOError:
+            return None
+        # comm is in parentheses, and may contain spaces and parentheses.
+        # Newer kernels show longer names for kernel threads, ps truncates
+        # them to TASK_COMM_LEN.
+        comm = stat[stat.find('(') + 1:stat.rfind(')')][:_TASK_COMM_LEN]
+        fields = stat[stat.rfind(')') + 2:].split()
+        return comm, fields[1], fields[2], fields[19]
+
+
+    def _read_args(self, pid, comm):
+        try:
+            with open(os.path.join(self._proc_dir, pid, 'cmdline')) as f:
+                cmdline = f.read()
+        except IOError:
+            cmdline = ''
+        if not cmdline:
+            # Like ps, show kernel threads and zombies by name.
+            return '[%s]' % comm
+        return ' '.join(cmdline.rstrip('\0').split('\0'))
+
+
+    def scan(self):
+        """Scan the processes of the current user.
+
+        @returns a list of dicts, as returned by _get_process_info.
+        """
+        uid = os.geteuid()
+        processes = {}
+        proc_infos = []
+        for pid in os.listdir(self._proc_dir):
+            if not pid.isdigit():
+                continue
+            try:
+                if os.stat(os.path.join(self._proc_dir, pid)).st_uid != uid:
+                    continue
+            except OSError:
+                continue
+            stat = self._read_stat(pid)
+            if stat is None:
+                continue
+            comm, ppid, pgid, start_time = stat
+            cached = self._processes.get(pid)
+            if cached is None or cached[0] != start_time:
+                cached = (start_time, self._read_args(pid, comm), None)
+            processes[pid] = cached
+            proc_infos.append({'pid': pid, 'pgid': pgid, 'ppid': ppid,
+                               'comm': comm, 'args': cached[1]})
+        self._processes = processes
+        return proc_infos
+
+
+    def get_cached_dark_mark(self, pid):
+        """Return whether a process found by the last scan has a dark mark.
+
+        @param pid: The pid of the process.
+        @returns True or False, or None if it is not known.
+        """
+        cached = self._processes.get(str(pid))
+        return cached[2] if cached else None
+
+
+    def set_dark_mark(self, pid, dark_mark):
+        """Record whether a process found by the last scan has a dark mark.
+
+        @param pid: The pid of the process.
+        @param dark_mark: Whether the process has a dark mark.
+        """
+        cached = self._processes.get(str(pid))
+        if cached:
+            self._processes[str(pid)] = cached[:2] + (dark_mark,)
+
+
+    def get_cached_pidfiles(self, pidfile_paths):
+        """Get the content of the pidfiles that did not change.
+
+        Pidfiles that are missing are dropped from the cache.
+
+        @param pidfile_paths: A list of paths of pidfiles.
+        @returns a tuple (pidfiles, changed_paths), where pidfiles maps paths
+                 to the content of unchanged pidfiles, and changed_paths lists
+                 the paths of the other existing pidfiles.
+        """
+        pidfiles = {}
+        changed_paths = []
+        for path in pidfile_paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._pidfiles.pop(path, None)
+                continue
+            cached = self._pidfiles.get(path)
+            if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+                pidfiles[path] = cached[2]
+            else:
+                changed_paths.append(path)
+        return pidfiles, changed_paths
+
+
+    def set_pidfile(self, content):
+        """Record the content of a pidfile that was just read.
+
+        @param content: A _PidfileContent.
+        """
+        try:
+            stat = os.stat(content.path)
+        except OSError:
+            return
+        if (time.time() - stat.st_mtime > _RACY_MTIME_SECS
+            and stat.st_size == len(content.content)):
+            self._pidfiles[content.path] = (stat.st_mtime, stat.st_size,
+                                            content.content)
+        else:
+            self._pidfiles.pop(content.path, None)
+
+
+_process_scanner = _ProcessScanner()
 
 
 _PidfileContent = collections.namedtuple('_PidfileContent', ['path', 'content'])
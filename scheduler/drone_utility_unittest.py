@@ -3,6 +3,7 @@
 """Tests for drone_utility."""
 
 import os
+import stat
 import unittest
 
 import common
@@ -182,5 +183,117 @@ class TestProcessRefresher(unittest.TestCase):
                 'args': args}
 
 
+class TestProcessScanner(unittest.TestCase):
+    """Tests for the drone_utility._ProcessScanner object."""
+
+    def setUp(self):
+        self._tempdir = autotemp.tempdir(unique_id='test_process_scanner')
+        self.addCleanup(self._tempdir.clean)
+        self._proc_dir = os.path.join(self._tempdir.name, 'proc')
+        os.mkdir(self._proc_dir)
+        self._scanner = drone_utility._ProcessScanner(self._proc_dir)
+
+
+    def _write_proc(self, pid, comm, cmdline, start_time=100):
+        pid_dir = os.path.join(self._proc_dir, str(pid))
+        if not os.path.isdir(pid_dir):
+            os.mkdir(pid_dir)
+        stat = ('%d (%s) S 1 %d 5 0 -1 4194560 1 2 3 4 5 6 7 8 20 0 1 0 %d '
+                '1000 10' % (pid, comm, pid, start_time))
+        with open(os.path.join(pid_dir, 'stat'), 'w') as f:
+            f.write(stat)
+        with open(os.path.join(pid_dir, 'cmdline'), 'w') as f:
+            f.write(cmdline)
+
+
+    def test_scan(self):
+        """Processes are read from the proc directory like ps would."""
+        self._write_proc(3, 'autoserv', 'python\0autoserv\0-m\0host1\0')
+        self._write_proc(4, 'a (weird) name', 'weird')
+        self._write_proc(5, 'kthreadd', '')
+        os.mkdir(os.path.join(self._proc_dir, 'self'))
+        got = sorted(self._scanner.scan(), key=lambda info: info['pid'])
+        self.assertEqual(got, [
+                {'pid': '3', 'pgid': '3', 'ppid': '1', 'comm': 'autoserv',
+                 'args': 'python autoserv -m host1'},
+                {'pid': '4', 'pgid': '4', 'ppid': '1',
+                 'comm': 'a (weird) name', 'args': 'weird'},
+                {'pid': '5', 'pgid': '5', 'ppid': '1', 'comm': 'kthreadd',
+                 'args': '[kthreadd]'}])
+
+
+    def test_scan_caches_by_pid_and_start_time(self):
+        """Command lines and dark marks are reused until a pid is reused."""
+        self._write_proc(3, 'autoserv', 'autoserv\0')
+        self._scanner.scan()
+        self._scanner.set_dark_mark('3', True)
+        self._write_proc(3, 'autoserv', 'changed\0')
+        self.assertEqual(self._scanner.scan()[0]['args'], 'autoserv')
+        self.assertTrue(self._scanner.get_cached_dark_mark(3))
+
+        self._write_proc(3, 'autoserv', 'changed\0', start_time=200)
+        self.assertEqual(self._scanner.scan()[0]['args'], 'changed')
+        self.assertIsNone(self._scanner.get_cached_dark_mark(3))
+
+
+    def test_pidfiles_are_read_when_changed(self):
+        """Only pidfiles that changed since they were read are listed."""
+        path = os.path.join(self._tempdir.name, 'pidfile')
+        with open(path, 'w') as f:
+            f.write('123\n')
+        os.utime(path, (1000, 1000))
+        self.assertEqual(self._scanner.get_cached_pidfiles([path]),
+                         ({}, [path]))
+        self._scanner.set_pidfile(drone_utility._PidfileContent(path, '123\n'))
+        self.assertEqual(self._scanner.get_cached_pidfiles([path]),
+                         ({path: '123\n'}, []))
+
+        with open(path, 'a') as f:
+            f.write('0\n')
+        self.assertEqual(self._scanner.get_cached_pidfiles([path]),
+                         ({}, [path]))
+
+
+    def test_save_and_load(self):
+        """The caches survive a save and load."""
+        self._write_proc(3, 'autoserv', 'autoserv\0')
+        self._scanner.scan()
+        self._scanner.set_dark_mark('3', True)
+        path = os.path.join(self._tempdir.name, 'pidfile')
+        with open(path, 'w') as f:
+            f.write('123\n\xff')
+        os.utime(path, (1000, 1000))
+        self._scanner.set_pidfile(
+                drone_utility._PidfileContent(path, '123\n\xff'))
+        cache_file = os.path.join(self._tempdir.name, 'cache', 'cache.json')
+        self._scanner.save(cache_file)
+        self.assertEqual(
+                stat.S_IMODE(os.stat(os.path.dirname(cache_file)).st_mode),
+                0700)
+        scanner = drone_utility._ProcessScanner(self._proc_dir)
+        scanner.load(cache_file)
+        self.assertTrue(scanner.get_cached_dark_mark(3))
+        self.assertEqual(scanner.get_cached_pidfiles([path]),
+                         ({path: '123\n\xff'}, []))
+
+
+    def test_cache_in_shared_dir_is_ignored(self):
+        """The caches are not saved or loaded where others can write."""
+        self._write_proc(3, 'autoserv', 'autoserv\0')
+        self._scanner.scan()
+        self._scanner.set_dark_mark('3', True)
+        cache_dir = os.path.join(self._tempdir.name, 'cache')
+        cache_file = os.path.join(cache_dir, 'cache.json')
+        self._scanner.save(cache_file)
+        os.chmod(cache_dir, 0777)
+        scanner = drone_utility._ProcessScanner(self._proc_dir)
+        scanner.load(cache_file)
+        self.assertIsNone(scanner.get_cached_dark_mark(3))
+
+        os.remove(cache_file)
+        self._scanner.save(cache_file)
+        self.assertFalse(os.path.exists(cache_file))
+
+
 if __name__ == '__main__':
     unittest.main()
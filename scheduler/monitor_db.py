@@ -334,6 +334,11 @@ class Dispatcher(object):
                 global_config.global_config.get_config_value(
                         scheduler_config.CONFIG_SECTION,
                         'inline_host_acquisition', type=bool, default=True))
+        # If set, the HQE, host and job field writes done while handling the
+        # agents are merged and sent at once at the end of the step.
+        self._db_write_behind = global_config.global_config.get_config_value(
+                scheduler_config.CONFIG_SECTION, 'db_write_behind', type=bool,
+                default=False)
 
         # If _inline_host_acquisition is set the scheduler will acquire and
         # release hosts against jobs inline, with the tick. Otherwise the
@@ -405,8 +410,17 @@ class Dispatcher(object):
                 self._find_aborting()
             with breakdown_timer.Step('find_aborted_special_tasks'):
                 self._find_aborted_special_tasks()
-            with breakdown_timer.Step('handle_agents'):
-                self._handle_agents()
+            if self._db_write_behind:
+                scheduler_models.begin_write_behind()
+            try:
+                with breakdown_timer.Step('handle_agents'):
+                    self._handle_agents()
+            finally:
+                with breakdown_timer.Step('flush_db_writes'):
+                    statements = scheduler_models.end_write_behind()
+                metrics.Gauge(
+                        'chromeos/autotest/scheduler/write_behind/'
+                        'tick_statements').set(statements)
             with breakdown_timer.Step('host_scheduler_tick'):
                 self._log_tick_msg('Starting _host_scheduler.tick')
                 self._host_scheduler.tick()
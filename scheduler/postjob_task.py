@@ -14,7 +14,7 @@ from autotest_lib.client.common_lib import utils
 from autotest_lib.frontend.afe import models, model_attributes
 from autotest_lib.scheduler import agent_task, drones, drone_manager
 from autotest_lib.scheduler import email_manager, pidfile_monitor
-from autotest_lib.scheduler import scheduler_config
+from autotest_lib.scheduler import scheduler_config, scheduler_models
 from autotest_lib.server import autoserv_utils
 
 try:
@@ -318,6 +318,7 @@ class GatherLogsTask(PostJobTask):
             if do_reboot:
                 # don't pass the queue entry to the CleanupTask. if the cleanup
                 # fails, the job doesn't care -- it's over.
+                scheduler_models.flush_pending_writes()
                 models.SpecialTask.objects.create(
                         host=models.Host.objects.get(id=queue_entry.host.id),
                         task=models.SpecialTask.Task.CLEANUP,
@@ -331,6 +332,7 @@ class GatherLogsTask(PostJobTask):
 
         The current hqe entry is not passed into the RESET job.
         """
+        scheduler_models.flush_pending_writes()
         for queue_entry in self.queue_entries:
             models.SpecialTask.objects.create(
                         host=models.Host.objects.get(id=queue_entry.host.id),
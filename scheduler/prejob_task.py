@@ -60,6 +60,7 @@ import re
 from autotest_lib.client.common_lib import host_protections
 from autotest_lib.frontend.afe import models
 from autotest_lib.scheduler import agent_task, scheduler_config
+from autotest_lib.scheduler import scheduler_models
 from autotest_lib.server import autoserv_utils
 from autotest_lib.server.cros import provision
 
@@ -81,6 +82,7 @@ class PreJobTask(agent_task.SpecialAgentTask):
             # If we requeue a HQE, we should cancel any remaining pre-job
             # tasks against this host, otherwise we'll be left in a state
             # where a queued HQE has special tasks to run against a host.
+            scheduler_models.flush_pending_writes()
             models.SpecialTask.objects.filter(
                     queue_entry__id=self.queue_entry.id,
                     host__id=self.host.id,
@@ -114,6 +116,7 @@ class PreJobTask(agent_task.SpecialAgentTask):
             # Limit the repair on a host when a prejob task fails, e.g., reset,
             # verify etc. The number of repair jobs is limited to the specific
             # HQE and host.
+            scheduler_models.flush_pending_writes()
             previous_repairs = models.SpecialTask.objects.filter(
                     task=models.SpecialTask.Task.REPAIR,
                     queue_entry_id=self.queue_entry.id,
@@ -128,6 +131,7 @@ class PreJobTask(agent_task.SpecialAgentTask):
         else:
             queue_entry = None
 
+        scheduler_models.flush_pending_writes()
         models.SpecialTask.objects.create(
                 host=models.Host.objects.get(id=self.host.id),
                 task=models.SpecialTask.Task.REPAIR,
@@ -153,6 +157,7 @@ class PreJobTask(agent_task.SpecialAgentTask):
         # We know if this is the last one when we create it, so we could add
         # another column to the database to keep track of this information, but
         # I expect the overhead of querying here to be minimal.
+        scheduler_models.flush_pending_writes()
         queue_entry = models.HostQueueEntry.objects.get(id=self.queue_entry.id)
         queued = models.SpecialTask.objects.filter(
                 host__id=self.host.id, is_active=False,
@@ -229,6 +234,7 @@ class CleanupTask(PreJobTask):
                 self.queue_entry.job.run_verify
                 and self.host.protection != do_not_verify_protection)
         if should_run_verify:
+            scheduler_models.flush_pending_writes()
             entry = models.HostQueueEntry.objects.get(id=self.queue_entry.id)
             models.SpecialTask.objects.create(
                     host=models.Host.objects.get(id=self.host.id),
@@ -82,6 +82,44 @@ class AvailableHostQueryManager(BaseHostQueryManager):
     host_objects = models.Host.leased_objects
 
 
+    def get_available_host_ids(self):
+        """Get the ids of the hosts that can be acquired.
+
+        @return: A set of host ids.
+        """
+        return set(self.host_objects.filter(invalid=0).values_list(
+                'id', flat=True))
+
+
+    def get_host_index_data(self):
+        """Get the data an rdb_cache_manager.RDBHostIndex is built from.
+
+        @return: A tuple (available_host_ids, host_labels, host_acls), as taken
+            by RDBHostIndex.reconcile.
+        """
+        host_labels = list(models.Host.labels.through.objects.values_list(
+                'host', 'label'))
+        # Labels are matched as models.Host.get_hosts_with_labels does: when
+        # static labels are respected, a replaced label is only satisfied by
+        # the static label of the same name.
+        if models.RESPECT_STATIC_LABELS:
+            replaced_ids = set(models.ReplacedLabel.objects.values_list(
+                    'label', flat=True))
+            host_labels = [(host_id, label_id)
+                           for host_id, label_id in host_labels
+                           if label_id not in replaced_ids]
+            replaced_label_ids = dict(models.Label.objects.filter(
+                    id__in=replaced_ids).values_list('name', 'id'))
+            for host_id, name in (
+                    models.Host.static_labels.through.objects.values_list(
+                            'host', 'staticlabel__name')):
+                if name in replaced_label_ids:
+                    host_labels.append((host_id, replaced_label_ids[name]))
+        host_acls = models.AclGroup.hosts.through.objects.values_list(
+                'host', 'aclgroup')
+        return self.get_available_host_ids(), host_labels, host_acls
+
+
 # Request Handlers: Used in conjunction with requests in rdb_utils, these
 # handlers acquire hosts for a request and record the acquisition in
 # an response_map dictionary keyed on the request itself, with the host/hosts
@@ -207,6 +245,9 @@ class BaseHostRequestHandler(object):
                     request = rdb_requests.UpdateHostRequest(
                             host_id=host, payload=payload).get_request()
                     self._record_exceptions(request, [e])
+            else:
+                if rdb_cache_manager.RDBHostCacheManager.use_host_index:
+                    rdb_cache_manager.host_index.apply_update(hosts, payload)
 
 
     def batch_get_hosts(self, host_requests):
@@ -247,6 +288,11 @@ class AvailableHostRequestHandler(BaseHostRequestHandler):
         self.unsatisfied_requests = 0
         self.leased_hosts_count = 0
         self.request_accountant = None
+        # Maps a cache key to the ids of the hosts the host index found for it,
+        # and host ids to the hosts fetched for all keys. None when the host
+        # index is not used.
+        self._indexed_host_ids = None
+        self._indexed_hosts = None
 
 
     @metrics.SecondsTimerDecorator(_rdb_timer_name % 'lease_hosts')
@@ -268,6 +314,10 @@ class AvailableHostRequestHandler(BaseHostRequestHandler):
                 logging.error('Unable to lease host %s: %s', host.hostname, e)
             else:
                 leased_hosts.add(host)
+        if self.cache.host_index:
+            # Hosts that failed leasing are most likely leased already.
+            self.cache.host_index.mark_unavailable(
+                    host.id for host in unleased_hosts)
         return list(leased_hosts)
 
 
@@ -344,8 +394,7 @@ class AvailableHostRequestHandler(BaseHostRequestHandler):
         """
         hosts = kwargs.get(rdb_cache_manager.MEMOIZE_KEY, [])
         if not hosts:
-            hosts = self.host_query_manager.find_hosts(
-                            request.deps, request.acls)
+            hosts = self._find_hosts(request)
 
         # <-----[:attempt_lease_hosts](evicted)--------> <-(returned, cached)->
         # |   -leased_hosts-  |   -stale cached hosts-  | -unleased matching- |
@@ -381,6 +430,55 @@ class AvailableHostRequestHandler(BaseHostRequestHandler):
         return hosts[attempt_lease_hosts:]
 
 
+    def _find_hosts(self, request):
+        """Find the available hosts matching a request.
+
+        @param request: The request for hosts.
+
+        @return: A set of matching hosts.
+        """
+        key = self.cache.get_key(request.deps, request.acls)
+        if self._indexed_host_ids is None or key not in self._indexed_host_ids:
+            return self.host_query_manager.find_hosts(
+                    request.deps, request.acls)
+        return set(self._indexed_hosts[host_id]
+                   for host_id in self._indexed_host_ids[key]
+                   if host_id in self._indexed_hosts
+                   and not self._indexed_hosts[host_id].leased)
+
+
+    def _prefetch_indexed_hosts(self, host_requests):
+        """Find the hosts matching all requests through the host index.
+
+        The host index is brought up to date, then the hosts matching every
+        distinct deps/acls of the requests are fetched with a single query.
+
+        @param host_requests: A list of requests to acquire hosts.
+        """
+        index = self.cache.host_index
+        if index is None:
+            return
+        if index.needs_reconcile():
+            index.reconcile(*self.host_query_manager.get_host_index_data())
+        else:
+            index.set_available(
+                    self.host_query_manager.get_available_host_ids())
+        self._indexed_host_ids = {}
+        for request in host_requests:
+            key = self.cache.get_key(request.deps, request.acls)
+            if key not in self._indexed_host_ids:
+                self._indexed_host_ids[key] = index.find_host_ids(
+                        key.deps, key.acls)
+        host_ids = set().union(*self._indexed_host_ids.values())
+        self._indexed_hosts = dict(
+                (host.id, host)
+                for host in self.host_query_manager.get_hosts(host_ids))
+        # Hosts leased or locked since the index was updated.
+        stale_host_ids = host_ids.difference(self._indexed_hosts)
+        index.stale_hosts += len(stale_host_ids)
+        index.mark_unavailable(stale_host_ids)
+
+
     @metrics.SecondsTimerDecorator(_rdb_timer_name % 'batch_acquire_hosts')
     def batch_acquire_hosts(self, host_requests):
         """Acquire hosts for a list of requests.
@@ -399,6 +497,7 @@ class AvailableHostRequestHandler(BaseHostRequestHandler):
                       ).set(len(host_requests))
 
         self.request_accountant = rdb_utils.RequestAccountant(host_requests)
+        self._prefetch_indexed_hosts(self.request_accountant.requests)
         # First pass tries to satisfy min_duts for each suite.
         for request in self.request_accountant.requests:
             to_acquire = self.request_accountant.get_min_duts(request)
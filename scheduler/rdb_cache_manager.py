@@ -79,6 +79,7 @@ of requests, so it's faster to check leased bits real time than query for hosts.
 import abc
 import collections
 import logging
+import time
 
 import common
 from autotest_lib.client.common_lib import utils
@@ -193,6 +194,128 @@ class InMemoryCacheBackend(CacheBackend):
     def has_key(self, key):
         return key in self._cache
 
+class RDBHostIndex(object):
+    """Inverted index from label and acl ids to available host ids.
+
+    Unlike cache lines, the index outlives a batched request: it is built from
+    the database, kept up to date with the hosts the rdb leases and updates,
+    and rebuilt every reconcile_interval_secs to pick up label and acl
+    changes. Finding the hosts matching a request is a set intersection.
+
+    Clients of the index must not trust it any more than they trust the
+    leased bit on a cached host: host ids it returns have to be checked
+    against the database before the hosts are leased.
+    """
+
+    reconcile_interval_secs = global_config.get_config_value(
+            'RDB', 'host_index_reconcile_interval_secs', type=int, default=300)
+
+    def __init__(self):
+        self._hosts_by_label = {}
+        self._hosts_by_acl = {}
+        self._available = set()
+        self._next_reconcile = 0
+        self.lookups = 0
+        self.stale_hosts = 0
+
+
+    def needs_reconcile(self):
+        """Return True if the index should be rebuilt from the database."""
+        return time.time() >= self._next_reconcile
+
+
+    def reconcile(self, available_host_ids, host_labels, host_acls):
+        """Rebuild the index.
+
+        @param available_host_ids: Ids of the valid, unleased, unlocked hosts.
+        @param host_labels: Iterable of (host id, label id) tuples.
+        @param host_acls: Iterable of (host id, acl id) tuples.
+        """
+        hosts_by_label = collections.defaultdict(set)
+        for host_id, label_id in host_labels:
+            hosts_by_label[label_id].add(host_id)
+        hosts_by_acl = collections.defaultdict(set)
+        for host_id, acl_id in host_acls:
+            hosts_by_acl[acl_id].add(host_id)
+        self._hosts_by_label = dict(hosts_by_label)
+        self._hosts_by_acl = dict(hosts_by_acl)
+        self._available = set(available_host_ids)
+        self._next_reconcile = time.time() + self.reconcile_interval_secs
+        logging.debug('Rebuilt rdb host index: %d labels, %d acls, %d '
+                      'available hosts', len(self._hosts_by_label),
+                      len(self._hosts_by_acl), len(self._available))
+
+
+    def set_available(self, host_ids):
+        """Replace the set of available hosts.
+
+        @param host_ids: Ids of the valid, unleased, unlocked hosts.
+        """
+        self._available = set(host_ids)
+
+
+    def mark_unavailable(self, host_ids):
+        """Remove hosts from the available hosts, e.g. once leased.
+
+        @param host_ids: An iterable of host ids.
+        """
+        self._available.difference_update(host_ids)
+
+
+    def apply_update(self, host_ids, payload):
+        """Apply an update of the host table to the available hosts.
+
+        @param host_ids: The ids of the updated hosts.
+        @param payload: The dict of updated columns and their new values.
+        """
+        if any(payload.get(field) for field in ('leased', 'locked', 'invalid')):
+            self._available.difference_update(host_ids)
+        elif 'leased' in payload:
+            # A released host may still be locked, this is caught when the
+            # host is fetched from the database.
+            self._available.update(host_ids)
+
+
+    def find_host_ids(self, deps, acls):
+        """Find the available hosts with all of |deps| and any of |acls|.
+
+        @param deps: An iterable of label ids.
+        @param acls: An iterable of acl ids.
+
+        @return: A set of host ids.
+        """
+        self.lookups += 1
+        host_ids = set()
+        for acl in acls:
+            host_ids.update(self._hosts_by_acl.get(acl, ()))
+        host_ids.intersection_update(self._available)
+        # Intersect the smallest sets first, to bail out early.
+        for dep in sorted(deps,
+                          key=lambda d: len(self._hosts_by_label.get(d, ()))):
+            if not host_ids:
+                break
+            host_ids.intersection_update(self._hosts_by_label.get(dep, ()))
+        return host_ids
+
+
+    def record_stats(self):
+        """Record stats about the lookups since the last call."""
+        logging.debug('Host index stats: lookups: %d, stale hosts: %d',
+                      self.lookups, self.stale_hosts)
+        metrics.Counter(
+                'chromeos/autotest/scheduler/rdb/host_index/lookups'
+        ).increment_by(self.lookups)
+        metrics.Counter(
+                'chromeos/autotest/scheduler/rdb/host_index/stale_hosts'
+        ).increment_by(self.stale_hosts)
+        self.lookups = 0
+        self.stale_hosts = 0
+
+
+# The host index is shared by all the batched requests of the process.
+host_index = RDBHostIndex()
+
+
 # TODO: Implement a MemecacheBackend, invalidate when unleasing a host, refactor
 # the AcquireHostRequest to contain a core of (deps, acls) that we can use as
 # the key for population and invalidation. The caching manager is still valid,
@@ -204,10 +327,13 @@ class RDBHostCacheManager(object):
     key = collections.namedtuple('key', ['deps', 'acls'])
     use_cache = global_config.get_config_value(
             'RDB', 'use_cache', type=bool, default=True)
+    use_host_index = global_config.get_config_value(
+            'RDB', 'use_host_index', type=bool, default=False)
 
     def __init__(self):
         self._cache_backend = (InMemoryCacheBackend()
                                if self.use_cache else DummyCacheBackend())
+        self.host_index = host_index if self.use_host_index else None
         self.hits = 0
         self.misses = 0
         self.stale_entries = []
@@ -244,6 +370,8 @@ class RDBHostCacheManager(object):
         metrics.Float(
                 'chromeos/autotest/scheduler/rdb/cache/mean_staleness').set(
                         staleness)
+        if self.host_index:
+            self.host_index.record_stats()
 
 
     @classmethod
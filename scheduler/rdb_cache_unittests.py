@@ -8,6 +8,7 @@ import unittest
 import common
 from autotest_lib.frontend import setup_django_environment
 from autotest_lib.frontend.afe import frontend_test_utils
+from autotest_lib.frontend.afe import models
 from autotest_lib.scheduler import rdb
 from autotest_lib.scheduler import rdb_cache_manager
 from autotest_lib.scheduler import rdb_lib
@@ -340,5 +341,107 @@ class RDBCacheTest(test_utils.AbstractBaseRDBTester, unittest.TestCase):
         self.check_hosts(rdb_lib.acquire_hosts(queue_entries))
 
 
+    def testHostIndex(self):
+        """Test that requests are satisfied through the host index."""
+
+        # Create 2 jobs with different deps and 3 hosts. Both jobs should get
+        # hosts through the index, without querying hosts by deps/acls.
+        default_params = test_utils.get_default_job_params()
+        default_host_params = test_utils.get_default_host_params()
+        self.create_job(**default_params)
+        default_params['deps'] = default_params['deps'][0]
+        self.create_job(**default_params)
+        for i in range(0, 3):
+            self.db_helper.create_host('h%s'%i, **default_host_params)
+        queue_entries = self._dispatcher._refresh_pending_queue_entries()
+        self.god.stub_with(
+                rdb_cache_manager.RDBHostCacheManager, 'use_host_index', True)
+        self.god.stub_with(rdb_cache_manager, 'host_index',
+                           rdb_cache_manager.RDBHostIndex())
+
+        def local_find_hosts(self, deps, acls):
+            """Local rdb.find_hosts handler."""
+            raise AssertionError('The host index should have found hosts '
+                                 'for deps %s, acls %s' % (deps, acls))
+
+        self.god.stub_with(rdb.AvailableHostQueryManager, 'find_hosts',
+                           local_find_hosts)
+        self.check_hosts(rdb_lib.acquire_hosts(queue_entries))
+
+
+    def testHostIndexStaticLabels(self):
+        """Test the index matches labels as get_hosts_with_labels does."""
+        label = self.db_helper.create_label('dep')
+        labeled = self.db_helper.create_host('labeled', deps=set(['dep']))
+        static_only = self.db_helper.create_host('static_only')
+        static_only.static_labels.add(
+                models.StaticLabel.objects.create(name='dep'))
+        query_manager = rdb.AvailableHostQueryManager()
+
+        def hosts_with_dep():
+            """Get the ids of the hosts the index has the dep for."""
+            _, host_labels, _ = query_manager.get_host_index_data()
+            return set(host_id for host_id, label_id in host_labels
+                       if label_id == label.id)
+
+        def hosts_with_dep_query():
+            """Get the ids of the hosts the deps query finds."""
+            return set(host.id for host in models.Host.get_hosts_with_labels(
+                    ['dep'], models.Host.objects.all()))
+
+        # Static labels are ignored unless they are respected.
+        self.assertEqual(hosts_with_dep(), set([labeled.id]))
+        self.god.stub_with(models, 'RESPECT_STATIC_LABELS', True)
+        self.assertEqual(hosts_with_dep(), set([labeled.id]))
+        self.assertEqual(hosts_with_dep_query(), hosts_with_dep())
+
+        # A replaced label is only satisfied by the static label.
+        models.ReplacedLabel.objects.create(label=label)
+        self.assertEqual(hosts_with_dep(), set([static_only.id]))
+        self.assertEqual(hosts_with_dep_query(), hosts_with_dep())
+
+
+class RDBHostIndexTest(unittest.TestCase):
+    """Unittests for RDBHostIndex."""
+
+    def setUp(self):
+        self.index = rdb_cache_manager.RDBHostIndex()
+        # Hosts 1-3 have label 10, hosts 1 and 2 also have label 20. Host 3 is
+        # in acl 100, the others in acl 200.
+        self.index.reconcile(
+                available_host_ids=[1, 2, 3],
+                host_labels=[(1, 10), (2, 10), (3, 10), (1, 20), (2, 20)],
+                host_acls=[(1, 200), (2, 200), (3, 100)])
+
+
+    def testFindHostIds(self):
+        """Test hosts need all deps and any acl."""
+        self.assertEqual(self.index.find_host_ids([10], [100, 200]),
+                         set([1, 2, 3]))
+        self.assertEqual(self.index.find_host_ids([10, 20], [100, 200]),
+                         set([1, 2]))
+        self.assertEqual(self.index.find_host_ids([10, 20], [100]), set())
+        self.assertEqual(self.index.find_host_ids([30], [100, 200]), set())
+        self.assertEqual(self.index.find_host_ids([10], []), set())
+
+
+    def testAvailability(self):
+        """Test leased and released hosts are tracked."""
+        self.index.mark_unavailable([1])
+        self.assertEqual(self.index.find_host_ids([20], [200]), set([2]))
+        self.index.apply_update([2], {'locked': True})
+        self.assertEqual(self.index.find_host_ids([20], [200]), set())
+        self.index.apply_update([1, 2], {'leased': False})
+        self.assertEqual(self.index.find_host_ids([20], [200]), set([1, 2]))
+        self.index.set_available([3])
+        self.assertEqual(self.index.find_host_ids([10], [100, 200]), set([3]))
+
+
+    def testNeedsReconcile(self):
+        """Test the index is rebuilt periodically."""
+        self.assertFalse(self.index.needs_reconcile())
+        self.assertTrue(rdb_cache_manager.RDBHostIndex().needs_reconcile())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -15,10 +15,13 @@ _notify_email_statuses: list of HQE statuses.  each time a single HQE reaches
         comes from global_config.
 _base_url: URL to the local AFE server, used to construct URLs for emails.
 _db: DatabaseConnection for this module.
+_pending_writes: field writes waiting to be flushed to _db, see
+        begin_write_behind().
 _drone_manager: reference to global DroneManager instance.
 """
 
 import base64
+import collections
 import datetime
 import errno
 import itertools
@@ -32,6 +35,7 @@ from autotest_lib.client.common_lib import global_config, host_protections
 from autotest_lib.client.common_lib import time_utils
 from autotest_lib.client.common_lib import utils
 from autotest_lib.frontend.afe import models, model_attributes
+from django.db import transaction
 from autotest_lib.scheduler import drone_manager, email_manager
 from autotest_lib.scheduler import rdb_lib
 from autotest_lib.scheduler import scheduler_config
@@ -53,6 +57,9 @@ _base_url = None
 
 _db = None
 _drone_manager = None
+# Maps (table, id) to a dictionary of the field values to write to that row.
+# None unless writes are deferred by begin_write_behind().
+_pending_writes = None
 
 RESPECT_STATIC_LABELS = global_config.global_config.get_config_value(
         'SKYLAB', 'respect_static_labels', type=bool, default=False)
@@ -88,6 +95,81 @@ def initialize_globals():
     _drone_manager = drone_manager.instance()
 
 
+def begin_write_behind():
+    """Defer DBObject field writes until flush_pending_writes() is called.
+
+    Until then, DBObject.update_field only records the new value. Writes to
+    the same row are merged, and reads of a row by id see the pending values.
+    Any other query sent by this module flushes the pending writes first.
+    Code reading the same tables through another path, e.g. the Django
+    models or rdb, must call flush_pending_writes() before doing so.
+    """
+    global _pending_writes
+    if _pending_writes is None:
+        _pending_writes = collections.OrderedDict()
+
+
+def end_write_behind():
+    """Flush the pending writes and send the following ones immediately.
+
+    @returns The number of UPDATE statements sent.
+    """
+    global _pending_writes
+    try:
+        return flush_pending_writes()
+    finally:
+        _pending_writes = None
+
+
+def flush_pending_writes():
+    """Send the pending field writes to the database, in one transaction.
+
+    Rows of a table that have the same set of fields to write are updated by
+    a single statement.
+
+    @returns The number of UPDATE statements sent.
+    """
+    if not _pending_writes:
+        return 0
+    statements = collections.OrderedDict()
+    for (table, row_id), values in _pending_writes.iteritems():
+        fields = tuple(sorted(values))
+        statements.setdefault((table, fields), []).append((row_id, values))
+    _pending_writes.clear()
+
+    with transaction.commit_on_success():
+        for (table, fields), rows in statements.iteritems():
+            assignments = []
+            params = []
+            for field in fields:
+                assignments.append('%s = CASE id %s END' % (
+                        field, ' '.join(['WHEN %s THEN %s'] * len(rows))))
+                for row_id, values in rows:
+                    params.extend((row_id, values[field]))
+            row_ids = [row_id for row_id, _ in rows]
+            params.extend(row_ids)
+            query = 'UPDATE %s SET %s WHERE id IN (%s)' % (
+                    table, ', '.join(assignments),
+                    ', '.join(['%s'] * len(row_ids)))
+            _db.execute(query, params)
+    metrics.Counter(
+            'chromeos/autotest/scheduler/write_behind/statements'
+    ).increment_by(len(statements))
+    return len(statements)
+
+
+def _execute(query, parameters=None):
+    """Run a query on _db, after sending any pending field writes.
+
+    @param query: The SQL query.
+    @param parameters: The query parameters.
+
+    @returns The rows returned by the query.
+    """
+    flush_pending_writes()
+    return _db.execute(query, parameters)
+
+
 def get_job_metadata(job):
     """Get a dictionary of the job information.
 
@@ -163,6 +245,8 @@ class DBObject(object):
 
         if row is None:
             row = self._fetch_row_from_db(id)
+        else:
+            row = self._apply_pending_writes(row)
 
         if self._initialized:
             differences = self._compare_fields_in_row(row)
@@ -187,7 +271,24 @@ class DBObject(object):
         if not rows:
             raise DBError("row not found (table=%s, row id=%s)"
                           % (self.__table, row_id))
-        return rows[0]
+        return self._apply_pending_writes(rows[0])
+
+
+    @classmethod
+    def _apply_pending_writes(cls, row):
+        """Overlay the pending writes to a row on the values read from the DB.
+
+        @param row - A sequence of values corresponding to fields named in
+                the class attribute _fields.
+
+        @returns The row as it will be once the pending writes are flushed.
+        """
+        values = _pending_writes and _pending_writes.get(
+                (cls._table_name, row[0]))
+        if not values:
+            return row
+        return tuple(values.get(field, value)
+                     for field, value in itertools.izip(cls._fields, row))
 
 
     def _assert_row_length(self, row):
@@ -248,7 +349,7 @@ class DBObject(object):
         if not table:
             table = self.__table
 
-        rows = _db.execute("""
+        rows = _execute("""
                 SELECT count(*) FROM %s
                 WHERE %s
         """ % (table, where))
@@ -264,8 +365,13 @@ class DBObject(object):
         if getattr(self, field) == value:
             return
 
-        query = "UPDATE %s SET %s = %%s WHERE id = %%s" % (self.__table, field)
-        _db.execute(query, (value, self.id))
+        if _pending_writes is not None:
+            _pending_writes.setdefault((self.__table, self.id), {})[field] = (
+                    value)
+        else:
+            query = "UPDATE %s SET %s = %%s WHERE id = %%s" % (self.__table,
+                                                              field)
+            _db.execute(query, (value, self.id))
 
         setattr(self, field, value)
 
@@ -284,9 +390,9 @@ class DBObject(object):
             values_str = ','.join(values)
             query = ('INSERT INTO %s (%s) VALUES (%s)' %
                      (self.__table, columns, values_str))
-            _db.execute(query)
+            _execute(query)
             # Update our id to the one the database just assigned to us.
-            self.id = _db.execute('SELECT LAST_INSERT_ID()')[0][0]
+            self.id = _execute('SELECT LAST_INSERT_ID()')[0][0]
 
 
     def delete(self):
@@ -294,7 +400,7 @@ class DBObject(object):
         self._initialized = False
         self._valid_fields.clear()
         query = 'DELETE FROM %s WHERE id=%%s' % self.__table
-        _db.execute(query, (self.id,))
+        _execute(query, (self.id,))
 
 
     @staticmethod
@@ -323,7 +429,7 @@ class DBObject(object):
                                              'joins' : joins,
                                              'where' : where,
                                              'order_by' : order_by})
-        rows = _db.execute(query, params)
+        rows = _execute(query, params)
         return rows
 
     @classmethod
@@ -379,7 +485,7 @@ class Host(DBObject):
             return non_static_rows
 
         combined_rows = []
-        replaced_labels = _db.execute(
+        replaced_labels = _execute(
                 'SELECT label_id FROM afe_replaced_labels')
         replaced_label_ids = {l[0] for l in replaced_labels}
 
@@ -425,8 +531,8 @@ class Host(DBObject):
                 'column': 'label_id',
                 'host_id': self.id
         }
-        non_static_rows = _db.execute(non_static_query)
-        static_rows = _db.execute(static_query)
+        non_static_rows = _execute(non_static_query)
+        static_rows = _execute(static_query)
 
         rows = self._get_labels_with_platform(non_static_rows, static_rows)
         platform = None
@@ -500,6 +606,7 @@ class HostQueueEntry(DBObject):
         self.job = Job(self.job_id, row=job_row)
 
         if self.host_id:
+            flush_pending_writes()
             self.host = rdb_lib.get_hosts([self.host_id])[0]
             self.host.dbg_str = self.get_dbg_str()
             self.host.metadata = get_job_metadata(self.job)
@@ -784,6 +891,7 @@ class HostQueueEntry(DBObject):
                                  queue_entry.status))
 
         summary = "\n".join(summary)
+        flush_pending_writes()
         status_counts = models.Job.objects.get_status_counts(
                 [self.job.id])[self.job.id]
         status = ', '.join('%d %s' % (count, status) for status, count
@@ -832,7 +940,7 @@ class HostQueueEntry(DBObject):
         """ Fetch info about who aborted the job. """
         if hasattr(self, "_aborted_by"):
             return
-        rows = _db.execute("""
+        rows = _execute("""
                 SELECT afe_users.login,
                         afe_aborted_host_queue_entries.aborted_on
                 FROM afe_aborted_host_queue_entries
@@ -898,11 +1006,13 @@ class HostQueueEntry(DBObject):
                 self.host.set_status(models.Host.Status.READY)
         elif (self.status == Status.VERIFYING or
               self.status == Status.RESETTING):
+            flush_pending_writes()
             models.SpecialTask.objects.create(
                     task=models.SpecialTask.Task.CLEANUP,
                     host=models.Host.objects.get(id=self.host.id),
                     requested_by=self.job.owner_model())
         elif self.status == Status.PROVISIONING:
+            flush_pending_writes()
             models.SpecialTask.objects.create(
                     task=models.SpecialTask.Task.REPAIR,
                     host=models.Host.objects.get(id=self.host.id),
@@ -924,12 +1034,12 @@ class HostQueueEntry(DBObject):
             # crosbug.com/31595 once issue is root caused.
             logging.error('No execution_subdir for host queue id:%s.', self.id)
             logging.error('====DB DEBUG====\n%s', SQL_SUSPECT_ENTRIES)
-            for row in _db.execute(SQL_SUSPECT_ENTRIES):
+            for row in _execute(SQL_SUSPECT_ENTRIES):
                 logging.error(row)
             logging.error('====DB DEBUG====\n')
             fix_query = SQL_FIX_SUSPECT_ENTRY % self.id
             logging.error('EXECUTING: %s', fix_query)
-            _db.execute(SQL_FIX_SUSPECT_ENTRY % self.id)
+            _execute(SQL_FIX_SUSPECT_ENTRY % self.id)
             raise AssertionError(('self.execution_subdir not found. '
                                   'See log for details.'))
 
@@ -989,6 +1099,7 @@ class Job(DBObject):
 
 
     def model(self):
+        flush_pending_writes()
         return models.Job.objects.get(id=self.id)
 
 
@@ -1029,7 +1140,7 @@ class Job(DBObject):
 
         stats = {}
 
-        rows = _db.execute("""
+        rows = _execute("""
                 SELECT t.test, s.word, t.reason
                 FROM tko_tests AS t, tko_jobs AS j, tko_status AS s
                 WHERE t.job_idx = j.job_idx
@@ -1063,7 +1174,7 @@ class Job(DBObject):
         else:
             stats['failed_rows'] = ''
 
-        time_row = _db.execute("""
+        time_row = _execute("""
                    SELECT started_time, finished_time
                    FROM tko_jobs
                    WHERE afe_job_id = %s
@@ -1092,6 +1203,8 @@ class Job(DBObject):
 
     def _pending_count(self):
         """The number of HostQueueEntries for this job in the Pending state."""
+        # The entry that just became Pending may not be written yet.
+        flush_pending_writes()
         pending_entries = models.HostQueueEntry.objects.filter(
                 job=self.id, status=models.HostQueueEntry.Status.PENDING)
         return pending_entries.count()
@@ -1137,6 +1250,7 @@ class Job(DBObject):
           statuses = list(models.HostQueueEntry.PRE_JOB_STATUSES)
         else:
           statuses = list(models.HostQueueEntry.IDLE_PRE_JOB_STATUSES)
+        flush_pending_writes()
         return models.HostQueueEntry.objects.filter(job=self.id,
                                                     status__in=statuses)
 
@@ -1167,6 +1281,7 @@ class Job(DBObject):
         """@returns a directory name to use for the next host group results."""
         group_name = ''
         group_count_re = re.compile(r'%sgroup(\d+)' % re.escape(group_name))
+        flush_pending_writes()
         query = models.HostQueueEntry.objects.filter(
             job=self.id).values('execution_subdir').distinct()
         subdirs = (entry['execution_subdir'] for entry in query)
@@ -1263,6 +1378,7 @@ class Job(DBObject):
         @returns: None
 
         """
+        flush_pending_writes()
         models.SpecialTask.objects.create(
                 host=models.Host.objects.get(id=queue_entry.host_id),
                 queue_entry=queue_entry, task=task)
@@ -1280,6 +1396,7 @@ class Job(DBObject):
 
         """
         task_queued = False
+        flush_pending_writes()
         hqe_model = models.HostQueueEntry.objects.get(id=queue_entry.id)
 
         if self._should_run_provision(queue_entry):
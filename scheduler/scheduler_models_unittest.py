@@ -97,6 +97,41 @@ class DBObjectTest(BaseSchedulerModelsTest):
         self.assert_(host_a is host_c, 'Cached instance not returned')
 
 
+    def _query_host(self, host_id, fields):
+        return self._database.execute(
+                'SELECT %s FROM afe_hosts WHERE id=%%s' % fields, (host_id,))[0]
+
+
+    def test_write_behind(self):
+        scheduler_models.begin_write_behind()
+        self.addCleanup(scheduler_models.end_write_behind)
+        host1 = scheduler_models.Host(id=1)
+        host2 = scheduler_models.Host(id=2)
+        host1.update_field('status', 'Running')
+        host1.update_field('dirty', False)
+        host1.update_field('status', 'Cleaning')
+        host2.update_field('status', 'Running')
+        self.assertEqual(self._query_host(1, 'status'), ('Ready',))
+
+        # Reads by id see the pending writes.
+        scheduler_models.DBObject._clear_instance_cache()
+        self.assertEqual(scheduler_models.Host(id=1).status, 'Cleaning')
+
+        self.assertEqual(scheduler_models.end_write_behind(), 2)
+        self.assertEqual(self._query_host(1, 'status, dirty'),
+                         ('Cleaning', False))
+        self.assertEqual(self._query_host(2, 'status'), ('Running',))
+
+
+    def test_write_behind_flushed_before_query(self):
+        scheduler_models.begin_write_behind()
+        self.addCleanup(scheduler_models.end_write_behind)
+        scheduler_models.Host(id=1).update_field('status', 'Running')
+        hosts = scheduler_models.Host.fetch(where='status = "Running"')
+        self.assertEqual([host.id for host in hosts], [1])
+        self.assertEqual(scheduler_models.flush_pending_writes(), 0)
+
+
     def test_delete(self):
         host = scheduler_models.Host(id=3)
         host.delete()
@@ -349,6 +384,22 @@ class JobTest(BaseSchedulerModelsTest):
             self.assertTrue(hqe.aborted)
 
 
+    def test_on_pending_starts_job_with_write_behind(self):
+        self._create_job(hosts=[1])
+        queue_entry = scheduler_models.HostQueueEntry.fetch('id = 1')[0]
+        self.god.stub_function(scheduler_models.email_manager.manager,
+                               'enqueue_notify_email')
+
+        scheduler_models.begin_write_behind()
+        self.addCleanup(scheduler_models.end_write_behind)
+        queue_entry.on_pending()
+        scheduler_models.end_write_behind()
+
+        self.assertEquals(models.HostQueueEntry.objects.get(id=1).status,
+                          models.HostQueueEntry.Status.STARTING)
+        self.god.check_playback()
+
+
     def _check_special_tasks(self, tasks, task_types):
         self.assertEquals(len(tasks), len(task_types))
         for task, (task_type, queue_entry_id) in zip(tasks, task_types):
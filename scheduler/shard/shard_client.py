@@ -90,6 +90,12 @@ On the client side, this will happen:
    ids of all hosts. This is used to not send objects repeatedly. For more
    information on this and alternatives considered
    see rpc_interface.shard_heartbeat.
+5. Every heartbeat response carries a heartbeat_sequence. Once the response
+   is persisted, the next heartbeat echoes it and leaves out the ids of known
+   jobs and hosts, sending only the hosts whose status changed. If the master
+   answers with heartbeat_sequence=None, or persisting a response fails, the
+   next heartbeat sends the complete lists again.  Full heartbeats don't
+   carry the new arguments, so shards can be upgraded before the master.
 """
 
 
@@ -117,6 +123,14 @@ class ShardClient(object):
         self.tick_pause_sec = tick_pause_sec
         self._shutdown_requested = False
         self._shard = None
+        # Sequence number of the last heartbeat response that was persisted
+        # completely, None if the next heartbeat needs to be a full one.
+        self._heartbeat_sequence = None
+        # Host statuses the master got with the last heartbeat, and the ones
+        # sent with the heartbeat in flight.
+        self._acked_host_statuses = {}
+        self._sent_host_statuses = {}
+        self._deserialization_failed = False
 
 
     def _deserialize_many(self, serialized_list, djmodel, message):
@@ -133,6 +147,7 @@ class ShardClient(object):
                 try:
                     djmodel.deserialize(serialized)
                 except Exception as e:
+                    self._deserialization_failed = True
                     logging.error('Deserializing a %s fails: %s, Error: %s',
                                   message, serialized, e)
                     metrics.Counter(
@@ -152,6 +167,10 @@ class ShardClient(object):
                                    as returned by the `shard_heartbeat` rpc
                                    call.
         """
+        # Until the response is persisted, the master can't rely on what this
+        # shard knows.
+        self._heartbeat_sequence = None
+        self._deserialization_failed = False
         hosts_serialized = heartbeat_response['hosts']
         jobs_serialized = heartbeat_response['jobs']
         suite_keyvals_serialized = heartbeat_response['suite_keyvals']
@@ -195,6 +214,13 @@ class ShardClient(object):
             logging.warn('Following completed jobs are reset shard_id to NULL '
                          'to be uploaded to master again: %s', job_ids_repr)
 
+        if self._deserialization_failed:
+            logging.warn('Some records could not be persisted, the next '
+                         'heartbeat will be a full one.')
+        else:
+            self._heartbeat_sequence = heartbeat_response.get(
+                    'heartbeat_sequence')
+
 
     def _remove_incorrect_hosts(self, incorrect_host_ids=None):
         """Remove from local database any hosts that should not exist.
@@ -277,15 +303,20 @@ class ShardClient(object):
         """
         job_ids = list(models.Job.objects.filter(
                 hostqueueentry__complete=False).values_list('id', flat=True))
-        host_models = models.Host.objects.filter(invalid=0)
         host_ids = []
         host_statuses = []
-        for h in host_models:
-            host_ids.append(h.id)
-            host_statuses.append(h.status)
+        for host_id, status in self._get_host_statuses():
+            host_ids.append(host_id)
+            host_statuses.append(status)
         return job_ids, host_ids, host_statuses
 
 
+    def _get_host_statuses(self):
+        """Returns a list of (host id, status) pairs of all valid hosts."""
+        return list(models.Host.objects.filter(invalid=0).values_list(
+                'id', 'status'))
+
+
     def _heartbeat_packet(self):
         """Construct the heartbeat packet.
 
@@ -293,9 +324,21 @@ class ShardClient(object):
 
         @return: A heartbeat packet.
         """
-        known_job_ids, known_host_ids, known_host_statuses = (
-                self._get_known_jobs_and_hosts())
-        logging.info('Known jobs: %s', known_job_ids)
+        if self._heartbeat_sequence is None:
+            known_job_ids, known_host_ids, known_host_statuses = (
+                    self._get_known_jobs_and_hosts())
+            logging.info('Known jobs: %s', known_job_ids)
+            host_status_updates = None
+            self._sent_host_statuses = dict(zip(known_host_ids,
+                                                known_host_statuses))
+        else:
+            known_job_ids, known_host_ids, known_host_statuses = [], [], []
+            host_statuses = self._get_host_statuses()
+            host_status_updates = [
+                    [host_id, status] for host_id, status in host_statuses
+                    if self._acked_host_statuses.get(host_id) != status]
+            logging.info('Host status updates: %s', host_status_updates)
+            self._sent_host_statuses = dict(host_statuses)
 
         job_objs = self._get_jobs_to_upload()
         hqes = [hqe.serialize(include_dependencies=False)
@@ -303,11 +346,19 @@ class ShardClient(object):
         jobs = [job.serialize(include_dependencies=False) for job in job_objs]
         logging.info('Uploading jobs %s', [j['id'] for j in jobs])
 
-        return {'shard_hostname': self.hostname,
-                'known_job_ids': known_job_ids,
-                'known_host_ids': known_host_ids,
-                'known_host_statuses': known_host_statuses,
-                'jobs': jobs, 'hqes': hqes}
+        packet = {'shard_hostname': self.hostname,
+                  'known_job_ids': known_job_ids,
+                  'known_host_ids': known_host_ids,
+                  'known_host_statuses': known_host_statuses,
+                  'jobs': jobs, 'hqes': hqes}
+        # A full heartbeat uses the original arguments only, so that it also
+        # works with a master that predates incremental heartbeats.  Such a
+        # master never returns a heartbeat_sequence, so the new arguments are
+        # only sent once the master has shown it knows them.
+        if self._heartbeat_sequence is not None:
+            packet['heartbeat_sequence'] = self._heartbeat_sequence
+            packet['host_status_updates'] = host_status_updates
+        return packet
 
 
     def _report_packet_metrics(self, packet):
@@ -318,6 +369,10 @@ class ShardClient(object):
             len(packet['jobs']))
         metrics.Gauge(_METRICS_PREFIX + 'known_host_ids_count').set(
             len(packet['known_host_ids']))
+        metrics.Gauge(_METRICS_PREFIX + 'host_status_updates_count').set(
+            len(packet.get('host_status_updates', ())))
+        metrics.Counter(_METRICS_PREFIX + 'packets').increment(
+            fields={'full': 'heartbeat_sequence' not in packet})
 
 
     def _heartbeat_failure(self, log_message, failure_type_str=''):
@@ -369,6 +424,7 @@ class ShardClient(object):
 
         metrics.Gauge(_METRICS_PREFIX + 'response_size').set(
             len(str(response)))
+        self._acked_host_statuses = self._sent_host_statuses
         self._mark_jobs_as_uploaded([job['id'] for job in packet['jobs']])
         self.process_heartbeat_response(response)
         logging.info("Heartbeat completed.")
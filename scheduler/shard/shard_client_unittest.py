@@ -56,13 +56,20 @@ class ShardClientTest(mox.MoxTestBase,
     def expect_heartbeat(self, shard_hostname='host1',
                          known_job_ids=[], known_host_ids=[],
                          known_host_statuses=[], hqes=[], jobs=[],
+                         heartbeat_sequence=None, host_status_updates=[],
                          side_effect=None, return_hosts=[], return_jobs=[],
-                         return_suite_keyvals=[], return_incorrect_hosts=[]):
+                         return_suite_keyvals=[], return_incorrect_hosts=[],
+                         return_heartbeat_sequence=None):
+        incremental_args = {}
+        if heartbeat_sequence is not None:
+            incremental_args = {'heartbeat_sequence': heartbeat_sequence,
+                                'host_status_updates': host_status_updates}
         call = self.afe.run(
             'shard_heartbeat', shard_hostname=shard_hostname,
             hqes=hqes, jobs=jobs,
             known_job_ids=known_job_ids, known_host_ids=known_host_ids,
             known_host_statuses=known_host_statuses,
+            **incremental_args
             )
 
         if side_effect:
@@ -73,6 +80,7 @@ class ShardClientTest(mox.MoxTestBase,
                 'jobs': return_jobs,
                 'suite_keyvals': return_suite_keyvals,
                 'incorrect_host_ids': return_incorrect_hosts,
+                'heartbeat_sequence': return_heartbeat_sequence,
             })
 
 
@@ -222,6 +230,42 @@ class ShardClientTest(mox.MoxTestBase,
         self.mox.VerifyAll()
 
 
+    def testIncrementalHeartbeat(self):
+        """Ensure only changes are sent once the master acked a heartbeat."""
+        self.setup_mocks()
+        self.setup_global_config()
+
+        host_serialized = self._get_sample_serialized_host()
+        host_id = host_serialized['id']
+
+        self.expect_heartbeat(return_hosts=[host_serialized],
+                              return_heartbeat_sequence=1)
+        # The host arrived after the first heartbeat, so its status is new to
+        # the master.
+        self.expect_heartbeat(heartbeat_sequence=1,
+                              host_status_updates=[[host_id, u'Ready']],
+                              return_heartbeat_sequence=2)
+        self.expect_heartbeat(heartbeat_sequence=2,
+                              return_heartbeat_sequence=3)
+        self.expect_heartbeat(heartbeat_sequence=3,
+                              host_status_updates=[[host_id, u'Running']])
+        # The master asked for a full heartbeat.
+        self.expect_heartbeat(known_host_ids=[host_id],
+                              known_host_statuses=[u'Running'])
+
+        self.mox.ReplayAll()
+        sut = shard_client.get_shard_client()
+
+        sut.do_heartbeat()
+        sut.do_heartbeat()
+        sut.do_heartbeat()
+        models.Host.objects.filter(id=host_id).update(status='Running')
+        sut.do_heartbeat()
+        sut.do_heartbeat()
+
+        self.mox.VerifyAll()
+
+
     def testRemoveInvalidHosts(self):
         self.setup_mocks()
         self.setup_global_config()
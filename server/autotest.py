@@ -312,15 +312,75 @@ class Autotest(installable_object.InstallableObject):
         # are fetched on that client. (for the tests,deps etc.
         # too apart from the client)
         pkg_dir = os.path.join(autodir, 'packages')
+        if self._update_installed_client(host, pkgmgr, autodir, pkg_dir):
+            self.installed = True
+            return
         # clean up the autodir except for the packages and result_tools
         # directory.
         host.run('cd %s && ls | grep -v "^packages$" | grep -v "^result_tools$"'
                  ' | xargs rm -rf && rm -rf .[!.]*' % autodir)
         pkgmgr.install_pkg('autotest', 'client', pkg_dir, autodir,
                            preserve_install_dir=True)
+        tarball_name = pkgmgr.get_tarball_name('autotest', 'client')
+        try:
+            pkgmgr.write_manifest(os.path.join(pkg_dir, tarball_name), autodir)
+        except (error.CmdError, error.AutoservRunError) as e:
+            # Without a manifest, the next install is a full one.
+            logging.warning('Could not write the autotest client manifest: %s',
+                            e)
         self.installed = True
 
 
+    def _update_installed_client(self, host, pkgmgr, autodir, pkg_dir):
+        """Bring the client already installed on a host up to date, if any.
+
+        The client installed in autodir is kept if it was installed from the
+        package currently in the repositories. Files of the package that were
+        modified since are untarred again, and files that are not part of it
+        are removed, which leaves autodir as a fresh install would.
+
+        @param host: The host to install the client on.
+        @param pkgmgr: The PackageManager of the host.
+        @param autodir: The directory the client is installed in.
+        @param pkg_dir: The directory packages are fetched to.
+
+        @returns True if autodir now holds the current client, False if it
+                 has to be installed from scratch.
+        """
+        tarball_name = pkgmgr.get_tarball_name('autotest', 'client')
+        try:
+            # Drop the checksums fetched for a previous install, they may be
+            # out of date.
+            host.run('rm -f %s' % os.path.join(autodir, packages.CHECKSUM_FILE))
+            checksum = pkgmgr.get_package_checksum(tarball_name)
+            installed_checksum = host.run(
+                    'cat %s' % os.path.join(autodir, '.checksum'),
+                    ignore_status=True).stdout.strip()
+            if not checksum or checksum != installed_checksum:
+                return False
+            diff = pkgmgr.diff_manifest(autodir,
+                                        exclude_dirs=['packages',
+                                                      'result_tools'])
+            if diff is None:
+                return False
+            changed, extra = diff
+            if extra:
+                host.run('cd %s && xargs -0 rm -f --' % autodir,
+                         stdin='\0'.join(extra))
+            if changed:
+                tarball_path = os.path.join(pkg_dir, tarball_name)
+                host.run('mkdir -p %s' % pkg_dir)
+                pkgmgr.fetch_pkg(tarball_name, tarball_path, use_checksum=True)
+                pkgmgr.untar_files(tarball_path, autodir, changed)
+        except (error.PackageFetchError, error.AutoservRunError) as e:
+            logging.info('Could not update the installed autotest client: %s',
+                         e)
+            return False
+        logging.info('Autotest client already installed, %d files restored '
+                     'and %d removed', len(changed), len(extra))
+        return True
+
+
     def _install_using_send_file(self, host, autodir):
         dirs_to_exclude = set(["tests", "site_tests", "deps", "profilers",
                                "packages"])
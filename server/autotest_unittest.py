@@ -153,21 +153,93 @@ class TestAutotest(unittest.TestCase):
         c = autotest.global_config.global_config
         c.get_config_value.expect_call('PACKAGES',
             'fetch_location', type=list, default=[]).and_return(['repo'])
-        os.path.exists.expect_call('/etc/cros_chroot_version').and_return(True)
         pkgmgr = packages.PackageManager.expect_new('autodir',
             repo_urls=['repo'], hostname='hostname', do_locking=False,
             run_function=self.host.run, run_function_dargs=dict(timeout=600))
         pkg_dir = os.path.join('autodir', 'packages')
+        self.record_installed_checksum(pkgmgr, 'new', 'old')
         cmd = ('cd autodir && ls | grep -v "^packages$" | '
                'grep -v "^result_tools$" | '
                'xargs rm -rf && rm -rf .[!.]*')
         self.host.run.expect_call(cmd)
         pkgmgr.install_pkg.expect_call('autotest', 'client', pkg_dir,
                                        'autodir', preserve_install_dir=True)
+        pkgmgr.get_tarball_name.expect_call('autotest', 'client').and_return(
+                'client.tar.bz2')
+        pkgmgr.write_manifest.expect_call(
+                os.path.join(pkg_dir, 'client.tar.bz2'), 'autodir')
+
+        # run and check
+        self.autotest.install()
+        self.god.check_playback()
+
+
+    def test_packaging_install_manifest_failure(self):
+        self.record_install_prologue()
+
+        c = autotest.global_config.global_config
+        c.get_config_value.expect_call('PACKAGES',
+            'fetch_location', type=list, default=[]).and_return(['repo'])
+        pkgmgr = packages.PackageManager.expect_new('autodir',
+            repo_urls=['repo'], hostname='hostname', do_locking=False,
+            run_function=self.host.run, run_function_dargs=dict(timeout=600))
+        pkg_dir = os.path.join('autodir', 'packages')
+        self.record_installed_checksum(pkgmgr, 'new', 'old')
+        cmd = ('cd autodir && ls | grep -v "^packages$" | '
+               'grep -v "^result_tools$" | '
+               'xargs rm -rf && rm -rf .[!.]*')
+        self.host.run.expect_call(cmd)
+        pkgmgr.install_pkg.expect_call('autotest', 'client', pkg_dir,
+                                       'autodir', preserve_install_dir=True)
+        pkgmgr.get_tarball_name.expect_call('autotest', 'client').and_return(
+                'client.tar.bz2')
+        pkgmgr.write_manifest.expect_call(
+                os.path.join(pkg_dir, 'client.tar.bz2'), 'autodir'
+                ).and_raises(error.AutoservRunError('md5sum', None))
+
+        # run and check
+        self.autotest.install()
+        self.god.check_playback()
+        self.assertTrue(self.autotest.installed)
+
+
+    def record_installed_checksum(self, pkgmgr, checksum, installed_checksum):
+        pkgmgr.get_tarball_name.expect_call('autotest', 'client').and_return(
+                'client.tar.bz2')
+        self.host.run.expect_call('rm -f autodir/packages.checksum')
+        pkgmgr.get_package_checksum.expect_call('client.tar.bz2').and_return(
+                checksum)
+        self.host.run.expect_call('cat autodir/.checksum',
+                                  ignore_status=True).and_return(
+                utils.CmdResult(stdout=installed_checksum + '\n'))
+
+
+    def test_packaging_install_up_to_date(self):
+        self.record_install_prologue()
+
+        c = autotest.global_config.global_config
+        c.get_config_value.expect_call('PACKAGES',
+            'fetch_location', type=list, default=[]).and_return(['repo'])
+        pkgmgr = packages.PackageManager.expect_new('autodir',
+            repo_urls=['repo'], hostname='hostname', do_locking=False,
+            run_function=self.host.run, run_function_dargs=dict(timeout=600))
+        pkg_dir = os.path.join('autodir', 'packages')
+        self.record_installed_checksum(pkgmgr, 'same', 'same')
+        pkgmgr.diff_manifest.expect_call(
+                'autodir', exclude_dirs=['packages', 'result_tools']
+                ).and_return((['control'], ['stale.pyc']))
+        self.host.run.expect_call('cd autodir && xargs -0 rm -f --',
+                                  stdin='stale.pyc')
+        self.host.run.expect_call('mkdir -p %s' % pkg_dir)
+        tarball_path = os.path.join(pkg_dir, 'client.tar.bz2')
+        pkgmgr.fetch_pkg.expect_call('client.tar.bz2', tarball_path,
+                                     use_checksum=True)
+        pkgmgr.untar_files.expect_call(tarball_path, 'autodir', ['control'])
 
         # run and check
         self.autotest.install()
         self.god.check_playback()
+        self.assertTrue(self.autotest.installed)
 
 
     def test_run(self):
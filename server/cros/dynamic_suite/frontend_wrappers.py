@@ -142,6 +142,23 @@ class RetryingAFE(frontend.AFE):
             return _run_in_child_thread(self, call, **dargs)
 
 
+    def run_batch(self, calls):
+        """Method for running several RPC calls in a single request.
+
+        The whole batch is retried when it fails, so it should only contain
+        calls that are safe to run again.
+
+        @param calls: A list of (call, dargs) tuples.
+        """
+        @retry.retry(Exception, timeout_min=self.timeout_min,
+                     delay_sec=self.delay_sec,
+                     blacklist=[ImportError, error.RPCException,
+                                proxy.ValidationError])
+        def _run_batch(self, calls):
+            return super(RetryingAFE, self).run_batch(calls)
+        return _run_batch(self, calls)
+
+
 class RetryingTKO(frontend.TKO):
     """Wrapper around frontend.TKO that retries all RPCs.
 
@@ -18,6 +18,18 @@ HQE_MAXIMUM_ABORT_RATE_FLOAT = global_config.global_config.get_config_value(
             'SCHEDULER', 'hqe_maximum_abort_rate_float', type=float,
             default=0.5)
 
+# Whether JobResultWaiter fetches the results of all the jobs that finished
+# since its last poll with one RPC and one TKO query, instead of two per job.
+BATCH_JOB_RESULTS = global_config.global_config.get_config_value(
+        'CROS', 'enable_batched_job_results', type=bool, default=False)
+
+# A since cursor only asks for jobs with a host queue entry that finished
+# after the latest finish time seen so far, minus this overlap.
+_SINCE_CURSOR_OVERLAP_SECONDS = 10 * 60
+# Every this many polls, the since cursor is not used, to pick up finished jobs
+# without a finish time, e.g. jobs aborted before they ran.
+_SINCE_CURSOR_FULL_POLL_INTERVAL = 10
+
 
 def view_is_relevant(view):
     """
@@ -118,15 +130,25 @@ def _status_for_test(status):
 class JobResultWaiter(object):
     """Class for waiting on job results."""
 
-    def __init__(self, afe, tko):
+    def __init__(self, afe, tko, batched=None, use_since_cursor=False):
         """Instantiate class
 
         @param afe: an instance of AFE as defined in server/frontend.py.
         @param tko: an instance of TKO as defined in server/frontend.py.
+        @param batched: If True, the results of all the jobs found finished
+                        by a poll are fetched together. Defaults to
+                        CROS/enable_batched_job_results.
+        @param use_since_cursor: If True, polls only ask for jobs that
+                                 finished after the previous poll. Only used
+                                 in batched mode.
         """
         self._afe = afe
         self._tko = tko
         self._job_ids = set()
+        self._batched = BATCH_JOB_RESULTS if batched is None else batched
+        self._use_since_cursor = use_since_cursor and self._batched
+        self._since = None
+        self._polls = 0
 
     def add_job(self, job):
         """Add job to wait on.
@@ -153,16 +175,55 @@ class JobResultWaiter(object):
         @yields an iterator of Statuses, one per test.
         """
         while self._job_ids:
-            for job in self._get_finished_jobs():
-                for result in _yield_job_results(self._afe, self._tko, job):
+            for job, results in self._get_job_results(
+                    self._get_finished_jobs()):
+                for result in results:
                     yield result
                 self._job_ids.remove(job.id)
             self._sleep()
 
     def _get_finished_jobs(self):
+        filter_data = {}
+        if (self._since is not None
+            and self._polls % _SINCE_CURSOR_FULL_POLL_INTERVAL):
+            filter_data['hostqueueentry__finished_on__gte'] = self._since
+        self._polls += 1
         # This is an RPC call which serializes to JSON, so we can't pass
         # in sets.
-        return self._afe.get_jobs(id__in=list(self._job_ids), finished=True)
+        return self._afe.get_jobs(id__in=list(self._job_ids), finished=True,
+                                  **filter_data)
+
+    def _get_job_results(self, jobs):
+        """Get the results of finished jobs.
+
+        @param jobs: A list of finished Job objects.
+        @returns a list of (job, results) tuples, where results is an iterator
+                 of Statuses, one per test.
+        """
+        if not self._batched:
+            return [(job, _yield_job_results(self._afe, self._tko, job))
+                    for job in jobs]
+        entries, statuses = _get_jobs_entries_and_statuses(self._afe,
+                                                           self._tko, jobs)
+        if self._use_since_cursor:
+            self._advance_since_cursor(entries)
+        return [(job, _job_results(job, entries[job.id], statuses[job.id]))
+                for job in jobs]
+
+    def _advance_since_cursor(self, entries):
+        """Move the since cursor past the latest finished host queue entry.
+
+        @param entries: A dict mapping job ids to lists of host queue entries.
+        """
+        finished_on = [entry['finished_on']
+                       for job_entries in entries.itervalues()
+                       for entry in job_entries if entry.get('finished_on')]
+        if not finished_on:
+            return
+        since = time_utils.epoch_time_to_date_string(
+                time_utils.date_string_to_epoch_time(max(finished_on))
+                - _SINCE_CURSOR_OVERLAP_SECONDS)
+        self._since = max(since, self._since)
 
     def _sleep(self):
         time.sleep(_DEFAULT_POLL_INTERVAL_SECONDS * (random.random() + 0.5))
@@ -181,17 +242,51 @@ def _yield_job_results(afe, tko, job):
     @yields an iterator of Statuses, one per test.
     """
     entries = afe.run('get_host_queue_entries', job=job.id)
+    statuses = tko.get_job_test_statuses_from_db(job.id)
+    for result in _job_results(job, entries, statuses):
+        yield result
+
+
+def _get_jobs_entries_and_statuses(afe, tko, jobs):
+    """
+    Fetches the host queue entries and test statuses of several jobs.
+
+    Makes one AFE RPC and one TKO query, whatever the number of jobs.
 
-    # This query uses the job id to search through the tko_test_view_2
-    # table, for results of a test with a similar job_tag. The job_tag
-    # is used to store results, and takes the form job_id-owner/host.
-    # Many times when a job aborts during a test, the job_tag actually
-    # exists and the results directory contains valid logs. If the job
-    # was aborted prematurely i.e before it had a chance to create the
-    # job_tag, this query will return no results. When statuses is not
-    # empty it will contain frontend.TestStatus' with fields populated
+    @param afe: an instance of AFE as defined in server/frontend.py.
+    @param tko: an instance of TKO as defined in server/frontend.py.
+    @param jobs: List of Job objects, as defined in server/frontend.py
+    @returns a tuple (entries, statuses) of dicts, mapping the id of each job
+             to the list of its host queue entries and to the list of its
+             frontend.TestStatus', respectively.
+    """
+    job_ids = [job.id for job in jobs]
+    entries = dict((job_id, []) for job_id in job_ids)
+    if not job_ids:
+        return entries, {}
+    for entry in afe.run('get_host_queue_entries', job__id__in=job_ids):
+        entries[entry['job']['id']].append(entry)
+    return entries, tko.get_jobs_test_statuses_from_db(job_ids)
+
+
+def _job_results(job, entries, statuses):
+    """
+    Yields the results of an individual job, from its entries and statuses.
+
+    @param job: Job object to get results from, as defined in
+                server/frontend.py
+    @param entries: List of the host queue entries of the job.
+    @param statuses: List of frontend.TestStatus' of the tests of the job.
+    @yields an iterator of Statuses, one per test.
+    """
+    # The statuses are the results of a test with a similar job_tag in the
+    # tko_test_view_2 table. The job_tag is used to store results, and takes
+    # the form job_id-owner/host. Many times when a job aborts during a
+    # test, the job_tag actually exists and the results directory contains
+    # valid logs. If the job was aborted prematurely i.e before it had a
+    # chance to create the job_tag, there are no statuses. When statuses is
+    # not empty it will contain frontend.TestStatus' with fields populated
     # using the results of the db query.
-    statuses = tko.get_job_test_statuses_from_db(job.id)
     if not statuses:
         yield Status('ABORT', job.name)
 
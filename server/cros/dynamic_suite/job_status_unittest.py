@@ -99,6 +99,48 @@ class StatusTest(mox.MoxTestBase):
                 self.assertTrue(True in map(status.equals_record, results))
 
 
+    def testJobResultWaiterBatched(self):
+        """Should fetch the results of all finished jobs at once."""
+        jobs = [FakeJob(0, [FakeStatus('GOOD', 'T0', ''),
+                            FakeStatus('GOOD', 'T1', '')]),
+                FakeJob(1, [FakeStatus('ERROR', 'T0', 'err', False),
+                            FakeStatus('GOOD', 'T1', '')]),
+                FakeJob(2, [FakeStatus('ERROR', 'SERVER_JOB', 'server error'),
+                            FakeStatus('GOOD', 'T0', '')])]
+        finish_times = ['2018-01-01 10:00:00', '2018-01-01 10:30:00',
+                        '2018-01-01 11:00:00']
+        for job, finished_on in zip(jobs, finish_times):
+            for status in job.statuses:
+                status.entry['job'] = {'id': job.id, 'name': 'job%d' % job.id}
+                status.entry['finished_on'] = finished_on
+
+        self.mox.StubOutWithMock(time, 'sleep')
+        self.afe.get_jobs(id__in=[0, 1, 2], finished=True).AndReturn(jobs[:2])
+        self.afe.run('get_host_queue_entries', job__id__in=[0, 1]).AndReturn(
+                [s.entry for job in jobs[:2] for s in job.statuses])
+        self.tko.get_jobs_test_statuses_from_db([0, 1]).AndReturn(
+                dict((job.id, job.statuses) for job in jobs[:2]))
+        time.sleep(mox.IgnoreArg())
+        self.afe.get_jobs(
+                id__in=[2], finished=True,
+                hostqueueentry__finished_on__gte='2018-01-01 10:20:00'
+        ).AndReturn(jobs[2:])
+        self.afe.run('get_host_queue_entries', job__id__in=[2]).AndReturn(
+                [s.entry for s in jobs[2].statuses])
+        self.tko.get_jobs_test_statuses_from_db([2]).AndReturn(
+                {2: jobs[2].statuses})
+        time.sleep(mox.IgnoreArg())
+        self.mox.ReplayAll()
+
+        waiter = job_status.JobResultWaiter(self.afe, self.tko, batched=True,
+                                            use_since_cursor=True)
+        waiter.add_jobs(jobs)
+        results = list(waiter.wait_for_results())
+        for job in jobs:
+            for status in job.statuses:
+                self.assertTrue(True in map(status.equals_record, results))
+
+
     def testYieldSubdir(self):
         """Make sure subdir are properly set for test and non-test status."""
         job_tag = '0-owner/172.33.44.55'
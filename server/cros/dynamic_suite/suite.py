@@ -599,7 +599,7 @@ class _ControlFileRetriever(object):
         @raises ControlVariableException: There is a syntax error in a
                                           control file.
         """
-        test = control_data.parse_control_string(
+        test = control_data.parse_control_string_cached(
                 text, raise_warnings=True, path=path)
         test.text = text
         if self._run_prod_code:
@@ -1266,7 +1266,8 @@ class _BaseSuite(object):
                  prototype:
                    record(base_job.status_log_entry)
         """
-        waiter = job_status.JobResultWaiter(self._afe, self._tko)
+        waiter = job_status.JobResultWaiter(self._afe, self._tko,
+                                            use_since_cursor=True)
         try:
             if self._suite_job_id:
                 jobs = self._afe.get_jobs(parent_job_id=self._suite_job_id)
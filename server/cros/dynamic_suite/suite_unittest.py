@@ -114,20 +114,22 @@ class SuiteTest(mox.MoxTestBase):
                                                suite_name):
         """Expect an attempt to parse the 'control files' in |files|.
 
-        @param already_stubbed: parse_control_string already stubbed out.
+        @param already_stubbed: parse_control_string_cached already stubbed
+                                out.
         @param file_list: the files the dev server returns
         @param files_to_parse: the {'name': FakeControlData} dict of files we
                                expect to get parsed.
         """
         if not already_stubbed:
-            self.mox.StubOutWithMock(control_data, 'parse_control_string')
+            self.mox.StubOutWithMock(control_data,
+                                     'parse_control_string_cached')
 
         self.getter.get_control_file_list(
                 suite_name=suite_name).AndReturn(file_list)
         for file, data in files_to_parse.iteritems():
             self.getter.get_control_file_contents(
                     file).InAnyOrder().AndReturn(data.string)
-            control_data.parse_control_string(
+            control_data.parse_control_string_cached(
                     data.string,
                     raise_warnings=True,
                     path=file).InAnyOrder().AndReturn(data)
@@ -140,11 +142,12 @@ class SuiteTest(mox.MoxTestBase):
         @param suite_name: The suite name to parse control files for.
         """
         self.getter = self.mox.CreateMock(control_file_getter.DevServerGetter)
-        self.mox.StubOutWithMock(control_data, 'parse_control_string')
+        self.mox.StubOutWithMock(control_data,
+                                 'parse_control_string_cached')
         suite_info = {}
         for k, v in self.files.iteritems():
             suite_info[k] = v.string
-            control_data.parse_control_string(
+            control_data.parse_control_string_cached(
                     v.string,
                     raise_warnings=True,
                     path=k).InAnyOrder().AndReturn(v)
@@ -113,6 +113,28 @@ class RpcClient(object):
             raise
 
 
+    def run_batch(self, calls):
+        """
+        Make several RPC calls to the server in a single request.
+
+        The calls run in order on the server. If any of them fails, the
+        exception of the first failure is raised once they have all run.
+
+        @param calls: A list of (call, dargs) tuples.
+
+        @returns A list of the results of the calls, in order.
+        """
+        batch = rpc_client_lib.get_batch_call(self.proxy)
+        for call, dargs in calls:
+            if self.debug:
+                print 'DEBUG: %s %s' % (call, dargs)
+            batch.add(call, **dargs)
+        results = [utils.strip_unicode(result) for result in batch.execute()]
+        if self.reply_debug:
+            print results
+        return results
+
+
     def log(self, message):
         if self.print_log:
             print message
@@ -143,18 +165,51 @@ class TKO(RpcClient):
         @param job_id: The afe job id to look up.
         @returns a TestStatus object of the resulting information.
         """
+        where = 'job_tag like "%s-%%"' % job_id
+        return self._select_test_statuses((where, None))
+
+
+    @metrics.SecondsTimerDecorator(
+            'chromeos/autotest/tko/get_jobs_status_duration')
+    def get_jobs_test_statuses_from_db(self, job_ids):
+        """Get the test statuses of several jobs in a single query.
+
+        Unlike get_job_test_statuses_from_db, this matches tests on the
+        afe_job_id column, which the parser fills in from the job_tag.
+
+        @param job_ids: An iterable of afe job ids to look up.
+        @returns a dict mapping each afe job id in |job_ids| to a list of
+                 TestStatus objects, as returned by
+                 get_job_test_statuses_from_db.
+        """
+        job_ids = [int(job_id) for job_id in job_ids]
+        statuses = dict((job_id, []) for job_id in job_ids)
+        if not job_ids:
+            return statuses
+        where = ('afe_job_id IN (%s)' % ','.join(['%s'] * len(job_ids)),
+                 job_ids)
+        for status in self._select_test_statuses(where):
+            statuses[int(status.afe_job_id)].append(status)
+        return statuses
+
+
+    def _select_test_statuses(self, where):
+        """Select test statuses from tko_test_view_2.
+
+        @param where: The where clause, as accepted by db.select.
+        @returns a list of TestStatus objects.
+        """
         if self._db is None:
             self._db = db.db()
         fields = ['status', 'test_name', 'subdir', 'reason',
                   'test_started_time', 'test_finished_time', 'afe_job_id',
                   'job_owner', 'hostname', 'job_tag']
         table = 'tko_test_view_2'
-        where = 'job_tag like "%s-%%"' % job_id
         test_status = []
         # Run commit before we query to ensure that we are pulling the latest
         # results.
         self._db.commit()
-        for entry in self._db.select(','.join(fields), table, (where, None)):
+        for entry in self._db.select(','.join(fields), table, where):
             status_dict = {}
             for key,value in zip(fields, entry):
                 # All callers expect values to be a str object.
@@ -679,6 +734,50 @@ class AFE(RpcClient):
                         success=success)
 
 
+    def get_special_tasks_for_hosts(self, host_ids, **data):
+        """Get the special tasks of many hosts in one call.
+
+        @param host_ids: List of host ids.
+        @param **data: Filter keywords to pass to the RPC.
+
+        @returns: A list of SpecialTask objects.
+        """
+        tasks = self.run('get_special_tasks_for_hosts',
+                         host_ids=host_ids, **data)
+        return [SpecialTask(self, t) for t in tasks]
+
+
+    def get_host_status_tasks(self, host_ids, end_time):
+        """Get the status tasks of many hosts in one call.
+
+        @param host_ids: List of host ids.
+        @param end_time: Time reference for the hosts' status.
+
+        @returns: A dictionary mapping host ids to SpecialTask objects.
+                  Hosts without a status task are left out.
+        """
+        tasks = self.run('get_host_status_tasks',
+                         host_ids=host_ids, end_time=end_time)
+        return dict((t['host']['id'], SpecialTask(self, t)) for t in tasks)
+
+
+    def get_host_diagnosis_intervals(self, host_ids, end_time, success):
+        """Get the last diagnosis interval of many hosts in one call.
+
+        @param host_ids: List of host ids.
+        @param end_time: Time reference for the diagnosis intervals.
+        @param success: Whether the intervals should start with a
+                        successful or failed status task.
+
+        @returns: A dictionary mapping host ids to [start, end] lists.
+                  Hosts that never changed state are left out.
+        """
+        intervals = self.run('get_host_diagnosis_intervals',
+                             host_ids=host_ids, end_time=end_time,
+                             success=success)
+        return dict((i[0], i[1:]) for i in intervals)
+
+
     def create_job(self, control_file, name=' ',
                    priority=priorities.Priority.DEFAULT,
                    control_type=control_data.CONTROL_TYPE_NAMES.CLIENT,
@@ -9,8 +9,16 @@ import logging
 
 import common
 
+from autotest_lib.client.common_lib import error
+from autotest_lib.server import utils
 from autotest_lib.server.cros.dynamic_suite import frontend_wrappers
 
+# Timeout in seconds for the single remote run collecting all label probes.
+_PROBE_TIMEOUT_SECS = 300
+
+# Starts the header line of each probe in the output of the probe script.
+_PROBE_MARKER = '__LABEL_PROBE__'
+
 
 def forever_exists_decorate(exists):
     """
@@ -56,10 +64,18 @@ class BaseLabel(object):
                           to tell LabelRetriever what list of label classes we
                           are generating and thus are able to have a
                           comprehensive list of the generated labels.
+    @property _PROBE_COMMANDS List of the host commands this label runs to
+                              detect itself.  LabelRetriever runs the probe
+                              commands of all its labels in a single remote
+                              script beforehand and answers the label's
+                              host.run() calls for them from the results.
+                              Commands must be spelled exactly as the label
+                              runs them; others still go to the host.
     """
 
     _NAME = None
     _LABEL_LIST = []
+    _PROBE_COMMANDS = []
 
     def generate_labels(self, host):
         """
@@ -185,6 +201,112 @@ class StringPrefixLabel(StringLabel):
         return prefix_labels, full_labels
 
 
+def _make_probe_script(command_groups):
+    """
+    Build a shell script running label probe commands.
+
+    Each group of commands runs in order in the background, concurrently with
+    the other groups.  Once all are done, the script prints for each command,
+    in order, a header line with its exit status and output sizes, followed
+    by its stdout and stderr.
+
+    @param command_groups: list of lists of commands.
+
+    @returns the script as a string.
+    """
+    lines = ['d=$(mktemp -d) || exit 1', 'trap \'rm -rf "$d"\' EXIT']
+    index = 0
+    for group in command_groups:
+        lines.append('{')
+        for command in group:
+            lines.append('(\n%s\n) >"$d/%d.out" 2>"$d/%d.err" </dev/null' %
+                         (command, index, index))
+            lines.append('echo $? >"$d/%d.rc"' % index)
+            index += 1
+        lines.append('} &')
+    lines.append('wait')
+    for i in range(index):
+        lines.append('echo %s "$(cat "$d/%d.rc")" "$(wc -c <"$d/%d.out")" '
+                     '"$(wc -c <"$d/%d.err")"' % (_PROBE_MARKER, i, i, i))
+        lines.append('cat "$d/%d.out" "$d/%d.err"' % (i, i))
+    return '\n'.join(lines)
+
+
+def _parse_probe_output(commands, output):
+    """
+    Parse the output of a probe script.
+
+    @param commands: the probed commands, in the order of the script.
+    @param output: stdout of the probe script.
+
+    @returns a dict mapping each command to its CmdResult.
+
+    @raises ValueError: if the output is malformed.
+    """
+    results = {}
+    pos = 0
+    for command in commands:
+        end = output.index('\n', pos)
+        header = output[pos:end].split()
+        if len(header) != 4 or header[0] != _PROBE_MARKER:
+            raise ValueError('bad probe header for %r: %r' %
+                             (command, output[pos:end]))
+        exit_status, stdout_len, stderr_len = [int(x) for x in header[1:]]
+        pos = end + 1
+        stdout = output[pos:pos + stdout_len]
+        pos += stdout_len
+        stderr = output[pos:pos + stderr_len]
+        pos += stderr_len
+        results[command] = utils.CmdResult(command, stdout, stderr,
+                                           exit_status)
+    return results
+
+
+class _ProbedHost(object):
+    """
+    Host wrapper answering probed commands from their cached results.
+
+    Everything else, including probed commands run with extra positional
+    arguments, stdin or args, is passed through to the real host.
+    """
+
+    def __init__(self, host, results):
+        """
+        @param host: The host object the probes ran on.
+        @param results: dict mapping probed commands to their CmdResult.
+        """
+        self._host = host
+        self._results = results
+
+
+    def __getattr__(self, name):
+        return getattr(self._host, name)
+
+
+    def run(self, command, *args, **dargs):
+        """
+        Return the probed result of |command| or run it on the host.
+
+        @see common_lib.hosts.host.run()
+        """
+        result = self._results.get(command)
+        if (result is None or args or dargs.get('stdin') is not None or
+                dargs.get('args')):
+            return self._host.run(command, *args, **dargs)
+        if result.exit_status and not dargs.get('ignore_status', False):
+            raise error.AutoservRunError('command execution error', result)
+        return result
+
+
+    def run_output(self, command, *args, **dargs):
+        """
+        Run and retrieve the value of stdout stripped of whitespace.
+
+        @see common_lib.hosts.host.run_output()
+        """
+        return self.run(command, *args, **dargs).stdout.rstrip()
+
+
 class LabelRetriever(object):
     """This class will assist in retrieving/updating the host labels."""
 
@@ -209,12 +331,46 @@ class LabelRetriever(object):
         self.label_prefix_names = set()
 
 
+    def _probe(self, host):
+        """
+        Run the probe commands of all labels on the host in one go.
+
+        @param host: The host to probe.
+
+        @returns a host object answering the probed commands from their
+            results, or |host| itself if there was nothing to probe or the
+            probe failed.
+        """
+        seen = set()
+        command_groups = []
+        for label in self._labels:
+            group = [c for c in label._PROBE_COMMANDS if c not in seen]
+            seen.update(group)
+            if group:
+                command_groups.append(group)
+        if not command_groups:
+            return host
+        commands = [c for group in command_groups for c in group]
+        try:
+            result = host.run(_make_probe_script(command_groups),
+                              timeout=_PROBE_TIMEOUT_SECS, stdout_tee=None,
+                              verbose=False)
+            results = _parse_probe_output(commands, result.stdout)
+        except (error.AutoservError, error.CmdError, ValueError):
+            logging.exception('label probe failed, running label commands '
+                              'one by one.')
+            return host
+        logging.info('probed %d label commands in one run.', len(commands))
+        return _ProbedHost(host, results)
+
+
     def get_labels(self, host):
         """
         Retrieve the labels for the host.
 
         @param host: The host to get the labels for.
         """
+        host = self._probe(host)
         labels = []
         for label in self._labels:
             logging.info('checking label %s', label.__class__.__name__)
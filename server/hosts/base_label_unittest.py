@@ -4,10 +4,12 @@
 # found in the LICENSE file.
 
 import mock
+import subprocess
 import unittest
 
 import common
 
+from autotest_lib.client.common_lib import error
 from autotest_lib.server.cros.dynamic_suite import frontend_wrappers
 from autotest_lib.server import utils
 from autotest_lib.server.hosts import base_label
@@ -66,6 +68,35 @@ class TestLabelList(base_label.StringLabel):
         return labels
 
 
+class TestProbeLabel(base_label.BaseLabel):
+    """TestProbeLabel is used to validate labels declaring probe commands."""
+
+    _NAME = 'probe_label'
+    _PROBE_COMMANDS = ['echo probed', 'exit 1']
+
+    def exists(self, host):
+        return (host.run('echo probed').stdout == 'probed\n' and
+                host.run('exit 1', ignore_status=True).exit_status == 1)
+
+
+class ProbeHost(object):
+    """A host running commands locally and recording them."""
+
+    def __init__(self):
+        self.commands = []
+
+
+    def run(self, command, ignore_status=False, **dargs):
+        self.commands.append(command)
+        proc = subprocess.Popen(['sh', '-c', command], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate()
+        result = utils.CmdResult(command, stdout, stderr, proc.returncode)
+        if result.exit_status and not ignore_status:
+            raise error.AutoservRunError('command execution error', result)
+        return result
+
+
 class MockAFEHost(utils.EmptyAFEHost):
 
     def __init__(self, labels=[], attributes={}):
@@ -184,6 +215,37 @@ class LabelRetrieverUnittests(unittest.TestCase):
                              expected_known)
 
 
+    def test_probe(self):
+        """Check probe commands of all labels run in a single command."""
+        host = ProbeHost()
+        retriever = base_label.LabelRetriever([TestProbeLabel(),
+                                               TestProbeLabel()])
+        self.assertEqual(retriever.get_labels(host),
+                         [TestProbeLabel._NAME, TestProbeLabel._NAME])
+        self.assertEqual(len(host.commands), 1)
+
+
+    def test_probed_failure_raises(self):
+        """Check a failed probe raises unless its status is ignored."""
+        host = ProbeHost()
+        retriever = base_label.LabelRetriever([TestProbeLabel()])
+        probed_host = retriever._probe(host)
+        self.assertRaises(error.AutoservRunError, probed_host.run, 'exit 1')
+        self.assertEqual(probed_host.run('echo other').stdout, 'other\n')
+        self.assertEqual(host.commands[1:], ['echo other'])
+
+
+    def test_probe_failure_falls_back(self):
+        """Check labels still run their commands when probing fails."""
+        host = ProbeHost()
+        retriever = base_label.LabelRetriever([TestProbeLabel()])
+        with mock.patch.object(base_label, '_parse_probe_output',
+                               side_effect=ValueError):
+            self.assertEqual(retriever.get_labels(host),
+                             [TestProbeLabel._NAME])
+        self.assertEqual(host.commands[1:], ['echo probed', 'exit 1'])
+
+
     @mock.patch.object(frontend_wrappers, 'RetryingAFE')
     def test_update_labels(self, mock_retry_afe):
         """Check that we add/remove the expected labels in update_labels()."""
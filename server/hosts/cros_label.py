@@ -24,13 +24,15 @@ from autotest_lib.site_utils import hwid_lib
 # pylint: disable=missing-docstring
 LsbOutput = collections.namedtuple('LsbOutput', ['unibuild', 'board'])
 
+_LSB_RELEASE_CMD = 'cat /etc/lsb-release'
+
 def _parse_lsb_output(host):
   """Parses the LSB output and returns key data points for labeling.
 
   @param host: Host that the command will be executed against
   @returns: LsbOutput with the result of parsing the /etc/lsb-release output
   """
-  release_info = utils.parse_cmd_output('cat /etc/lsb-release',
+  release_info = utils.parse_cmd_output(_LSB_RELEASE_CMD,
                                         run_method=host.run)
 
   unibuild = release_info.get('CHROMEOS_RELEASE_UNIBUILD') == '1'
@@ -41,6 +43,7 @@ class BoardLabel(base_label.StringPrefixLabel):
     """Determine the correct board label for the device."""
 
     _NAME = ds_constants.BOARD_PREFIX.rstrip(':')
+    _PROBE_COMMANDS = [_LSB_RELEASE_CMD]
 
     def generate_labels(self, host):
         # We only want to apply the board labels once, which is when they get
@@ -59,6 +62,7 @@ class ModelLabel(base_label.StringPrefixLabel):
     """Determine the correct model label for the device."""
 
     _NAME = ds_constants.MODEL_LABEL
+    _PROBE_COMMANDS = [_LSB_RELEASE_CMD]
 
     def generate_labels(self, host):
         # Based on the issue explained in BoardLabel, return the existing
@@ -101,14 +105,15 @@ class LightSensorLabel(base_label.BaseLabel):
         "in_illuminance_raw",
         "illuminance0_input",
     ]
+    _SEARCH_CMD = "find -L %s -maxdepth 4 | egrep '%s'" % (
+        _LIGHTSENSOR_SEARCH_DIR, '|'.join(_LIGHTSENSOR_FILES))
+    _PROBE_COMMANDS = [_SEARCH_CMD]
 
     def exists(self, host):
-        search_cmd = "find -L %s -maxdepth 4 | egrep '%s'" % (
-            self._LIGHTSENSOR_SEARCH_DIR, '|'.join(self._LIGHTSENSOR_FILES))
         # Run the search cmd following the symlinks. Stderr_tee is set to
         # None as there can be a symlink loop, but the command will still
         # execute correctly with a few messages printed to stderr.
-        result = host.run(search_cmd, stdout_tee=None, stderr_tee=None,
+        result = host.run(self._SEARCH_CMD, stdout_tee=None, stderr_tee=None,
                           ignore_status=True)
 
         return result.exit_status == 0
@@ -118,10 +123,10 @@ class BluetoothLabel(base_label.BaseLabel):
     """Label indicating if bluetooth is detected."""
 
     _NAME = 'bluetooth'
+    _PROBE_COMMANDS = ['test -d /sys/class/bluetooth/hci0']
 
     def exists(self, host):
-        result = host.run('test -d /sys/class/bluetooth/hci0',
-                          ignore_status=True)
+        result = host.run(self._PROBE_COMMANDS[0], ignore_status=True)
 
         return result.exit_status == 0
 
@@ -130,9 +135,10 @@ class ECLabel(base_label.BaseLabel):
     """Label to determine the type of EC on this host."""
 
     _NAME = 'ec:cros'
+    _PROBE_COMMANDS = ['mosys ec info']
 
     def exists(self, host):
-        cmd = 'mosys ec info'
+        cmd = self._PROBE_COMMANDS[0]
         # The output should look like these, so that the last field should
         # match our EC version scheme:
         #
@@ -163,6 +169,8 @@ class AccelsLabel(base_label.BaseLabel):
     """Determine the type of accelerometers on this host."""
 
     _NAME = 'accel:cros-ec'
+    _PROBE_COMMANDS = ['which ectool', 'ectool motionsense',
+                       'ectool motionsense active']
 
     def exists(self, host):
         # Check to make sure we have ectool
@@ -235,9 +243,10 @@ class AudioLoopbackDongleLabel(base_label.BaseLabel):
     """Return the label if an audio loopback dongle is plugged in."""
 
     _NAME = 'audio_loopback_dongle'
+    _PROBE_COMMANDS = [cras_utils.get_cras_nodes_cmd()]
 
     def exists(self, host):
-        nodes_info = host.run(command=cras_utils.get_cras_nodes_cmd(),
+        nodes_info = host.run(command=self._PROBE_COMMANDS[0],
                               ignore_status=True).stdout
         if (cras_utils.node_type_is_plugged('HEADPHONE', nodes_info) and
             cras_utils.node_type_is_plugged('MIC', nodes_info)):
@@ -258,13 +267,14 @@ class PowerSupplyLabel(base_label.StringPrefixLabel):
     """
 
     _NAME = 'power'
+    _PROBE_COMMANDS = ['mosys psu type']
 
     def __init__(self):
         self.psu_cmd_result = None
 
 
     def exists(self, host):
-        self.psu_cmd_result = host.run(command='mosys psu type',
+        self.psu_cmd_result = host.run(command=self._PROBE_COMMANDS[0],
                                        ignore_status=True)
         return self.psu_cmd_result.stdout.strip() != 'unknown'
 
@@ -295,17 +305,19 @@ class StorageLabel(base_label.StringPrefixLabel):
     """
 
     _NAME = 'storage'
+    # The output should be /dev/mmcblk* for SD/eMMC or /dev/sd* for scsi
+    _ROOTDEV_CMD = ' '.join(['. /usr/sbin/write_gpt.sh;',
+                             '. /usr/share/misc/chromeos-common.sh;',
+                             'load_base_vars;',
+                             'get_fixed_dst_drive'])
+    _PROBE_COMMANDS = [_ROOTDEV_CMD]
 
     def __init__(self):
         self.type_str = ''
 
 
     def exists(self, host):
-        # The output should be /dev/mmcblk* for SD/eMMC or /dev/sd* for scsi
-        rootdev_cmd = ' '.join(['. /usr/sbin/write_gpt.sh;',
-                                '. /usr/share/misc/chromeos-common.sh;',
-                                'load_base_vars;',
-                                'get_fixed_dst_drive'])
+        rootdev_cmd = self._ROOTDEV_CMD
         rootdev = host.run(command=rootdev_cmd, ignore_status=True)
         if rootdev.exit_status:
             logging.info("Fail to run %s", rootdev_cmd)
@@ -410,9 +422,10 @@ class VideoLabel(base_label.StringLabel):
         '4k_video_vp8',
         '4k_video_vp9',
     ]
+    _PROBE_COMMANDS = ['/usr/local/bin/avtest_label_detect']
 
     def generate_labels(self, host):
-        result = host.run('/usr/local/bin/avtest_label_detect',
+        result = host.run(self._PROBE_COMMANDS[0],
                           ignore_status=True).stdout
         return re.findall('^Detected label: (\w+)$', result, re.M)
 
@@ -421,12 +434,12 @@ class ArcLabel(base_label.BaseLabel):
     """Label indicates if host has ARC support."""
 
     _NAME = 'arc'
+    _PROBE_COMMANDS = ['grep CHROMEOS_ARC_VERSION /etc/lsb-release']
 
     @base_label.forever_exists_decorate
     def exists(self, host):
-        return 0 == host.run(
-            'grep CHROMEOS_ARC_VERSION /etc/lsb-release',
-            ignore_status=True).exit_status
+        return 0 == host.run(self._PROBE_COMMANDS[0],
+                             ignore_status=True).exit_status
 
 
 class CtsArchLabel(base_label.StringLabel):
@@ -452,10 +465,11 @@ class SparseCoverageLabel(base_label.StringLabel):
 
     # Prime numbers. We can easily construct 6, 10, 15 and 30 from these.
     _NAME = ['sparse_coverage_2', 'sparse_coverage_3', 'sparse_coverage_5']
+    _PROBE_COMMANDS = [_LSB_RELEASE_CMD]
 
     def _should_cover(self, host, nth_build):
         release_info = utils.parse_cmd_output(
-            'cat /etc/lsb-release', run_method=host.run)
+            _LSB_RELEASE_CMD, run_method=host.run)
         build = release_info.get('CHROMEOS_RELEASE_BUILD_NUMBER')
         branch = release_info.get('CHROMEOS_RELEASE_BRANCH_NUMBER')
         patch = release_info.get('CHROMEOS_RELEASE_PATCH_NUMBER')
@@ -546,6 +560,7 @@ class HWIDLabel(base_label.StringLabel):
     """Return all the labels generated from the hwid."""
 
     # We leave out _NAME because hwid_lib will generate everything for us.
+    _PROBE_COMMANDS = ['crossystem hwid']
 
     def __init__(self):
         # Grab the key file needed to access the hwid service.
@@ -555,7 +570,7 @@ class HWIDLabel(base_label.StringLabel):
 
     def generate_labels(self, host):
         hwid_labels = []
-        hwid = host.run_output('crossystem hwid').strip()
+        hwid = host.run_output(self._PROBE_COMMANDS[0]).strip()
         hwid_info_list = hwid_lib.get_hwid_info(hwid, hwid_lib.HWID_INFO_LABEL,
                                                 self.key_file).get('labels', [])
 
@@ -594,9 +609,11 @@ class DetachableBaseLabel(base_label.BaseLabel):
     """Label indicating if device has detachable keyboard."""
 
     _NAME = 'detachablebase'
+    _PROBE_COMMANDS = ['which hammerd']
 
     def exists(self, host):
-        return host.run('which hammerd', ignore_status=True).exit_status == 0
+        return host.run(self._PROBE_COMMANDS[0],
+                        ignore_status=True).exit_status == 0
 
 
 CROS_LABELS = [
@@ -0,0 +1,363 @@
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Persistent command channel to a host over a single ssh session.
+
+Every SSHHost.run() normally forks a local ssh client, which starts a remote
+shell for one command.  A CommandChannel instead starts one long-lived ssh
+session running a small python agent on the host.  Commands are sent to the
+agent as newline framed JSON requests, run concurrently on the host, and
+answered with their exit status, stdout and stderr in the same framing, so
+many requests can be in flight at once and a batch of them costs a single
+round trip.
+"""
+
+import base64
+import collections
+import itertools
+import json
+import logging
+import os
+import select
+import subprocess
+import tempfile
+import threading
+import time
+
+from autotest_lib.client.common_lib import utils
+
+# Runs on the host, under either python 2 or python 3.  Each request line is
+# {"id", "command", "timeout", "stdin"}; each reply line is {"id", "status",
+# "stdout", "stderr", "timed_out", "duration"}, with stdin/stdout/stderr
+# base64 encoded.  A reply with a null id tells the client the agent is up.
+# Commands run in the user's shell, as they would with a plain ssh command.
+_AGENT_SOURCE = r'''
+import base64, json, os, pwd, signal, subprocess, sys, threading, time
+
+_in = getattr(sys.stdin, 'buffer', sys.stdin)
+_out = getattr(sys.stdout, 'buffer', sys.stdout)
+_lock = threading.Lock()
+_running = {}
+_shell = (os.environ.get('SHELL') or pwd.getpwuid(os.getuid()).pw_shell or
+          '/bin/sh')
+
+
+def _reply(reply):
+    line = (json.dumps(reply) + '\n').encode('utf-8')
+    with _lock:
+        _out.write(line)
+        _out.flush()
+
+
+def _kill(proc, timed_out=None):
+    if timed_out is not None:
+        timed_out.append(True)
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _encode(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _run(request):
+    start = time.time()
+    command = request['command']
+    if not isinstance(command, str):
+        command = command.encode('utf-8')
+    try:
+        proc = subprocess.Popen([_shell, '-c', command],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, close_fds=True,
+                                preexec_fn=os.setsid)
+    except OSError as e:
+        _reply({'id': request['id'], 'status': 127, 'stdout': '',
+                'stderr': _encode(str(e).encode('utf-8')),
+                'timed_out': False, 'duration': 0})
+        return
+    _running[request['id']] = proc
+    timed_out = []
+    timer = None
+    if request.get('timeout') is not None:
+        timer = threading.Timer(request['timeout'], _kill, (proc, timed_out))
+        timer.daemon = True
+        timer.start()
+    stdin = base64.b64decode(request.get('stdin') or '')
+    stdout, stderr = proc.communicate(stdin)
+    if timer:
+        timer.cancel()
+    _running.pop(request['id'], None)
+    _reply({'id': request['id'], 'status': proc.returncode,
+            'stdout': _encode(stdout), 'stderr': _encode(stderr),
+            'timed_out': bool(timed_out), 'duration': time.time() - start})
+
+
+def _main():
+    _reply({'id': None})
+    for line in iter(_in.readline, b''):
+        request = json.loads(line.decode('utf-8'))
+        thread = threading.Thread(target=_run, args=(request,))
+        thread.daemon = True
+        thread.start()
+    for proc in list(_running.values()):
+        _kill(proc)
+
+
+_main()
+'''
+
+# The agent is passed on the command line so that stdin is left entirely to
+# the request stream.
+_AGENT_COMMAND = ('exec python -u -c "import base64; '
+                  'exec(base64.b64decode(\'%s\'))"' %
+                  base64.b64encode(_AGENT_SOURCE))
+
+# Seconds to wait for a reply past a command's own timeout before the
+# channel is considered wedged.
+_REPLY_GRACE_SECS = 30
+
+# Seconds to wait for the agent to exit once its stdin is closed.
+_CLOSE_TIMEOUT_SECS = 5
+
+
+Reply = collections.namedtuple(
+        'Reply', ['exit_status', 'stdout', 'stderr', 'timed_out', 'duration'])
+
+
+class ChannelError(Exception):
+    """The channel could not deliver a command; it was not run."""
+
+
+class CommandLostError(ChannelError):
+    """The channel went away after a command was sent.
+
+    The command may or may not have run on the host.
+    """
+
+
+class _Pending(object):
+    """A request waiting for its reply."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.reply = None
+        self.error = None
+
+
+class CommandChannel(object):
+    """A persistent ssh session running commands through a remote agent.
+
+    Safe to use from several threads at once.  A channel is tied to the
+    process that started it; callers that fork need a new one per process.
+    """
+
+    def __init__(self, ssh_command):
+        """
+        @param ssh_command: ssh command line to reach the host, without the
+                remote command, e.g. the output of SSHHost.ssh_command().
+        """
+        self._ssh_command = ssh_command
+        self._process = None
+        self._reader = None
+        self._pending = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self.pid = os.getpid()
+
+
+    def start(self, timeout=30):
+        """Start the ssh session and wait for the agent to come up.
+
+        @param timeout: seconds to wait for the agent.
+
+        @raises ChannelError: if the agent did not start.
+        """
+        full_cmd = '%s "%s"' % (self._ssh_command,
+                                utils.sh_escape(_AGENT_COMMAND))
+        stderr = tempfile.TemporaryFile()
+        try:
+            self._process = subprocess.Popen(
+                    full_cmd, shell=True, stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE, stderr=stderr, close_fds=True,
+                    bufsize=-1)
+            ready, _, _ = select.select([self._process.stdout], [], [],
+                                        timeout)
+            line = self._process.stdout.readline() if ready else ''
+            if not line or json.loads(line).get('id', 0) is not None:
+                raise ChannelError('agent did not start')
+        except (ChannelError, OSError, ValueError) as e:
+            stderr.seek(0)
+            self._kill()
+            raise ChannelError('%s: %s' % (e, stderr.read().strip()))
+        finally:
+            stderr.close()
+        self._reader = threading.Thread(target=self._read_replies,
+                                        name='ssh-channel-reader')
+        self._reader.daemon = True
+        self._reader.start()
+
+
+    def is_alive(self):
+        """@return True if the channel can take new commands."""
+        process = self._process
+        return (not self._closed and process is not None and
+                process.poll() is None)
+
+
+    def run(self, command, timeout=None, stdin=None):
+        """Run a command on the host.
+
+        @param command: shell command line.
+        @param timeout: seconds after which the command is killed, or None.
+        @param stdin: optional string to feed to the command.
+
+        @return a Reply.
+
+        @raises ChannelError: if the command could not be sent.
+        @raises CommandLostError: if the channel went away before the reply.
+        """
+        return self.run_batch([command], timeout=timeout, stdin=stdin)[0]
+
+
+    def run_batch(self, commands, timeout=None, stdin=None):
+        """Send several commands in one write and wait for all of them.
+
+        The commands run concurrently on the host.
+
+        @param commands: list of shell command lines.
+        @param timeout: seconds after which each command is killed, or None.
+        @param stdin: optional string to feed to each command.
+
+        @return a list of Reply, in the order of |commands|.
+
+        @raises ChannelError: if the commands could not be sent.
+        @raises CommandLostError: if the channel went away before all replies
+                arrived.
+        """
+        ids, pendings = self._send(commands, timeout, stdin)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout + _REPLY_GRACE_SECS
+        try:
+            for pending in pendings:
+                while not pending.done.is_set():
+                    wait = 1
+                    if deadline is not None:
+                        wait = min(wait, deadline - time.time())
+                        if wait <= 0:
+                            self.close()
+                            raise CommandLostError('no reply from the agent')
+                    pending.done.wait(wait)
+                if pending.error:
+                    raise pending.error
+        finally:
+            with self._lock:
+                for request_id in ids:
+                    self._pending.pop(request_id, None)
+        return [pending.reply for pending in pendings]
+
+
+    def _send(self, commands, timeout, stdin):
+        """Register and write requests for |commands|.
+
+        @return a tuple (request ids, list of _Pending).
+        """
+        lines = []
+        ids = []
+        pendings = []
+        encoded_stdin = base64.b64encode(stdin) if stdin else None
+        with self._lock:
+            if not self.is_alive():
+                raise ChannelError('channel is not running')
+            # close() may clear _process from another thread once the lock
+            # is released.
+            process = self._process
+            for command in commands:
+                request_id = next(self._ids)
+                pending = _Pending()
+                self._pending[request_id] = pending
+                ids.append(request_id)
+                pendings.append(pending)
+                lines.append(json.dumps({'id': request_id,
+                                         'command': command,
+                                         'timeout': timeout,
+                                         'stdin': encoded_stdin}))
+        try:
+            with self._write_lock:
+                process.stdin.write('\n'.join(lines) + '\n')
+                process.stdin.flush()
+        except (IOError, OSError, ValueError) as e:
+            with self._lock:
+                for request_id in ids:
+                    self._pending.pop(request_id, None)
+            self.close()
+            raise ChannelError('failed to send commands: %s' % e)
+        return ids, pendings
+
+
+    def _read_replies(self):
+        """Reader thread: hand replies to their waiting requests."""
+        stdout = self._process.stdout
+        try:
+            for line in iter(stdout.readline, ''):
+                reply = json.loads(line)
+                with self._lock:
+                    pending = self._pending.get(reply['id'])
+                if pending is None:
+                    continue
+                pending.reply = Reply(
+                        exit_status=reply['status'],
+                        stdout=base64.b64decode(reply['stdout']),
+                        stderr=base64.b64decode(reply['stderr']),
+                        timed_out=reply['timed_out'],
+                        duration=reply['duration'])
+                pending.done.set()
+        except (IOError, ValueError, KeyError, TypeError):
+            logging.exception('Malformed reply on ssh command channel')
+        with self._lock:
+            self._closed = True
+            pendings = self._pending.values()
+        for pending in pendings:
+            if not pending.done.is_set():
+                pending.error = CommandLostError('ssh command channel closed')
+                pending.done.set()
+
+
+    def close(self):
+        """Stop the agent and the ssh session."""
+        with self._lock:
+            if self._closed and self._process is None:
+                return
+            self._closed = True
+            process = self._process
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except (IOError, OSError):
+            pass
+        deadline = time.time() + _CLOSE_TIMEOUT_SECS
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        self._kill()
+
+
+    def _kill(self):
+        """Kill the local ssh process, if it is still running."""
+        with self._lock:
+            process, self._process = self._process, None
+        if process is None:
+            return
+        if process.poll() is None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+            process.wait()
+        if self._reader is None:
+            process.stdout.close()
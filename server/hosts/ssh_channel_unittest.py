@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Tests for ssh_channel, running the agent locally instead of over ssh."""
+
+import os
+import time
+import unittest
+
+import mock
+
+import common
+from autotest_lib.server.hosts import ssh_channel
+
+
+class CommandChannelTest(unittest.TestCase):
+    """Tests for CommandChannel."""
+
+    def setUp(self):
+        self.channel = ssh_channel.CommandChannel('sh -c')
+        self.channel.start(timeout=10)
+        self.addCleanup(self.channel.close)
+
+
+    def test_run(self):
+        """Test a command returns its exit status and output."""
+        reply = self.channel.run('echo out; echo err >&2; exit 3')
+        self.assertEqual(reply.exit_status, 3)
+        self.assertEqual(reply.stdout, 'out\n')
+        self.assertEqual(reply.stderr, 'err\n')
+        self.assertFalse(reply.timed_out)
+
+
+    def test_stdin(self):
+        """Test binary stdin is passed to the command untouched."""
+        reply = self.channel.run('cat', stdin='a\x00\xff\n')
+        self.assertEqual(reply.stdout, 'a\x00\xff\n')
+
+
+    def test_batch_runs_concurrently(self):
+        """Test a batch returns replies in order and runs in parallel."""
+        start = time.time()
+        replies = self.channel.run_batch(['sleep 1; echo %d' % i
+                                          for i in range(5)])
+        self.assertLess(time.time() - start, 4)
+        self.assertEqual([r.stdout for r in replies],
+                         ['%d\n' % i for i in range(5)])
+
+
+    def test_timeout(self):
+        """Test a command running past its timeout is killed."""
+        reply = self.channel.run('sleep 30', timeout=1)
+        self.assertTrue(reply.timed_out)
+        self.assertTrue(self.channel.is_alive())
+
+
+    def test_lost_command(self):
+        """Test in-flight commands fail once the session goes away."""
+        self.assertRaises(ssh_channel.CommandLostError,
+                          self.channel.run, 'kill -9 $PPID; sleep 30')
+        self.assertFalse(self.channel.is_alive())
+        self.assertRaises(ssh_channel.ChannelError, self.channel.run, 'true')
+
+
+    def test_user_shell(self):
+        """Test commands run in the user's shell."""
+        with mock.patch.dict(os.environ, {'SHELL': '/bin/bash'}):
+            channel = ssh_channel.CommandChannel('sh -c')
+            channel.start(timeout=10)
+        self.addCleanup(channel.close)
+        self.assertEqual(channel.run('echo $0').stdout, '/bin/bash\n')
+
+
+    def test_start_failure(self):
+        """Test a session that never runs the agent fails to start."""
+        channel = ssh_channel.CommandChannel('true')
+        self.assertRaises(ssh_channel.ChannelError, channel.start, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,11 +12,16 @@ You should import the "hosts" package instead of importing each type of host.
 
 import inspect
 import logging
+import os
 import re
+import threading
+import time
 from autotest_lib.client.common_lib import error
 from autotest_lib.client.common_lib import pxssh
+from autotest_lib.client.common_lib.global_config import global_config
 from autotest_lib.server import utils
 from autotest_lib.server.hosts import abstract_ssh
+from autotest_lib.server.hosts import ssh_channel
 
 # In case cros_host is being ran via SSP on an older Moblab version with an
 # older chromite version.
@@ -25,6 +30,17 @@ try:
 except ImportError:
     metrics = utils.metrics_mock
 
+enable_command_channel = global_config.get_config_value(
+        'AUTOSERV', 'enable_ssh_command_channel', type=bool, default=False)
+
+# Seconds to wait before trying to start the command channel again after it
+# failed to start, e.g. because the host is down or has no python.
+_COMMAND_CHANNEL_RETRY_SECS = 300
+
+# Output tees the command channel can honor; it only gets a command's output
+# once the command is done, so callers that stream it keep using plain ssh.
+_COMMAND_CHANNEL_TEES = (None, utils.TEE_TO_LOGS, utils.DEVNULL)
+
 
 class SSHHost(abstract_ssh.AbstractSSHHost):
     """
@@ -56,6 +72,9 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
                 hostname: network hostname or address of remote machine
         """
         super(SSHHost, self)._initialize(hostname=hostname, *args, **dargs)
+        self._command_channel = None
+        self._command_channel_lock = threading.Lock()
+        self._command_channel_retry_time = 0
         self.setup_ssh()
 
 
@@ -274,6 +293,9 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
         This RPC call has an overhead of minimum 40ms and up to 400ms on
         servers (crbug.com/734887). Each time a run_very_slowly is added for
         every job - a server core dies in the lab.
+        With AUTOSERV enable_ssh_command_channel set, commands whose output
+        is not streamed to a custom tee go through a persistent command
+        channel to the host instead, falling back to ssh if it is down.
         @see common_lib.hosts.host.run()
 
         @param timeout: command execution timeout
@@ -306,6 +328,18 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
 
             env = " ".join("=".join(pair) for pair in self.env.iteritems())
             try:
+                if (enable_command_channel and not options and
+                        (stdin is None or isinstance(stdin, basestring)) and
+                        stdout_tee in _COMMAND_CHANNEL_TEES and
+                        stderr_tee in _COMMAND_CHANNEL_TEES):
+                    try:
+                        return self._run_over_channel(
+                                command, timeout, ignore_status, stdout_tee,
+                                stderr_tee, connect_timeout, env, stdin, args,
+                                ignore_timeout, ssh_failure_retry_ok)
+                    except ssh_channel.ChannelError as e:
+                        logging.debug('Running through ssh instead of the '
+                                      'command channel: %s', e)
                 return self._run(command, timeout, ignore_status,
                                  stdout_tee, stderr_tee, connect_timeout, env,
                                  options, stdin, args, ignore_timeout,
@@ -323,6 +357,199 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
         return self.run_very_slowly(*args, **kwargs)
 
 
+    def run_batch(self, commands, timeout=3600, ignore_status=False,
+                  connect_timeout=30, verbose=True):
+        """
+        Run several independent commands on the remote host.
+
+        When the ssh command channel is enabled, all the commands are sent
+        in one round trip and run concurrently on the host, so they must not
+        depend on each other.  Otherwise they are run one after the other.
+
+        @param commands: list of command line strings.
+        @param timeout: execution timeout of each command.
+        @param ignore_status: do not raise an exception, no matter what the
+                exit codes of the commands are.
+        @param connect_timeout: ssh connection timeout (in seconds)
+        @param verbose: log the commands
+
+        @return a list of CmdResult objects, in the order of |commands|.
+
+        @raises AutoservRunError: if a command timed out, or, once all of
+                them ran, if one of them failed.
+        """
+        if verbose:
+            for command in commands:
+                logging.debug("Running (ssh batch) '%s'", command)
+        results = None
+        if enable_command_channel:
+            self.start_master_ssh()
+            try:
+                results = self._run_batch_over_channel(commands, timeout,
+                                                       connect_timeout)
+            except ssh_channel.ChannelError as e:
+                logging.debug('Running batch through ssh instead of the '
+                              'command channel: %s', e)
+        if results is None:
+            results = [self.run(command, timeout=timeout, ignore_status=True,
+                                connect_timeout=connect_timeout,
+                                verbose=False)
+                       for command in commands]
+        if not ignore_status:
+            for result in results:
+                if result.exit_status > 0:
+                    raise error.AutoservRunError('command execution error',
+                                                 result)
+        return results
+
+
+    def close(self):
+        with self._command_channel_lock:
+            channel = self._command_channel
+            self._command_channel = None
+        if channel and channel.pid == os.getpid():
+            channel.close()
+        super(SSHHost, self).close()
+
+
+    def _get_command_channel(self, connect_timeout):
+        """
+        Return the persistent command channel to the host, starting it if
+        needed.
+
+        A channel inherited from a parent process is left alone, since its
+        ssh session belongs to the parent.
+
+        @param connect_timeout: seconds to wait for the channel to start.
+
+        @raises ssh_channel.ChannelError: if no channel is available.
+        """
+        with self._command_channel_lock:
+            channel = self._command_channel
+            if channel and channel.pid == os.getpid():
+                if channel.is_alive():
+                    return channel
+                channel.close()
+            self._command_channel = None
+            if time.time() < self._command_channel_retry_time:
+                raise ssh_channel.ChannelError('channel recently failed')
+            channel = ssh_channel.CommandChannel(
+                    self.ssh_command(connect_timeout))
+            try:
+                channel.start(timeout=connect_timeout)
+            except ssh_channel.ChannelError:
+                self._command_channel_retry_time = (
+                        time.time() + _COMMAND_CHANNEL_RETRY_SECS)
+                raise
+            self._command_channel = channel
+            return channel
+
+
+    def _channel_command(self, command, env, args=()):
+        """Build the remote command line like _run() sends it over ssh."""
+        for arg in args:
+            command += ' "%s"' % utils.sh_escape(arg)
+        if env.strip():
+            command = 'export %s; %s' % (env, command)
+        return command
+
+
+    def _channel_result(self, command, reply, stdout_tee=utils.TEE_TO_LOGS,
+                        stderr_tee=utils.TEE_TO_LOGS, ignore_status=False):
+        """
+        Turn a command channel reply into a CmdResult, logging its output
+        the way utils.run() would.
+        """
+        outputs = ((reply.stdout, stdout_tee, utils.DEFAULT_STDOUT_LEVEL,
+                    utils.STDOUT_PREFIX),
+                   (reply.stderr, stderr_tee,
+                    utils.get_stderr_level(ignore_status),
+                    utils.STDERR_PREFIX))
+        for data, tee, level, prefix in outputs:
+            if data:
+                tee_file = utils.get_stream_tee_file(tee, level, prefix=prefix)
+                tee_file.write(data)
+                tee_file.flush()
+        return utils.CmdResult(command, reply.stdout, reply.stderr,
+                               reply.exit_status, reply.duration)
+
+
+    def _run_over_channel(self, command, timeout, ignore_status,
+                          stdout, stderr, connect_timeout, env, stdin, args,
+                          ignore_timeout, ssh_failure_retry_ok):
+        """
+        Helper function for run() sending the command over the persistent
+        command channel.  Behaves like a single attempt of _run().
+
+        @raises ssh_channel.ChannelError: if the command was not run and
+                should go through _run(), or if it may be retried there.
+        """
+        command = self._channel_command(command, env, args)
+        counter = metrics.Counter('chromeos/autotest/ssh/channel_commands')
+        channel = self._get_command_channel(connect_timeout)
+        try:
+            reply = channel.run(command, timeout=timeout, stdin=stdin)
+        except ssh_channel.CommandLostError as e:
+            counter.increment(fields={'outcome': 'lost'})
+            if ssh_failure_retry_ok:
+                raise
+            # The command may have taken the channel down, e.g. a reboot;
+            # report it the way an ssh client cut off mid-command would.
+            reply = ssh_channel.Reply(exit_status=255, stdout='',
+                                      stderr='%s\n' % e, timed_out=False,
+                                      duration=0)
+        else:
+            counter.increment(fields={'outcome': 'success'})
+        if ssh_failure_retry_ok and (reply.timed_out or
+                                     reply.exit_status == 255):
+            raise ssh_channel.ChannelError('retrying after exit status %s' %
+                                           reply.exit_status)
+        result = self._channel_result(command, reply, stdout, stderr,
+                                      ignore_status)
+        if reply.timed_out:
+            if ignore_timeout:
+                return None
+            raise error.CmdTimeoutError(
+                    command, result,
+                    'Command did not complete within %d seconds' % timeout)
+        if not ignore_status and result.exit_status > 0:
+            raise error.AutoservRunError('command execution error', result)
+        return result
+
+
+    def _run_batch_over_channel(self, commands, timeout, connect_timeout):
+        """
+        Helper function for run_batch() sending all the commands in one
+        round trip over the persistent command channel.
+
+        @raises ssh_channel.ChannelError: if the commands were not sent.
+        @raises AutoservRunError: if a command timed out.
+        """
+        env = ' '.join('='.join(pair) for pair in self.env.iteritems())
+        commands = [self._channel_command(command, env)
+                    for command in commands]
+        channel = self._get_command_channel(connect_timeout)
+        counter = metrics.Counter('chromeos/autotest/ssh/channel_commands')
+        try:
+            replies = channel.run_batch(commands, timeout=timeout)
+        except ssh_channel.CommandLostError as e:
+            counter.increment_by(len(commands), fields={'outcome': 'lost'})
+            replies = [ssh_channel.Reply(exit_status=255, stdout='',
+                                         stderr='%s\n' % e, timed_out=False,
+                                         duration=0)] * len(commands)
+        else:
+            counter.increment_by(len(commands), fields={'outcome': 'success'})
+        results = []
+        for command, reply in zip(commands, replies):
+            result = self._channel_result(command, reply, ignore_status=True)
+            if reply.timed_out:
+                raise error.AutoservRunError(
+                        'Timeout encountered: Command did not complete '
+                        'within %d seconds' % timeout, result)
+            results.append(result)
+        return results
+
+
     def run_background(self, command, verbose=True):
         """Start a command on the host in the background.
 
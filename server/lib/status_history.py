@@ -35,6 +35,8 @@ the logs explaining a failure or repair event.
 """
 
 import common
+import collections
+import operator
 import os
 from autotest_lib.frontend import setup_django_environment
 from django.db import models as django_models
@@ -68,6 +70,10 @@ UNKNOWN = 1
 WORKING = 2
 BROKEN = 3
 
+# Maximum number of hosts covered by a single database query in the
+# bulk queries below, to keep the generated SQL to a sane size.
+_BULK_QUERY_HOSTS = 500
+
 
 def parse_time(time_string):
     """Parse time according to a canonical form.
@@ -265,6 +271,31 @@ class _SpecialTaskEvent(_JobEvent):
         return [cls(afe.server, t) for t in tasks]
 
 
+    @classmethod
+    def get_tasks_for_hosts(cls, afe, host_ids, start_time, end_time):
+        """Return special tasks for many hosts in a given time range.
+
+        Like `get_tasks()`, but for all the hosts in `host_ids` in a
+        single RPC.
+
+        @param afe         Autotest frontend
+        @param host_ids    Database host ids of the desired hosts.
+        @param start_time  Start time of the range of interest.
+        @param end_time    End time of the range of interest.
+
+        @return A list of `_SpecialTaskEvent` objects.
+
+        """
+        query_start = time_utils.epoch_time_to_date_string(start_time)
+        query_end = time_utils.epoch_time_to_date_string(end_time)
+        tasks = afe.get_special_tasks_for_hosts(
+                host_ids,
+                time_started__gte=query_start,
+                time_finished__lte=query_end,
+                is_complete=1)
+        return [cls(afe.server, t) for t in tasks]
+
+
     @classmethod
     def get_status_task(cls, afe, host_id, end_time):
         """Return the task indicating a host's status at a given time.
@@ -286,6 +317,12 @@ class _SpecialTaskEvent(_JobEvent):
         return cls(afe.server, task) if task else None
 
 
+    @property
+    def host_id(self):
+        """Return the database id of the host the task ran on."""
+        return self._afetask.host.id
+
+
     def __init__(self, afe_hostname, afetask):
         self._afe_hostname = afe_hostname
         self._afetask = afetask
@@ -387,6 +424,39 @@ class _TestJobEvent(_JobEvent):
         return [cls(afe.server, hqe) for hqe in hqelist]
 
 
+    @classmethod
+    def get_hqes_for_hosts(cls, afe, host_ids, start_time, end_time):
+        """Return HQEs for many hosts in a given time range.
+
+        Like `get_hqes()`, but for all the hosts in `host_ids` in a
+        single RPC.
+
+        @param afe         Autotest frontend
+        @param host_ids    Database host ids of the desired hosts.
+        @param start_time  Start time of the range of interest.
+        @param end_time    End time of the range of interest.
+
+        @return A list of `_TestJobEvent` objects.
+
+        """
+        query_start = time_utils.epoch_time_to_date_string(start_time)
+        query_end = time_utils.epoch_time_to_date_string(end_time)
+        hqelist = afe.get_host_queue_entries_by_insert_time(
+                host_id__in=host_ids,
+                insert_time_after=query_start,
+                insert_time_before=query_end,
+                started_on__gte=query_start,
+                started_on__lte=query_end,
+                complete=1)
+        return [cls(afe.server, hqe) for hqe in hqelist]
+
+
+    @property
+    def host_id(self):
+        """Return the database id of the host the job ran on."""
+        return self._hqe.host.id
+
+
     def __init__(self, afe_hostname, hqe):
         self._afe_hostname = afe_hostname
         self._hqe = hqe
@@ -512,7 +582,65 @@ class HostJobHistory(object):
 
         kwargs = {'multiple_labels': labels}
         hosts = afe.get_hosts(**kwargs)
-        return [cls(afe, h, start_time, end_time) for h in hosts]
+        histories = [cls(afe, h, start_time, end_time) for h in hosts]
+        cls.prefetch(afe, histories)
+        return histories
+
+
+    @classmethod
+    def prefetch(cls, afe, histories, intervals=False, events=False):
+        """Fill in the data of many `HostJobHistory` instances at once.
+
+        Data that would otherwise be queried separately for each
+        history, one host at a time, is instead queried for all the
+        histories with a handful of bulk RPCs.  The status task is
+        always prefetched, since every use of a history needs it.
+
+        @param afe         Autotest frontend
+        @param histories   The `HostJobHistory` instances to fill in.
+        @param intervals   Whether to also prefetch the time bounds of
+                           the last diagnosis interval.
+        @param events      Whether to also prefetch the history of
+                           events in the histories' time interval.
+
+        """
+        by_times = collections.defaultdict(list)
+        for history in histories:
+            by_times[history.start_time, history.end_time].append(history)
+        for (start_time, end_time), group in by_times.iteritems():
+            host_ids = [h._host.id for h in group]
+            query_end = time_utils.epoch_time_to_date_string(end_time)
+            tasks = afe.get_host_status_tasks(host_ids, query_end)
+            for history in group:
+                task = tasks.get(history._host.id)
+                history._set_status_task(
+                        _SpecialTaskEvent(afe.server, task) if task else None)
+            if intervals:
+                for success in (True, False):
+                    interval_ids = set(
+                            h._host.id for h in group
+                            if h._status_task is not None and
+                            (h._status_diagnosis != WORKING) == success)
+                    if not interval_ids:
+                        continue
+                    bounds = afe.get_host_diagnosis_intervals(
+                            list(interval_ids), query_end, success)
+                    for history in group:
+                        if history._host.id in interval_ids:
+                            history._interval_times = bounds.get(
+                                    history._host.id, [])
+            if events and start_time is not None:
+                newhistory = (
+                        _SpecialTaskEvent.get_tasks_for_hosts(
+                                afe, host_ids, start_time, end_time) +
+                        _TestJobEvent.get_hqes_for_hosts(
+                                afe, host_ids, start_time, end_time))
+                host_events = collections.defaultdict(list)
+                for event in newhistory:
+                    host_events[event.host_id].append(event)
+                for history in group:
+                    history._history = sorted(
+                            host_events[history._host.id], reverse=True)
 
 
     def __init__(self, afe, afehost, start_time, end_time):
@@ -526,6 +654,8 @@ class HostJobHistory(object):
         self._status_interval = None
         self._status_diagnosis = None
         self._status_task = None
+        # Time bounds of the last diagnosis interval, if prefetched.
+        self._interval_times = None
 
 
     def _get_history(self, start_time, end_time):
@@ -579,18 +709,23 @@ class HostJobHistory(object):
         return self._extract_prefixed_label(prefix)
 
 
-    def _init_status_task(self):
-        """Fill in `self._status_diagnosis` and `_status_task`."""
-        if self._status_diagnosis is not None:
-            return
-        self._status_task = _SpecialTaskEvent.get_status_task(
-                self._afe, self._host.id, self.end_time)
+    def _set_status_task(self, status_task):
+        """Set `self._status_task`, and `_status_diagnosis` from it."""
+        self._status_task = status_task
         if self._status_task is not None:
             self._status_diagnosis = self._status_task.diagnosis
         else:
             self._status_diagnosis = UNKNOWN
 
 
+    def _init_status_task(self):
+        """Fill in `self._status_diagnosis` and `_status_task`."""
+        if self._status_diagnosis is not None:
+            return
+        self._set_status_task(_SpecialTaskEvent.get_status_task(
+                self._afe, self._host.id, self.end_time))
+
+
     def _init_status_interval(self):
         """Fill in `self._status_interval`."""
         if self._status_interval is not None:
@@ -599,15 +734,16 @@ class HostJobHistory(object):
         self._status_interval = []
         if self._status_task is None:
             return
-        query_end = time_utils.epoch_time_to_date_string(self.end_time)
-        interval = self._afe.get_host_diagnosis_interval(
-                self._host.id, query_end,
-                self._status_diagnosis != WORKING)
-        if not interval:
+        if self._interval_times is None:
+            query_end = time_utils.epoch_time_to_date_string(self.end_time)
+            self._interval_times = self._afe.get_host_diagnosis_interval(
+                    self._host.id, query_end,
+                    self._status_diagnosis != WORKING)
+        if not self._interval_times:
             return
         self._status_interval = self._get_history(
-                parse_time(interval[0]),
-                parse_time(interval[1]))
+                parse_time(self._interval_times[0]),
+                parse_time(self._interval_times[1]))
 
 
     def diagnosis_interval(self):
@@ -712,6 +848,121 @@ def get_diagnosis_interval(host_id, end_time, success):
             task1.time_finished.strftime(time_utils.TIME_FMT)]
 
 
+def _select_task_per_host(query, host_filters, last):
+    """Select a single special task for each of many hosts.
+
+    Instead of one query per host, this issues two queries per
+    `_BULK_QUERY_HOSTS` hosts:  one finding the start time of the
+    selected task of each host, and one fetching those tasks.
+
+    @param query         Django query-set of the candidate tasks.
+    @param host_filters  A list of Django `Q` objects, one per host,
+                         each selecting the candidate tasks of one
+                         host.
+    @param last          If true, select the task that started last
+                         on each host.  If false, the task that
+                         started first.
+
+    @return A dictionary mapping the ids of the hosts with a
+            candidate task to their selected task.
+
+    """
+    aggregate = django_models.Max if last else django_models.Min
+    selected = {}
+    for i in xrange(0, len(host_filters), _BULK_QUERY_HOSTS):
+        chunk_filter = reduce(operator.or_,
+                              host_filters[i:i + _BULK_QUERY_HOSTS])
+        candidates = query.filter(chunk_filter)
+        rows = (candidates.order_by().values('host')
+                .annotate(selected_time=aggregate('time_started')))
+        selected_filters = [
+                django_models.Q(host=row['host'],
+                                time_started=row['selected_time'])
+                for row in rows if row['selected_time'] is not None]
+        if not selected_filters:
+            continue
+        tasks = candidates.filter(reduce(operator.or_, selected_filters))
+        # Break ties in the start time the same way for both queries.
+        for task in tasks.order_by('id'):
+            if last or task.host_id not in selected:
+                selected[task.host_id] = task
+    return selected
+
+
+def get_diagnosis_intervals(host_ids, end_time, success):
+    """Return the last diagnosis interval for many hosts.
+
+    Like `get_diagnosis_interval()`, but for all the hosts in
+    `host_ids`, with a few set-based queries.  Hosts that never
+    changed state are left out.
+
+    This is the RPC endpoint for `AFE.get_host_diagnosis_intervals()`.
+
+    @param host_ids    Database host ids of the desired hosts.
+    @param end_time    Find the last eligible interval before this time.
+    @param success     Whether the eligible intervals should start with a
+                       success or a failure.
+
+    @return A dictionary mapping host ids to lists containing the start
+            time of the earliest job selected, and the end time of the
+            latest job.
+
+    """
+    base_query = afe_models.SpecialTask.objects.filter(is_complete=True)
+    success_query = base_query.filter(success=True)
+    failure_query = base_query.filter(success=False, task='Repair')
+    if success:
+        query0 = success_query
+        query1 = failure_query
+    else:
+        query0 = failure_query
+        query1 = success_query
+    query0 = query0.filter(time_finished__lte=end_time)
+    first_tasks = _select_task_per_host(
+            query0, [django_models.Q(host=host_id) for host_id in host_ids],
+            last=True)
+    last_tasks = _select_task_per_host(
+            query1,
+            [django_models.Q(host=host_id,
+                             time_finished__gt=task0.time_finished)
+             for host_id, task0 in first_tasks.iteritems()],
+            last=False)
+    return dict((host_id,
+                 [task0.time_started.strftime(time_utils.TIME_FMT),
+                  last_tasks[host_id].time_finished.strftime(
+                          time_utils.TIME_FMT)])
+                for host_id, task0 in first_tasks.iteritems()
+                if host_id in last_tasks)
+
+
+def get_status_tasks(host_ids, end_time):
+    """Get the last status task for many hosts before a given time.
+
+    Like `get_status_task()`, but for all the hosts in `host_ids`,
+    with a few set-based queries.
+
+    This is the RPC endpoint for `AFE.get_host_status_tasks()`.
+
+    @param host_ids    Database host ids of the desired hosts.
+    @param end_time    End time of the range of interest.
+
+    @return A Django query-set selecting at most one special task per
+            host.
+
+    """
+    status_tasks = (django_models.Q(task='Repair') |
+                    django_models.Q(success=True))
+    query = afe_models.SpecialTask.objects.filter(
+            status_tasks,
+            time_finished__lte=end_time,
+            is_complete=True)
+    tasks = _select_task_per_host(
+            query, [django_models.Q(host=host_id) for host_id in host_ids],
+            last=True)
+    return afe_models.SpecialTask.objects.filter(
+            id__in=[task.id for task in tasks.itervalues()])
+
+
 def get_status_task(host_id, end_time):
     """Get the last status task for a host before a given time.
 
@@ -19,11 +19,13 @@ import logging
 import os
 import pickle
 import platform
+import Queue
 import re
 import select
 import shutil
 import sys
 import tempfile
+import threading
 import time
 import traceback
 import uuid
@@ -64,6 +66,12 @@ except ImportError:
 
 INCREMENTAL_TKO_PARSING = global_config.global_config.get_config_value(
         'autoserv', 'incremental_tko_parsing', type=bool, default=False)
+STATUS_LOG_FLUSH_INTERVAL = global_config.global_config.get_config_value(
+        'AUTOSERV', 'status_log_flush_interval', type=float, default=0)
+STATUS_LOG_FSYNC = global_config.global_config.get_config_value(
+        'AUTOSERV', 'status_log_fsync', type=bool, default=False)
+STATUS_PARSE_QUEUE_SIZE = global_config.global_config.get_config_value(
+        'AUTOSERV', 'status_parse_queue_size', type=int, default=1000)
 
 def _control_segment_path(name):
     """Get the pathname of the named control segment file."""
@@ -219,6 +227,64 @@ class server_job_record_hook(object):
             job._parse_status(rendered_entry)
 
 
+class status_parser_thread(object):
+    """Feeds status log lines to the incremental TKO parser from a background
+    thread, so that parsing and inserting results into the database does not
+    hold up the job.
+
+    Lines queued by a process forked after the thread was started are parsed
+    synchronously, since the thread only exists in the process that started
+    it.
+    """
+    def __init__(self, parse_line, queue_size):
+        """
+        @param parse_line: The function to call with each status log line.
+        @param queue_size: The maximum number of lines waiting to be parsed;
+                queuing more lines blocks until some are parsed.
+        """
+        self._parse_line = parse_line
+        self._queue = Queue.Queue(queue_size)
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run,
+                                        name='status_parser')
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def put(self, line):
+        """Queue a status log line to be parsed."""
+        if os.getpid() == self._pid:
+            self._queue.put(line)
+        else:
+            self._parse_line(line)
+
+
+    def wait(self):
+        """Wait until all the queued lines are parsed."""
+        if os.getpid() == self._pid:
+            self._queue.join()
+
+
+    def stop(self):
+        """Parse the queued lines and stop the thread."""
+        if os.getpid() == self._pid:
+            self._queue.put(None)
+            self._thread.join()
+
+
+    def _run(self):
+        while True:
+            line = self._queue.get()
+            try:
+                if line is None:
+                    return
+                self._parse_line(line)
+            except Exception:
+                logging.exception('Failed to parse status log line %r', line)
+            finally:
+                self._queue.task_done()
+
+
 class server_job(base_job.base_job):
     """The server-side concrete implementation of base_job.
 
@@ -352,7 +418,9 @@ class server_job(base_job.base_job):
         self._indenter = status_indenter()
         self._logger = base_job.status_logger(
             self, self._indenter, 'status.log', 'status.log',
-            record_hook=server_job_record_hook(self))
+            record_hook=server_job_record_hook(self),
+            flush_interval=STATUS_LOG_FLUSH_INTERVAL, fsync=STATUS_LOG_FSYNC)
+        self._status_parser_thread = None
 
         # Initialize a flag to indicate DUT failure during the test, e.g.,
         # unexpected reboot.
@@ -430,12 +498,23 @@ class server_job(base_job.base_job):
         Register some hooks into the subcommand modules that allow us
         to properly clean up self.hosts created in forked subprocesses.
         """
+        def before_fork(cmd):
+            # the child must neither inherit buffered status log entries
+            # nor a parser that misses lines still waiting to be parsed
+            self._logger.flush()
+            if self._status_parser_thread:
+                self._status_parser_thread.wait()
         def on_fork(cmd):
             self._existing_hosts_on_fork = set(self.hosts)
         def on_join(cmd):
             new_hosts = self.hosts - self._existing_hosts_on_fork
             for host in new_hosts:
                 host.close()
+            # the child leaves through os._exit, which skips the exit handlers
+            self._logger.flush()
+            if self._status_parser_thread:
+                self._status_parser_thread.wait()
+        subcommand.subcommand.register_prefork_hook(before_fork)
         subcommand.subcommand.register_fork_hook(on_fork)
         subcommand.subcommand.register_join_hook(on_join)
 
@@ -474,6 +553,9 @@ class server_job(base_job.base_job):
             machine_idx = self.results_db.lookup_machine(self.job_model.machine)
             self.job_model.index = job_idx
             self.job_model.machine_idx = machine_idx
+        if STATUS_PARSE_QUEUE_SIZE > 0:
+            self._status_parser_thread = status_parser_thread(
+                    self._process_status_line, STATUS_PARSE_QUEUE_SIZE)
 
 
     def cleanup_parser(self):
@@ -492,6 +574,9 @@ class server_job(base_job.base_job):
         if not self._using_parser:
             return
 
+        if self._status_parser_thread:
+            self._status_parser_thread.stop()
+            self._status_parser_thread = None
         final_tests = self.parser.end()
         for test in final_tests:
             self.__insert_test(test)
@@ -1397,6 +1482,13 @@ class server_job(base_job.base_job):
 
 
     def _parse_status(self, new_line):
+        if self._status_parser_thread:
+            self._status_parser_thread.put(new_line)
+        else:
+            self._process_status_line(new_line)
+
+
+    def _process_status_line(self, new_line):
         if self.fast and not self._using_parser:
             logging.info('Parsing lines in fast mode')
             new_tests = self.parser.process_lines([new_line])
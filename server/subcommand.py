@@ -107,7 +107,7 @@ def parallel_simple(function, arglist, subdir_name_constructor=lambda x: str(x),
 
 
 class subcommand(object):
-    fork_hooks, join_hooks = [], []
+    prefork_hooks, fork_hooks, join_hooks = [], [], []
 
     def __init__(self, func, args, subdir = None):
         # func(args) - the subcommand to run
@@ -134,6 +134,13 @@ class subcommand(object):
                    (self.func, self.args, self.subdir))
 
 
+    @classmethod
+    def register_prefork_hook(cls, hook):
+        """ Register a function to be called from the parent process just
+        before forking. """
+        cls.prefork_hooks.append(hook)
+
+
     @classmethod
     def register_fork_hook(cls, hook):
         """ Register a function to be called from the child process after
@@ -155,6 +162,8 @@ class subcommand(object):
 
 
     def fork_start(self):
+        for hook in self.prefork_hooks:
+            hook(self)
         sys.stdout.flush()
         sys.stderr.flush()
         r, w = os.pipe()
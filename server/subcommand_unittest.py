@@ -31,6 +31,7 @@ class subcommand_test(unittest.TestCase):
     def tearDown(self):
         self.god.unstub_all()
         # cleanup the hooks
+        subcommand.subcommand.prefork_hooks = []
         subcommand.subcommand.fork_hooks = []
         subcommand.subcommand.join_hooks = []
 
@@ -91,6 +92,19 @@ class subcommand_test(unittest.TestCase):
         self.god.check_playback()
 
 
+    def test_fork_start_calls_prefork_hook(self):
+        self.god.stub_function(subcommand.os, 'fork')
+        prefork_hook = self.god.create_mock_function('prefork_hook')
+        subcommand.subcommand.register_prefork_hook(prefork_hook)
+        func = self.god.create_mock_function('func')
+        cmd = _create_subcommand(func, [])
+
+        prefork_hook.expect_call(cmd)
+        subcommand.os.fork.expect_call().and_return(1000)
+        cmd.fork_start()
+        self.god.check_playback()
+
+
     def _setup_fork_start_child(self):
         self.god.stub_function(subcommand.os, 'pipe')
         self.god.stub_function(subcommand.os, 'fork')
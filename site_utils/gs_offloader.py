@@ -35,6 +35,7 @@ from autotest_lib.client.common_lib import file_utils
 from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib import utils
 from autotest_lib.site_utils import job_directories
+from autotest_lib.site_utils import job_directory_index
 # For unittest, the cloud_console.proto is not compiled yet.
 try:
     from autotest_lib.site_utils import cloud_console_client
@@ -82,6 +83,9 @@ REPORT_INTERVAL_SECS = 60 * 60
 RESULTS_DIR = '/usr/local/autotest/results'
 FAILED_OFFLOADS_FILE = os.path.join(RESULTS_DIR, 'FAILED_OFFLOADS')
 
+# Index of uploaded job directories, relative to RESULTS_DIR.
+INDEX_FILE = '.gs_offloader_index.db'
+
 FAILED_OFFLOADS_FILE_HEADER = '''
 This is the list of gs_offloader failed jobs.
 Last offloader attempt at %s failed to offload %d files.
@@ -860,6 +864,8 @@ class Offloader(object):
         offloaded.
       * _open_jobs: a dictionary mapping directory paths to Job
         objects.
+      * _index: JobDirectoryIndex used to find new job directories
+        without rescanning all of them every cycle.
     """
 
     def __init__(self, options):
@@ -893,6 +899,8 @@ class Offloader(object):
         assert self._jobdir_classes
         self._processes = options.parallelism
         self._open_jobs = {}
+        self._index = job_directory_index.JobDirectoryIndex(
+                options.index_file or None, options.reconcile_interval)
         self._pusub_topic = None
         self._offload_count_limit = 3
 
@@ -902,30 +910,46 @@ class Offloader(object):
 
         Go through the file system looking for valid job directories
         that are currently not in `self._open_jobs`, and add them in.
+        Only directories that changed since the last cycle are looked
+        at, unless the index is reconciling.
 
         """
         new_job_count = 0
+        uploaded = []
         for cls in self._jobdir_classes:
-            for resultsdir in cls.get_job_directories():
-                if (
-                        resultsdir in self._open_jobs
-                        or _is_uploaded(resultsdir)):
+            for resultsdir in self._index.find_new_directories(
+                    cls.GLOB_PATTERN, known=self._open_jobs):
+                if _is_uploaded(resultsdir):
+                    uploaded.append(resultsdir)
                     continue
                 self._open_jobs[resultsdir] = cls(resultsdir)
                 new_job_count += 1
+        self._index.add_uploaded(uploaded)
         logging.debug('Start of offload cycle - found %d new jobs',
                       new_job_count)
 
 
     def _remove_offloaded_jobs(self):
-        """Removed offloaded jobs from `self._open_jobs`."""
+        """Removed offloaded jobs from `self._open_jobs`.
+
+        Only jobs we have tried to offload can have been offloaded, so
+        other jobs are only checked when the index is reconciling, in
+        case their directory was removed behind our back.
+        """
         removed_job_count = 0
+        uploaded = []
+        check_all = self._index.reconciling
         for jobkey, job in self._open_jobs.items():
-            if (
-                    not os.path.exists(job.dirname)
-                    or _is_uploaded(job.dirname)):
+            if not (check_all or job.offload_count):
+                continue
+            if not os.path.exists(job.dirname):
                 del self._open_jobs[jobkey]
                 removed_job_count += 1
+            elif _is_uploaded(job.dirname):
+                uploaded.append(job.dirname)
+                del self._open_jobs[jobkey]
+                removed_job_count += 1
+        self._index.add_uploaded(uploaded)
         logging.debug('End of offload cycle - cleared %d new jobs, '
                       'carrying %d open jobs',
                       removed_job_count, len(self._open_jobs))
@@ -961,6 +985,8 @@ class Offloader(object):
         report failures via e-mail.
 
         """
+        if self._index.start_cycle():
+            self._index.prune_missing()
         self._add_new_jobs()
         self._report_current_jobs_count()
         with parallel.BackgroundTaskRunner(
@@ -1096,6 +1122,17 @@ def parse_options():
                       help='Minimum job age in days before a result can be '
                       'removed from local storage',
                       type='int', default=None)
+    parser.add_option('--index_file', dest='index_file',
+                      default=INDEX_FILE,
+                      help='sqlite file, relative to the results directory, '
+                      'used to remember which job directories are already '
+                      'offloaded. If empty, the index is kept in memory '
+                      'only.')
+    parser.add_option(
+            '--reconcile_interval', dest='reconcile_interval', type='int',
+            default=job_directory_index.DEFAULT_RECONCILE_INTERVAL_SECS,
+            help='Number of seconds between two full scans of the results '
+                 'directory.')
     parser.add_option(
             '--metrics-file',
             help='If provided, drop metrics to this local file instead of '
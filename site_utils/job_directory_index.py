@@ -0,0 +1,197 @@
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Incremental discovery of job result directories for gs_offloader.
+
+Listing every job directory and checking its upload marker on every offload
+cycle costs a few syscalls per directory, which adds up on drones that keep
+tens of thousands of result directories around.  `JobDirectoryIndex` avoids
+most of that work:
+
+  * The directories that contain job directories (the results root, or each
+    `hosts/<hostname>` directory) are only listed again when their mtime
+    changes, which happens whenever an entry is created or removed in them.
+  * Directories known to be uploaded are stored in a small sqlite database,
+    so they are neither re-checked during the cycle nor after a restart.
+  * Every `reconcile_interval_secs` a full scan is done anyway, to pick up
+    anything the cheap checks could have missed.
+"""
+
+import fnmatch
+import glob
+import os
+import sqlite3
+import time
+
+import common
+from autotest_lib.client.common_lib import utils
+
+try:
+    from chromite.lib import metrics
+except ImportError:
+    metrics = utils.metrics_mock
+
+
+# Default interval between two full scans of the results directory.
+DEFAULT_RECONCILE_INTERVAL_SECS = 60 * 60
+
+# An mtime this close to the time of the scan may still change without the
+# change being visible in the mtime, e.g. on file systems with a one second
+# timestamp granularity. Such directories are listed again on the next scan.
+_RACY_MTIME_SECS = 2
+
+_SCHEMA = ('CREATE TABLE IF NOT EXISTS uploaded_dirs '
+           '(dirname TEXT PRIMARY KEY)')
+
+
+class JobDirectoryIndex(object):
+    """Index of job result directories seen by the offloader."""
+
+    def __init__(self, index_path=None,
+                 reconcile_interval_secs=DEFAULT_RECONCILE_INTERVAL_SECS):
+        """
+        @param index_path: Path of the sqlite database used to persist the
+                           set of uploaded directories. If None, the index is
+                           only kept in memory.
+        @param reconcile_interval_secs: Seconds between two full scans.
+        """
+        self._index_path = index_path
+        self._reconcile_interval_secs = reconcile_interval_secs
+        self._next_reconcile = 0
+        # Nothing is cached before the first cycle, so everything gets
+        # checked anyway.
+        self._reconciling = True
+        self._conn = None
+        self._uploaded = None
+        # Maps a parent directory to its mtime at the last listing.
+        self._parent_mtimes = {}
+
+
+    def _connect(self):
+        """Open the index database and load it, on first use."""
+        if self._uploaded is not None:
+            return
+        self._conn = sqlite3.connect(self._index_path or ':memory:',
+                                     timeout=60)
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self._uploaded = set(row[0] for row in self._conn.execute(
+                'SELECT dirname FROM uploaded_dirs'))
+
+
+    def start_cycle(self):
+        """Start an offload cycle.
+
+        @return: True if this cycle does a full reconciliation scan.
+        """
+        self._connect()
+        now = time.time()
+        self._reconciling = now >= self._next_reconcile
+        if self._reconciling:
+            self._next_reconcile = now + self._reconcile_interval_secs
+            self._parent_mtimes.clear()
+        metrics.Counter(
+                'chromeos/autotest/gs_offloader/index/cycles'
+        ).increment(fields={'reconcile': self._reconciling})
+        return self._reconciling
+
+
+    @property
+    def reconciling(self):
+        """Whether the current cycle does a full reconciliation scan."""
+        return self._reconciling
+
+
+    def find_new_directories(self, glob_pattern, known=()):
+        """Find job directories that may have appeared since the last call.
+
+        @param glob_pattern: The `GLOB_PATTERN` of a _JobDirectory class,
+                             relative to the current directory.
+        @param known: Container of directories the caller already tracks;
+                      they are not checked or returned.
+
+        @return: A list of directories matching the pattern, that are not
+                 known to be uploaded or in |known|. Directories under
+                 parents that did not change since the previous call are
+                 left out, unless this cycle is reconciling.
+        """
+        self._connect()
+        parent_pattern, leaf_pattern = os.path.split(glob_pattern)
+        if parent_pattern:
+            parents = glob.glob(parent_pattern)
+        else:
+            parents = ['']
+        found = []
+        listed = 0
+        for parent in parents:
+            try:
+                mtime = os.stat(parent or '.').st_mtime
+            except OSError:
+                continue
+            if self._parent_mtimes.get(parent) == mtime:
+                continue
+            try:
+                names = os.listdir(parent or '.')
+            except OSError:
+                continue
+            listed += 1
+            if time.time() - mtime > _RACY_MTIME_SECS:
+                self._parent_mtimes[parent] = mtime
+            else:
+                self._parent_mtimes.pop(parent, None)
+            for name in fnmatch.filter(names, leaf_pattern):
+                dirname = os.path.join(parent, name)
+                if (dirname not in known and dirname not in self._uploaded
+                    and os.path.isdir(dirname)):
+                    found.append(dirname)
+        metrics.Counter(
+                'chromeos/autotest/gs_offloader/index/parents_listed'
+        ).increment_by(listed)
+        return found
+
+
+    def is_uploaded(self, dirname):
+        """Return whether a directory is known to be uploaded.
+
+        @param dirname: Path of the job directory.
+        """
+        self._connect()
+        return dirname in self._uploaded
+
+
+    def add_uploaded(self, dirnames):
+        """Record that directories are uploaded.
+
+        @param dirnames: Iterable of job directory paths.
+        """
+        self._connect()
+        new = set(dirnames) - self._uploaded
+        if not new:
+            return
+        self._uploaded.update(new)
+        self._conn.executemany(
+                'INSERT OR IGNORE INTO uploaded_dirs (dirname) VALUES (?)',
+                [(d,) for d in new])
+        self._conn.commit()
+
+
+    def prune_missing(self):
+        """Forget uploaded directories that no longer exist.
+
+        Only meant to be called during a reconciliation cycle, since it checks
+        every indexed directory.
+        """
+        self._connect()
+        gone = [d for d in self._uploaded if not os.path.exists(d)]
+        if not gone:
+            return
+        self._uploaded.difference_update(gone)
+        self._conn.executemany('DELETE FROM uploaded_dirs WHERE dirname = ?',
+                               [(d,) for d in gone])
+        self._conn.commit()
+
+
+    def __len__(self):
+        self._connect()
+        return len(self._uploaded)
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import common
+from autotest_lib.site_utils import job_directory_index
+
+
+class JobDirectoryIndexTest(unittest.TestCase):
+    """Tests for JobDirectoryIndex."""
+
+    def setUp(self):
+        self._old_cwd = os.getcwd()
+        self._results_dir = tempfile.mkdtemp()
+        os.chdir(self._results_dir)
+        for d in ['1-job', '2-job', 'hosts/host1/3-verify']:
+            os.makedirs(d)
+        open('4-not-a-dir', 'w').close()
+        self._index_dir = tempfile.mkdtemp()
+        self._index_file = os.path.join(self._index_dir, 'index.db')
+
+
+    def tearDown(self):
+        os.chdir(self._old_cwd)
+        shutil.rmtree(self._results_dir)
+        shutil.rmtree(self._index_dir)
+
+
+    def _age_parents(self):
+        """Make the parent directories old enough to be cached."""
+        old = time.time() - 60
+        for d in ['.', 'hosts/host1']:
+            os.utime(d, (old, old))
+
+
+    def test_finds_job_directories(self):
+        """Test the first scan finds every job directory."""
+        index = job_directory_index.JobDirectoryIndex(self._index_file)
+        self.assertEqual(set(index.find_new_directories('[0-9]*-*')),
+                         set(['1-job', '2-job']))
+        self.assertEqual(index.find_new_directories('hosts/*/[0-9]*-*'),
+                         ['hosts/host1/3-verify'])
+
+
+    def test_skips_known_and_uploaded(self):
+        """Test known and uploaded directories are not returned."""
+        index = job_directory_index.JobDirectoryIndex(self._index_file)
+        index.add_uploaded(['1-job'])
+        self.assertEqual(index.find_new_directories('[0-9]*-*',
+                                                    known={'2-job': None}),
+                         [])
+
+
+    def test_unchanged_parent_not_listed(self):
+        """Test a parent directory is only listed again when it changes."""
+        self._age_parents()
+        index = job_directory_index.JobDirectoryIndex(self._index_file)
+        index.start_cycle()
+        self.assertEqual(len(index.find_new_directories('[0-9]*-*')), 2)
+        self.assertEqual(index.find_new_directories('[0-9]*-*'), [])
+        os.mkdir('5-job')
+        self.assertEqual(index.find_new_directories('[0-9]*-*',
+                                                    known=['1-job', '2-job']),
+                         ['5-job'])
+
+
+    def test_reconcile_lists_everything(self):
+        """Test a reconciling cycle lists unchanged parents too."""
+        self._age_parents()
+        index = job_directory_index.JobDirectoryIndex(
+                self._index_file, reconcile_interval_secs=0)
+        self.assertTrue(index.start_cycle())
+        self.assertEqual(len(index.find_new_directories('[0-9]*-*')), 2)
+        self.assertTrue(index.start_cycle())
+        self.assertEqual(len(index.find_new_directories('[0-9]*-*')), 2)
+
+
+    def test_uploaded_set_is_persisted(self):
+        """Test uploaded directories are remembered across instances."""
+        index = job_directory_index.JobDirectoryIndex(self._index_file)
+        index.add_uploaded(['1-job'])
+        index = job_directory_index.JobDirectoryIndex(self._index_file)
+        self.assertTrue(index.is_uploaded('1-job'))
+        self.assertEqual(index.find_new_directories('[0-9]*-*'), ['2-job'])
+
+
+    def test_prune_missing(self):
+        """Test deleted directories are dropped from the index."""
+        index = job_directory_index.JobDirectoryIndex(self._index_file)
+        index.add_uploaded(['1-job', '2-job'])
+        shutil.rmtree('1-job')
+        index.prune_missing()
+        self.assertFalse(index.is_uploaded('1-job'))
+        self.assertEqual(len(index), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -482,7 +482,9 @@ class _LabInventory(collections.Mapping):
         create = lambda host: (
                 status_history.HostJobHistory(afe, host,
                                               start_time, end_time))
-        return cls([create(host) for host in afehosts], target_pools)
+        histories = [create(host) for host in afehosts]
+        status_history.HostJobHistory.prefetch(afe, histories)
+        return cls(histories, target_pools)
 
 
     def __init__(self, histories, pools):
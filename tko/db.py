@@ -2,6 +2,7 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
 import math
 import os
 import random
@@ -11,9 +12,20 @@ import time
 
 import common
 from autotest_lib.client.common_lib import global_config
+from autotest_lib.client.common_lib import utils as common_utils
 from autotest_lib.frontend import database_settings_helper
 from autotest_lib.tko import utils
 
+try:
+    from chromite.lib import metrics
+except ImportError:
+    metrics = common_utils.metrics_mock
+
+
+# Maximum number of rows sent in a single multi-row INSERT statement. Keeps
+# each statement well below the default MySQL max_allowed_packet.
+BULK_INSERT_CHUNK_SIZE = 500
+
 
 def _log_error(msg):
     """Log an error message.
@@ -50,6 +62,10 @@ class db_sql(object):
         self.con = None
         self._init_db()
 
+        # Rows buffered by table while a bulk insert is in progress, see
+        # begin_bulk_insert(). None when rows are written immediately.
+        self._bulk_rows = None
+
         # if not present, insert statuses
         self.status_idx = {}
         self.status_word = {}
@@ -367,6 +383,94 @@ class db_sql(object):
         self._exec_sql_with_commit(cmd, values, commit)
 
 
+    def insert_many(self, table, fields, rows, commit=None):
+        """\
+                'insert into table (keys) values (%s ... %s), (%s ... %s)'
+
+                Rows are sent in chunks of BULK_INSERT_CHUNK_SIZE, one
+                multi-row statement per chunk.
+
+        @param table: The name of the table.
+        @param fields: The sequence of field names.
+        @param rows: A sequence of value tuples, ordered like |fields|.
+        @param commit: If commit the transaction .
+        """
+        fields = list(fields)
+        row_refs = '(%s)' % ','.join('%s' for field in fields)
+        for start in xrange(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+            chunk = rows[start:start + BULK_INSERT_CHUNK_SIZE]
+            values = []
+            for row in chunk:
+                values.extend(row)
+            cmd = ('insert into %s (%s) values %s' %
+                   (table, ','.join(self._quote(field) for field in fields),
+                    ','.join([row_refs] * len(chunk))))
+            self.dprint('%s %s' % (cmd, values))
+
+            self._exec_sql_with_commit(cmd, values, commit)
+
+
+    def begin_bulk_insert(self):
+        """Start buffering rows written through _insert_row.
+
+        Buffered rows are grouped by table and written with insert_many() by
+        flush_bulk_insert().
+        """
+        self._bulk_rows = collections.OrderedDict()
+
+
+    def abort_bulk_insert(self):
+        """Drop any buffered rows and go back to immediate inserts."""
+        self._bulk_rows = None
+
+
+    def flush_bulk_insert(self, commit=None):
+        """Write all buffered rows and stop buffering.
+
+        @param commit: If commit the transaction .
+
+        @return: A dict mapping table name to the number of rows written.
+        """
+        pending, self._bulk_rows = self._bulk_rows, None
+        if not pending:
+            return {}
+
+        row_counts = collections.defaultdict(int)
+        start_time = time.time()
+        for (table, fields), rows in pending.iteritems():
+            self.insert_many(table, fields, rows, commit=commit)
+            row_counts[table] += len(rows)
+        duration = time.time() - start_time
+
+        for table, count in row_counts.iteritems():
+            metrics.Counter(
+                    'chromeos/autotest/tko/bulk_insert/rows',
+                    description='Rows written to TKO by bulk inserts.'
+            ).increment_by(count, fields={'table': table})
+        metrics.SecondsDistribution(
+                'chromeos/autotest/tko/bulk_insert/flush_duration',
+                description='Time spent flushing buffered TKO rows.'
+        ).add(duration)
+        self.dprint('bulk insert flushed %s in %.3fs' %
+                    (dict(row_counts), duration))
+        return dict(row_counts)
+
+
+    def _insert_row(self, table, data, commit=None):
+        """Insert a row, or buffer it if a bulk insert is in progress.
+
+        @param table: The name of the table.
+        @param data: The insert data.
+        @param commit: If commit the transaction .
+        """
+        if self._bulk_rows is None:
+            self.insert(table, data, commit=commit)
+            return
+        fields = tuple(sorted(data))
+        self._bulk_rows.setdefault((table, fields), []).append(
+                tuple(data[field] for field in fields))
+
+
     def delete(self, table, where, commit = None):
         """Delete entries.
 
@@ -433,13 +537,19 @@ class db_sql(object):
         self.delete('tko_jobs', where)
 
 
-    def insert_job(self, tag, job, parent_job_id=None, commit=None):
+    def insert_job(self, tag, job, parent_job_id=None, commit=None,
+                   bulk_insert=False, unchanged_tests=()):
         """Insert a tko job.
 
         @param tag: The job tag.
         @param job: The job object.
         @param parent_job_id: The parent job id.
         @param commit: If commit the transaction .
+        @param bulk_insert: If True, buffer the iteration, attribute and label
+                            rows of all tests and write them with multi-row
+                            inserts once every test has been inserted.
+        @param unchanged_tests: Tests of job.tests that are already up to date
+                                in the database and are not written again.
 
         @return The dict of data inserted into the tko_jobs table.
         """
@@ -478,8 +588,18 @@ class db_sql(object):
             self.insert('tko_jobs', data, commit=commit)
             job.index = self.get_last_autonumber_value()
         self.update_job_keyvals(job, commit=commit)
-        for test in job.tests:
-            self.insert_test(job, test, commit=commit)
+        if bulk_insert:
+            self.begin_bulk_insert()
+        try:
+            for test in job.tests:
+                if test not in unchanged_tests:
+                    self.insert_test(job, test, commit=commit)
+        except:
+            if bulk_insert:
+                self.abort_bulk_insert()
+            raise
+        if bulk_insert:
+            self.flush_bulk_insert(commit=commit)
 
         data['job_idx'] = job.index
         return data
@@ -537,28 +657,28 @@ class db_sql(object):
             for key, value in i.attr_keyval.iteritems():
                 data['attribute'] = key
                 data['value'] = value
-                self.insert('tko_iteration_attributes', data,
-                            commit=commit)
+                self._insert_row('tko_iteration_attributes', data,
+                                 commit=commit)
             for key, value in i.perf_keyval.iteritems():
                 data['attribute'] = key
                 if math.isnan(value) or math.isinf(value):
                     data['value'] = None
                 else:
                     data['value'] = value
-                self.insert('tko_iteration_result', data,
-                            commit=commit)
+                self._insert_row('tko_iteration_result', data,
+                                 commit=commit)
 
         data = {'test_idx': test_idx}
 
         for key, value in test.attributes.iteritems():
             data = {'test_idx': test_idx, 'attribute': key,
                     'value': value}
-            self.insert('tko_test_attributes', data, commit=commit)
+            self._insert_row('tko_test_attributes', data, commit=commit)
 
         if not is_update:
             for label_index in test.labels:
                 data = {'test_id': test_idx, 'testlabel_id': label_index}
-                self.insert('tko_test_labels_tests', data, commit=commit)
+                self._insert_row('tko_test_labels_tests', data, commit=commit)
 
 
     def read_machine_map(self):
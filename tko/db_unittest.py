@@ -3,6 +3,7 @@
 import sys
 import unittest
 
+import mock
 from cStringIO import StringIO
 
 import common
@@ -36,5 +37,72 @@ class FormatOperationalErrorTestCase(unittest.TestCase):
         self.assertIn('An operational error occurred', got)
 
 
+class BulkInsertTestCase(unittest.TestCase):
+    """Tests for the bulk insert path of db_sql."""
+
+    def setUp(self):
+        self.db = db.db_sql.__new__(db.db_sql)
+        self.db.debug = False
+        self.db.autocommit = False
+        self.db.con = mock.Mock()
+        self.db.cur = mock.Mock()
+        self.db._bulk_rows = None
+
+
+    def test_insert_many_single_statement(self):
+        """Test insert_many() sends one multi-row statement."""
+        self.db.insert_many('tko_test_attributes', ['a', 'b'],
+                            [(1, 2), (3, 4)])
+        self.db.cur.execute.assert_called_once_with(
+                'insert into tko_test_attributes (`a`,`b`) values '
+                '(%s,%s),(%s,%s)', [1, 2, 3, 4])
+
+
+    def test_insert_many_chunks(self):
+        """Test insert_many() splits rows into chunks."""
+        rows = [(i,) for i in xrange(db.BULK_INSERT_CHUNK_SIZE + 1)]
+        self.db.insert_many('tko_test_attributes', ['a'], rows)
+        self.assertEqual(self.db.cur.execute.call_count, 2)
+
+
+    def test_insert_row_immediate(self):
+        """Test _insert_row() inserts right away outside a bulk insert."""
+        self.db._insert_row('tko_test_attributes', {'a': 1})
+        self.db.cur.execute.assert_called_once_with(
+                'insert into tko_test_attributes (`a`) values (%s)', [1])
+
+
+    def test_bulk_insert_buffers_until_flush(self):
+        """Test rows are buffered by table and written on flush."""
+        self.db.begin_bulk_insert()
+        row = {'test_idx': 1, 'attribute': 'x', 'value': 'y'}
+        self.db._insert_row('tko_test_attributes', row)
+        row['value'] = 'z'
+        self.db._insert_row('tko_test_attributes', row)
+        self.db._insert_row('tko_test_labels_tests',
+                            {'test_id': 1, 'testlabel_id': 2})
+        self.assertFalse(self.db.cur.execute.called)
+
+        counts = self.db.flush_bulk_insert()
+
+        self.assertEqual(counts, {'tko_test_attributes': 2,
+                                  'tko_test_labels_tests': 1})
+        self.assertEqual(self.db.cur.execute.call_count, 2)
+        self.db.cur.execute.assert_any_call(
+                'insert into tko_test_attributes '
+                '(`attribute`,`test_idx`,`value`) values '
+                '(%s,%s,%s),(%s,%s,%s)', ['x', 1, 'y', 'x', 1, 'z'])
+        self.assertIsNone(self.db._bulk_rows)
+
+
+    def test_abort_bulk_insert(self):
+        """Test abort_bulk_insert() drops buffered rows."""
+        self.db.begin_bulk_insert()
+        self.db._insert_row('tko_test_attributes', {'a': 1})
+        self.db.abort_bulk_insert()
+        self.assertEqual(self.db.flush_bulk_insert(), {})
+        self.assertFalse(self.db.cur.execute.called)
+
+
 if __name__ == "__main__":
     unittest.main()
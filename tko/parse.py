@@ -28,7 +28,7 @@ from autotest_lib.server.cros.dynamic_suite import constants
 from autotest_lib.site_utils import job_overhead
 from autotest_lib.site_utils.sponge_lib import sponge_utils
 from autotest_lib.tko import db as tko_db, utils as tko_utils
-from autotest_lib.tko import models, parser_lib
+from autotest_lib.tko import models, parse_checkpoint, parser_lib
 from autotest_lib.tko.perf_upload import perf_uploader
 
 try:
@@ -39,7 +39,8 @@ except ImportError:
 
 _ParseOptions = collections.namedtuple(
     'ParseOptions', ['reparse', 'mail_on_failure', 'dry_run', 'suite_report',
-                     'datastore_creds', 'export_to_gcloud_path'])
+                     'datastore_creds', 'export_to_gcloud_path',
+                     'bulk_insert', 'incremental'])
 
 def parse_args():
     """Parse args."""
@@ -97,6 +98,16 @@ def parse_args():
                             "chromite/bin/."),
                       dest="export_to_gcloud_path", action="store",
                       default=None)
+    parser.add_option("--no-bulk-insert",
+                      help=("Insert test iterations, attributes and labels one "
+                            "row at a time instead of with batched multi-row "
+                            "inserts."),
+                      dest="bulk_insert", action="store_false", default=True)
+    parser.add_option("--no-incremental",
+                      help=("Always parse the whole status log, instead of "
+                            "resuming from the checkpoint of an earlier parse "
+                            "of the job."),
+                      dest="incremental", action="store_false", default=True)
     options, args = parser.parse_args()
 
     # we need a results directory
@@ -319,6 +330,8 @@ def parse_one(db, jobname, path, parse_options):
     suite_report = parse_options.suite_report
     datastore_creds = parse_options.datastore_creds
     export_to_gcloud_path = parse_options.export_to_gcloud_path
+    bulk_insert = parse_options.bulk_insert
+    incremental = parse_options.incremental
 
     tko_utils.dprint("\nScanning %s (%s)" % (jobname, path))
     old_job_idx = db.find_job(jobname)
@@ -349,11 +362,17 @@ def parse_one(db, jobname, path, parse_options):
         tko_utils.dprint("! Unable to parse job, no status file")
         return
 
+    # when reparsing, pick up from where the last parse of the job stopped
+    checkpoint = None
+    if not incremental:
+        parse_checkpoint.remove(path)
+    elif reparse and old_job_idx is not None:
+        checkpoint = parse_checkpoint.load(path, status_log, old_job_idx)
+
     # parse the status logs
     tko_utils.dprint("+ Parsing dir=%s, jobname=%s" % (path, jobname))
-    status_lines = open(status_log).readlines()
-    parser.start(job)
-    tests = parser.end(status_lines)
+    tests, restored_tests, snapshot = parse_checkpoint.parse_status_log(
+            parser, job, status_log, checkpoint)
 
     # parser.end can return the same object multiple times, so filter out dups
     job.tests = []
@@ -363,6 +382,11 @@ def parse_one(db, jobname, path, parse_options):
             already_added.add(test)
             job.tests.append(test)
 
+    # tests restored from the checkpoint that the parser did not produce again
+    # are already up to date in the database
+    unchanged_tests = set(restored_tests).difference(
+            tests[len(restored_tests):])
+
     # try and port test_idx over from the old tests, but if old tests stop
     # matching up with new ones just give up
     if reparse and old_job_idx is not None:
@@ -372,9 +396,14 @@ def parse_one(db, jobname, path, parse_options):
             if test_idx is not None:
                 test.test_idx = test_idx
             else:
+                unchanged_tests.discard(test)
                 tko_utils.dprint("! Reparse returned new test "
                                  "testname=%r subdir=%r" %
                                  (test.testname, test.subdir))
+        if unchanged_tests:
+            tko_utils.dprint("+ Resumed from checkpoint, %d of %d tests are "
+                             "unchanged" % (len(unchanged_tests),
+                                            len(job.tests)))
         if not dry_run:
             for test_idx in old_tests.itervalues():
                 where = {'test_idx' : test_idx}
@@ -436,7 +465,8 @@ def parse_one(db, jobname, path, parse_options):
 
             # Upload perf values to the perf dashboard, if applicable.
             for test in job.tests:
-                perf_uploader.upload_test(job, test, jobname)
+                if test not in unchanged_tests:
+                    perf_uploader.upload_test(job, test, jobname)
 
             # Upload job details to Sponge.
             sponge_url = sponge_utils.upload_results(job, log=tko_utils.dprint)
@@ -446,7 +476,8 @@ def parse_one(db, jobname, path, parse_options):
             # write the job into the database.
             job_data = db.insert_job(
                 jobname, job,
-                parent_job_id=job_keyval.get(constants.PARENT_JOB_ID, None))
+                parent_job_id=job_keyval.get(constants.PARENT_JOB_ID, None),
+                bulk_insert=bulk_insert, unchanged_tests=unchanged_tests)
 
             # Verify the job data is written to the database.
             if job.tests:
@@ -499,6 +530,12 @@ def parse_one(db, jobname, path, parse_options):
 
     if not dry_run:
         db.commit()
+        if incremental and snapshot:
+            try:
+                parse_checkpoint.save(path, job.index, snapshot)
+            except (IOError, OSError) as e:
+                tko_utils.dprint("WARNING: failed to save parse checkpoint "
+                                 "for %s: %s" % (path, e))
 
     # Generate a suite report.
     # Check whether this is a suite job, a suite job will be a hostless job, its
@@ -575,6 +612,7 @@ def _get_job_subdirs(path):
     # if this dir contains ONLY subdirectories, return them
     contents = set(os.listdir(path))
     contents.discard(".parse.lock")
+    contents.discard(parse_checkpoint.CHECKPOINT_FILE)
     subdirs = set(sub for sub in contents if
                   os.path.isdir(os.path.join(path, sub)))
     if len(contents) == len(subdirs) != 0:
@@ -680,7 +718,8 @@ def main():
     parse_options = _ParseOptions(options.reparse, options.mailit,
                                   options.dry_run, options.suite_report,
                                   options.datastore_creds,
-                                  options.export_to_gcloud_path)
+                                  options.export_to_gcloud_path,
+                                  options.bulk_insert, options.incremental)
     results_dir = os.path.abspath(args[0])
     assert os.path.exists(results_dir)
 
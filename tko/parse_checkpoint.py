@@ -0,0 +1,198 @@
+# Copyright 2018 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Checkpoints for incremental parsing of job status logs.
+
+A checkpoint records how far into a status log the parser got, together with
+a pickled snapshot of the parser state and of the tests it had produced at that
+point. A later parse of the same job can restore the snapshot and only feed the
+parser the lines that were appended since.
+"""
+
+import cPickle as pickle
+import hashlib
+import os
+
+import common
+from autotest_lib.tko import utils as tko_utils
+
+
+CHECKPOINT_FILE = '.parse_checkpoint'
+_CHECKPOINT_VERSION = 1
+# Number of bytes before the checkpoint offset that are hashed to detect a
+# status log that was rewritten rather than appended to.
+_TAIL_DIGEST_BYTES = 4096
+# Number of status lines fed to the parser at a time.
+_CHUNK_LINES = 1000
+
+
+class Snapshot(object):
+    """The parser state at a checkpoint, ready to be saved to disk.
+
+    The parser state and the tests are pickled together, and as soon as the
+    snapshot is taken, so that objects shared between them stay shared when
+    they are restored, and later changes to the live objects do not leak into
+    the checkpoint.
+    """
+
+    def __init__(self, status_log, offset, parser_state, tests):
+        """
+        @param status_log: Path to the status log.
+        @param offset: Byte offset in the status log of the first line that
+                       has not been fed to the parser.
+        @param parser_state: The parser's checkpoint_state.
+        @param tests: The list of tests produced by the parser so far.
+        """
+        self.status_log = status_log
+        self.offset = offset
+        self.parser_data = pickle.dumps((parser_state, tests),
+                                        pickle.HIGHEST_PROTOCOL)
+
+
+def _checkpoint_path(results_dir):
+    return os.path.join(results_dir, CHECKPOINT_FILE)
+
+
+def _tail_digest(status_log_file, offset):
+    """Hash the bytes just before |offset| in an open status log."""
+    start = max(0, offset - _TAIL_DIGEST_BYTES)
+    status_log_file.seek(start)
+    return hashlib.md5(status_log_file.read(offset - start)).hexdigest()
+
+
+def save(results_dir, job_idx, snapshot):
+    """Write a checkpoint for a parsed job.
+
+    @param results_dir: The job results directory.
+    @param job_idx: The tko job_idx the parsed tests were written to.
+    @param snapshot: A Snapshot instance.
+    """
+    with open(snapshot.status_log) as status_log_file:
+        stat = os.fstat(status_log_file.fileno())
+        tail_digest = _tail_digest(status_log_file, snapshot.offset)
+    checkpoint = {
+            'version': _CHECKPOINT_VERSION,
+            'status_log': os.path.basename(snapshot.status_log),
+            'inode': stat.st_ino,
+            'offset': snapshot.offset,
+            'tail_digest': tail_digest,
+            'job_idx': job_idx,
+            'parser_data': snapshot.parser_data,
+    }
+    path = _checkpoint_path(results_dir)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(checkpoint, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, path)
+
+
+def load(results_dir, status_log, job_idx):
+    """Load the checkpoint of a previous parse, if it is still usable.
+
+    @param results_dir: The job results directory.
+    @param status_log: Path to the status log about to be parsed.
+    @param job_idx: The tko job_idx of the job in the database.
+
+    @return: A tuple (offset, parser_state, tests), or None if there is no
+             checkpoint or it does not match the status log and database.
+    """
+    path = _checkpoint_path(results_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            checkpoint = pickle.load(f)
+        if (checkpoint.get('version') != _CHECKPOINT_VERSION
+            or checkpoint['status_log'] != os.path.basename(status_log)
+            or checkpoint['job_idx'] != job_idx):
+            tko_utils.dprint('! Ignoring stale parse checkpoint %s' % path)
+            return None
+        offset = checkpoint['offset']
+        with open(status_log) as status_log_file:
+            stat = os.fstat(status_log_file.fileno())
+            if (stat.st_ino != checkpoint['inode'] or stat.st_size < offset
+                or _tail_digest(status_log_file, offset) !=
+                        checkpoint['tail_digest']):
+                tko_utils.dprint('! Status log changed since parse '
+                                 'checkpoint %s, ignoring it' % path)
+                return None
+        parser_state, tests = pickle.loads(checkpoint['parser_data'])
+    except Exception as e:
+        tko_utils.dprint('! Unable to load parse checkpoint %s: %s' %
+                         (path, e))
+        return None
+    return offset, parser_state, tests
+
+
+def remove(results_dir):
+    """Remove the checkpoint of a job, if any.
+
+    @param results_dir: The job results directory.
+    """
+    try:
+        os.remove(_checkpoint_path(results_dir))
+    except OSError:
+        pass
+
+
+def read_status_lines(status_log_file, offset=0):
+    """Read complete status lines from a status log in chunks.
+
+    A final line without a trailing newline is not returned, since the job may
+    still be writing it. The caller can read it with status_log_file.read()
+    once this generator is exhausted.
+
+    @param status_log_file: A file object open on the status log.
+    @param offset: Byte offset to start reading from.
+
+    @yields: Tuples (lines, end_offset), where lines is a list of at most
+             _CHUNK_LINES lines and end_offset is the byte offset just after
+             the last of them.
+    """
+    status_log_file.seek(offset)
+    chunk = []
+    while True:
+        line = status_log_file.readline()
+        if not line.endswith('\n'):
+            # Rewind over the partial line, if any.
+            status_log_file.seek(offset)
+            break
+        chunk.append(line)
+        offset += len(line)
+        if len(chunk) >= _CHUNK_LINES:
+            yield chunk, offset
+            chunk = []
+    if chunk:
+        yield chunk, offset
+
+
+def parse_status_log(parser, job, status_log, checkpoint=None):
+    """Stream a status log through the parser.
+
+    @param parser: A parser_lib parser instance.
+    @param job: The job model to parse the results into.
+    @param status_log: Path to the status log.
+    @param checkpoint: The (offset, parser_state, tests) tuple returned by
+                       load(), or None to parse the whole log.
+
+    @return: A tuple (tests, restored_tests, snapshot). tests is the list of
+             all tests produced, starting with restored_tests, the tests
+             restored from the checkpoint. snapshot is a Snapshot of the
+             parser state after the last complete line, or None if the
+             parser does not support checkpoints.
+    """
+    offset, resume_state, restored_tests = checkpoint or (0, None, [])
+    parser.start(job, resume_state=resume_state)
+    tests = list(restored_tests)
+    with open(status_log) as status_log_file:
+        tests.extend(parser.process_lines([]))
+        for lines, offset in read_status_lines(status_log_file, offset):
+            tests.extend(parser.process_lines(lines))
+        snapshot = None
+        if parser.checkpoint_state is not None:
+            snapshot = Snapshot(status_log, offset, parser.checkpoint_state,
+                                tests)
+        # Whatever is left is a partial line the job is still writing.
+        tests.extend(parser.end(status_log_file.readlines()))
+    return tests, restored_tests, snapshot
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+from autotest_lib.tko import parse_checkpoint
+from autotest_lib.tko.parsers import version_1
+
+
+_STATUS_LOG_HEAD = ('START\t----\t----\ttimestamp=100\n'
+                    '\tSTART\tsub1\ttest1\ttimestamp=101\n'
+                    '\t\tGOOD\tsub1\ttest1\ttimestamp=102\n'
+                    '\tEND GOOD\tsub1\ttest1\ttimestamp=103\n')
+_STATUS_LOG_TAIL = ('\tSTART\tsub2\ttest2\ttimestamp=104\n'
+                    '\t\tFAIL\tsub2\ttest2\ttimestamp=105\tbroken\n'
+                    '\tEND FAIL\tsub2\ttest2\ttimestamp=106\tbroken\n'
+                    'END GOOD\t----\t----\ttimestamp=107\n')
+
+
+class _FakeJob(object):
+    """The parts of a job model used by the version 1 parser."""
+
+    def __init__(self, results_dir):
+        self.dir = results_dir
+        self.machine = 'host1'
+        self.started_time = None
+        self.finished_time = None
+        self.aborted_by = None
+
+
+    def exit_status(self):
+        """Returns the job exit status."""
+        return 'GOOD'
+
+
+class ParseCheckpointTest(unittest.TestCase):
+    """Tests for incremental status log parsing."""
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        self.status_log = os.path.join(self.results_dir, 'status.log')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+
+    def _write_status_log(self, contents, mode='w'):
+        with open(self.status_log, mode) as f:
+            f.write(contents)
+
+
+    def _parse(self, checkpoint=None):
+        return parse_checkpoint.parse_status_log(
+                version_1.parser(), _FakeJob(self.results_dir),
+                self.status_log, checkpoint)
+
+
+    @staticmethod
+    def _summary(tests):
+        results = {}
+        for test in tests:
+            results[(test.testname, test.subdir)] = (test.status, test.reason)
+        return results
+
+
+    def test_read_status_lines_holds_back_partial_line(self):
+        """Test a partial last line is not returned."""
+        self._write_status_log('a\nb\nc')
+        with open(self.status_log) as f:
+            chunks = list(parse_checkpoint.read_status_lines(f))
+            self.assertEqual(chunks, [(['a\n', 'b\n'], 4)])
+            self.assertEqual(f.read(), 'c')
+
+
+    def test_read_status_lines_from_offset(self):
+        """Test reading starts at the given offset."""
+        self._write_status_log('a\nb\n')
+        with open(self.status_log) as f:
+            chunks = list(parse_checkpoint.read_status_lines(f, 2))
+        self.assertEqual(chunks, [(['b\n'], 4)])
+
+
+    def test_load_without_checkpoint(self):
+        """Test load() returns None when there is no checkpoint."""
+        self._write_status_log(_STATUS_LOG_HEAD)
+        self.assertIsNone(
+                parse_checkpoint.load(self.results_dir, self.status_log, 1))
+
+
+    def test_resume_matches_full_parse(self):
+        """Test resuming from a checkpoint gives the same tests."""
+        self._write_status_log(_STATUS_LOG_HEAD)
+        _, _, snapshot = self._parse()
+        parse_checkpoint.save(self.results_dir, 1, snapshot)
+
+        self._write_status_log(_STATUS_LOG_TAIL, mode='a')
+        checkpoint = parse_checkpoint.load(self.results_dir, self.status_log,
+                                           1)
+        self.assertIsNotNone(checkpoint)
+        self.assertEqual(checkpoint[0], len(_STATUS_LOG_HEAD))
+        resumed, restored, _ = self._parse(checkpoint)
+
+        full, _, _ = self._parse()
+        self.assertEqual(self._summary(resumed), self._summary(full))
+        new_tests = set(resumed[len(restored):])
+        self.assertNotIn(('test1', 'sub1'),
+                         [(t.testname, t.subdir) for t in new_tests])
+
+
+    def test_load_rejects_other_job(self):
+        """Test a checkpoint for another job_idx is ignored."""
+        self._write_status_log(_STATUS_LOG_HEAD)
+        _, _, snapshot = self._parse()
+        parse_checkpoint.save(self.results_dir, 1, snapshot)
+        self.assertIsNone(
+                parse_checkpoint.load(self.results_dir, self.status_log, 2))
+
+
+    def test_load_rejects_rewritten_log(self):
+        """Test a checkpoint is ignored when the log was rewritten."""
+        self._write_status_log(_STATUS_LOG_HEAD)
+        _, _, snapshot = self._parse()
+        parse_checkpoint.save(self.results_dir, 1, snapshot)
+        with open(self.status_log, 'r+') as f:
+            f.write('X')
+        self.assertIsNone(
+                parse_checkpoint.load(self.results_dir, self.status_log, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
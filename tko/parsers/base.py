@@ -9,12 +9,18 @@ class parser(object):
     standard parser interfaction functions. The derived classes must
     implement a state_iterator method for this class to be useful.
     """
-    def start(self, job):
+    def start(self, job, resume_state=None):
         """ Initialize the parser for processing the results of
-        'job'."""
+        'job'. If 'resume_state' is given, it must be a value of
+        checkpoint_state saved by an earlier parse of the same status
+        log, and parsing continues from that point."""
         # initialize all the basic parser parameters
         self.job = job
         self.finished = False
+        self.resume_state = resume_state
+        # Parsers that support checkpointing set this to a picklable
+        # snapshot of their state whenever the line buffer is drained.
+        self.checkpoint_state = None
         self.line_buffer = status_lib.line_buffer()
         # create and prime the parser state machine
         self.state = self.state_iterator(self.line_buffer)
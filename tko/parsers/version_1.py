@@ -317,6 +317,7 @@ class parser(base.parser):
         subdir_stack = [None]
         testname_stack = [None]
         running_test = None
+        running_client = None
         running_reasons = set()
         ignored_lines = []
         yield []   # We're ready to start running.
@@ -330,11 +331,20 @@ class parser(base.parser):
                 tko_utils.dprint(line)
             tko_utils.dprint('---------------------------------')
 
-        # Create a RUNNING SERVER_JOB entry to represent the entire test.
-        running_job = test.parse_partial_test(self.job, '----', 'SERVER_JOB',
-                                              '', current_kernel,
-                                              self.job.started_time)
-        new_tests.append(running_job)
+        if self.resume_state:
+            # Pick up where a previous parse of this log left off.
+            (line, job_count, boot_count, min_stack_size, stack,
+             current_kernel, current_status, current_reason,
+             started_time_stack, subdir_stack, testname_stack, running_test,
+             running_client, running_reasons,
+             running_job) = self.resume_state
+        else:
+            # Create a RUNNING SERVER_JOB entry to represent the entire test.
+            running_job = test.parse_partial_test(self.job, '----',
+                                                  'SERVER_JOB', '',
+                                                  current_kernel,
+                                                  self.job.started_time)
+            new_tests.append(running_job)
 
         while True:
             # Are we finished with parsing?
@@ -367,6 +377,12 @@ class parser(base.parser):
 
             # Stop processing once the buffer is empty.
             if buffer.size() == 0:
+                self.checkpoint_state = (
+                        line, job_count, boot_count, min_stack_size, stack,
+                        current_kernel, current_status, current_reason,
+                        started_time_stack, subdir_stack, testname_stack,
+                        running_test, running_client, running_reasons,
+                        running_job)
                 yield new_tests
                 new_tests = []
                 continue